@@ -1,9 +1,14 @@
+import argparse
 import logging
 import os
+import sqlite3
+import struct
 
-from math import ceil
 import rlp
+from trie import Trie
+from trie.db.base import BaseDB
 from trie.db.memory import MemoryDB
+from trie.utils.sha3 import keccak
 from rlp.sedes import big_endian_int, binary
 from abci import (
     ABCIServer,
@@ -21,6 +26,9 @@ logger = logging.getLogger(__name__)
 STATE_KEY = b'stateKey'
 KV_PAIR_PREFIX_KEY = b'kvPairKey'
 BLANK_ROOT_HASH = b''
+PROOF_OP_TYPE = "mpt"
+PREFIX_QUERY_PATH = "/prefix"
+TX_FORMAT_VERSION = 1
 
 
 def prefix_key(key):
@@ -29,6 +37,56 @@ def prefix_key(key):
     return KV_PAIR_PREFIX_KEY + key
 
 
+def decode_tx(tx):
+    """Takes a binary transaction and returns its (key, value) couples.
+
+    The transaction is a format version byte followed by the key and value of
+    each operation, both prefixed by their length (4 bytes, big endian). Keys
+    and values are returned as memoryviews on the transaction (no copy).
+
+    Raises:
+        ValueError: if the transaction is malformed
+    """
+    view = memoryview(tx)
+    if not view or view[0] != TX_FORMAT_VERSION:
+        raise ValueError("Unknown transaction format")
+    items = []
+    offset = 1
+    try:
+        while offset < len(view):
+            fields = []
+            for _ in range(2):
+                (size,) = struct.unpack_from("!I", view, offset)
+                offset += 4
+                if offset + size > len(view):
+                    raise ValueError("Truncated transaction")
+                fields.append(view[offset:offset + size])
+                offset += size
+            items.append(tuple(fields))
+    except struct.error as exc:
+        raise ValueError("Truncated transaction") from exc
+    if not items:
+        raise ValueError("Empty transaction")
+    return items
+
+
+def encode_items(items):
+    """Takes (key, value) couples and returns them framed the same way as in
+    a transaction (without the format version byte)
+    """
+    return b"".join(struct.pack("!I", len(x)) + x for item in items for x in item)
+
+
+def _prefix_upper_bound(prefix):
+    """Smallest byte string greater than every key starting with `prefix`
+    (None if there is none, i.e. the prefix only contains 0xff bytes)
+    """
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
 class stateMetaData(rlp.Serializable):
     fields = [
         ('size', big_endian_int),
@@ -40,6 +98,117 @@ class stateMetaData(rlp.Serializable):
         super().__init__(size, height, apphash)
 
 
+class SqliteDB(BaseDB):
+    """
+    Disk backed store for the trie nodes and the state metadata.
+
+    Writes are only made durable by `commit` (i.e. once per block), so a crash
+    never leaves a partially applied block behind.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key BLOB PRIMARY KEY, value BLOB NOT NULL)")
+        # The trie cannot be iterated in key order, hence the application keys
+        # are also kept in this (sorted) index for the prefix queries
+        self._conn.execute("CREATE TABLE IF NOT EXISTS app_keys (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.commit()
+
+    def get(self, key):
+        row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def set(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, value))
+
+    def exists(self, key):
+        return self._conn.execute("SELECT 1 FROM kv WHERE key = ?", (key,)).fetchone() is not None
+
+    def delete(self, key):
+        self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    #
+    # Application keys index
+    #
+    def index_keys(self, added, removed):
+        self._conn.executemany("INSERT OR IGNORE INTO app_keys (key) VALUES (?)", ((k,) for k in added))
+        self._conn.executemany("DELETE FROM app_keys WHERE key = ?", ((k,) for k in removed))
+
+    def iter_prefix(self, prefix):
+        """Application keys starting with `prefix`, in order (range scan on the index)
+        """
+        upper = _prefix_upper_bound(prefix)
+        if upper is None:
+            cursor = self._conn.execute("SELECT key FROM app_keys WHERE key >= ? ORDER BY key", (prefix,))
+        else:
+            cursor = self._conn.execute(
+                "SELECT key FROM app_keys WHERE key >= ? AND key < ? ORDER BY key", (prefix, upper)
+            )
+        for (key,) in cursor:
+            yield key
+
+    #
+    # Snapshot API
+    #
+    def snapshot(self, path):
+        """Copy the committed state to `path` (consistent even while writing)
+        """
+        dest = sqlite3.connect(path)
+        try:
+            self._conn.backup(dest)
+        finally:
+            dest.close()
+        return path
+
+    def revert(self, path):
+        """Replace the whole store by the snapshot stored at `path`
+        """
+        src = sqlite3.connect(path)
+        try:
+            src.backup(self._conn)
+        finally:
+            src.close()
+
+
+class _RecordingDB(BaseDB):
+    """
+    Read-only view keeping track of the trie nodes read, looking up a key
+    this way gives the nodes on the path from the root (i.e. the proof).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.nodes = []
+
+    def get(self, key):
+        node = self.db.get(key)
+        self.nodes.append(node)
+        return node
+
+
+def verify_proof(app_hash, key, value, proof):
+    """Check the value of a key against an app hash given the proof nodes
+    returned by `query` (an absent key is proven with value b'')
+    """
+    db = MemoryDB()
+    for node in proof:
+        db.set(keccak(node), node)
+    try:
+        return Trie(db, app_hash).get(prefix_key(key)) == value
+    except KeyError:
+        # Node missing from the proof
+        return False
+
+
 class State(object):
     """
     Talks directly to cold storage and the merkle
@@ -51,83 +220,163 @@ class State(object):
         self.size = size
         self.height = height
         self.apphash = apphash
+        # Key/value pairs are stored in a Merkle Patricia trie, its root hash
+        # is the app hash committed in each block
+        self.trie = Trie(db, apphash or Trie.BLANK_NODE_HASH)
+        # Keys added (True) or removed (False) by the block in progress, the
+        # index is only updated on commit so it matches the committed trie
+        self.pending_keys = {}
 
     @classmethod
     def load_state(cls, dbfile=None):
         """ Create or load State.
         returns: State
         """
-        if not dbfile:
-            return (cls(MemoryDB(), 0, 0, BLANK_ROOT_HASH))
+        return cls._load_from_db(SqliteDB(dbfile or ":memory:"))
+
+    @classmethod
+    def restore(cls, snapshot, dbfile=None):
+        """ Replace State by a snapshot taken with `snapshot`.
+        returns: State
+        """
+        db = SqliteDB(dbfile or ":memory:")
+        db.revert(snapshot)
+        return cls._load_from_db(db)
+
+    @classmethod
+    def _load_from_db(cls, db):
+        if not db.exists(STATE_KEY):
+            return cls(db, 0, 0, BLANK_ROOT_HASH)
+        meta = rlp.decode(db.get(STATE_KEY), sedes=stateMetaData)
+        return cls(db, meta.size, meta.height, meta.apphash)
+
+    def snapshot(self, path):
+        return self.db.snapshot(path)
 
     def save(self):
         # Save to storage
+        added = [k for k, present in self.pending_keys.items() if present]
+        removed = [k for k, present in self.pending_keys.items() if not present]
+        self.db.index_keys(added, removed)
+        self.pending_keys = {}
         meta = stateMetaData(self.size, self.height, self.apphash)
         serial = rlp.encode(meta, sedes=stateMetaData)
         self.db.set(STATE_KEY, serial)
+        self.db.commit()
         return self.apphash
 
 
 class MetadataBlockchain(BaseApplication):
 
-    def __init__(self):
-        self.state = State.load_state()
+    def __init__(self, state=None, snapshot_dir=None, snapshot_interval=0):
+        self.state = state or State.load_state()
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
 
     def info(self, req):
         """
-        Since this will always respond with height=0, Tendermint
-        will resync this app from the begining
+        Report the last committed height and app hash, so Tendermint only
+        replays the blocks committed since then
         """
         r = ResponseInfo()
         r.version = "1.0"
         r.last_block_height = self.state.height
-        r.last_block_app_hash = b''
+        r.last_block_app_hash = self.state.apphash
         return r
 
     def deliver_tx(self, tx):
         """Validate the transaction before mutating the state.
 
+        A transaction contains one or more key/value couples (see `decode_tx`),
+        this allows to publish all the checkpoints of an epoch at once. An
+        empty value deletes the key.
+
         Args:
-            raw_tx: a raw string (in bytes) transaction.
+            raw_tx: a raw binary transaction.
         """
-        parts = tx.split(b'&')
-        key, value = parts[0], parts[1]
-        key_content = key.split(b'?')[1]
-        value_content = value.split(b'?')[1]
+        try:
+            items = decode_tx(tx)
+        except ValueError as exc:
+            return ResponseDeliverTx(code=1, log=f"Malformed transaction: {exc}")
         logger.info("Transaction received")
-        logger.info("%s <-> %s", key_content, value_content)
-        self.state.db.set(prefix_key(key_content), value_content)
-        self.state.size += 1
+        for key, value in items:
+            key, value = key.tobytes(), value.tobytes()
+            logger.info("%s <-> %s", key, value)
+            if value:
+                self.state.trie.set(prefix_key(key), value)
+            else:
+                self.state.trie.delete(prefix_key(key))
+            self.state.pending_keys[key] = bool(value)
+            self.state.size += 1
         logger.info("Transaction successfully delivered")
         return ResponseDeliverTx(code=CodeTypeOk)
 
     def check_tx(self, tx):
+        # Malformed transactions never reach the mempool
+        try:
+            decode_tx(tx)
+        except ValueError as exc:
+            return ResponseCheckTx(code=1, log=f"Malformed transaction: {exc}")
         return ResponseCheckTx(code=CodeTypeOk)
 
     def commit(self):
-        byte_length = max(ceil(self.state.size.bit_length() / 8), 1)
-        app_hash = self.state.size.to_bytes(byte_length, byteorder='big')
-        self.state.app_hash = app_hash
+        app_hash = self.state.trie.root_hash
+        self.state.apphash = app_hash
         self.state.height += 1
         self.state.save()
+        if self.snapshot_dir and self.snapshot_interval and self.state.height % self.snapshot_interval == 0:
+            path = os.path.join(self.snapshot_dir, f"{self.state.height}.sqlite")
+            self.state.snapshot(path)
+            logger.info("Snapshot of height %s saved to %s", self.state.height, path)
         return ResponseCommit(data=app_hash)
 
     def query(self, req):
+        """
+        Missing keys are reported with value `0`. If requested, the proof
+        contains the trie nodes from the app hash of the last block to the
+        key (see `verify_proof`).
+
+        With the `/prefix` path, the value contains all the key/value couples
+        whose key starts with the data, in key order (see `encode_items`).
+        """
         logger.info("Query received")
-        if self.state.db.exists(prefix_key(req.data)):
-            value = self.state.db.get(prefix_key(req.data))
-            logger.info("%s <-> %s", req.data, value)
-            logger.info("Query successfully delivered")
-            return ResponseQuery(code=CodeTypeOk, value=value)
-        else:
-            if not self.state.db.exists(prefix_key(b'0')):
-                self.state.db.set(prefix_key(b'0'), b'0')
-            value = self.state.db.get(prefix_key(b'0'))
-            logger.info("%s <-> %s", req.data, value)
-            logger.info("Query successfully delivered")
-            return ResponseQuery(code=CodeTypeOk, value=value)
+        if req.path == PREFIX_QUERY_PATH:
+            return self._query_prefix(req)
+        recording_db = _RecordingDB(self.state.db)
+        # Query the committed state, not the one of the block in progress
+        value = Trie(recording_db, self.state.apphash or Trie.BLANK_NODE_HASH).get(prefix_key(req.data))
+        response = ResponseQuery(code=CodeTypeOk, key=req.data, value=value or b'0', height=self.state.height)
+        if req.prove:
+            op = response.proof.ops.add()
+            op.type = PROOF_OP_TYPE
+            op.key = req.data
+            op.data = rlp.encode(recording_db.nodes)
+        logger.info("%s <-> %s", req.data, response.value)
+        logger.info("Query successfully delivered")
+        return response
+
+    def _query_prefix(self, req):
+        trie = Trie(self.state.db, self.state.apphash or Trie.BLANK_NODE_HASH)
+        items = [(key, trie.get(prefix_key(key))) for key in self.state.db.iter_prefix(req.data)]
+        logger.info("%s keys with prefix %s", len(items), req.data)
+        return ResponseQuery(code=CodeTypeOk, key=req.data, value=encode_items(items), height=self.state.height)
 
 
 if __name__ == '__main__':
-    app = ABCIServer(app=MetadataBlockchain())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=os.environ.get("ABCI_STATE_DB", "abci_state.db"),
+                        help="state database (`:memory:` to keep it in memory)")
+    parser.add_argument("--restore", metavar="SNAPSHOT", help="restore the state from a snapshot")
+    parser.add_argument("--snapshot-dir", help="directory where the periodic snapshots are saved")
+    parser.add_argument("--snapshot-interval", type=int, default=0, help="blocks between two snapshots")
+    args = parser.parse_args()
+
+    if args.restore:
+        state = State.restore(args.restore, args.db)
+    else:
+        state = State.load_state(args.db)
+    logger.info("State loaded at height %s", state.height)
+    if args.snapshot_dir:
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+    app = ABCIServer(app=MetadataBlockchain(state, args.snapshot_dir, args.snapshot_interval))
     app.run()
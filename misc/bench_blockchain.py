@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+"""
+Benchmark of the vlob operations of the memory and blockchain backends.
+
+The backend components are run in-process against `abci_server.MetadataBlockchain`
+and the Tendermint RPC endpoint is replaced by a stand-in committing each
+transaction in its own block, so neither a Tendermint node nor an ABCI
+server is needed.
+
+For each backend and each phase (create, read, update) are reported the
+throughput, the p50/p99 latencies, the transactions sent, their size and
+the growth of the chain (number of key writes in the application state).
+
+    $ python misc/bench_blockchain.py --vlobs 100 --reads 5 --updates 5
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+from uuid import uuid4
+from pathlib import Path
+from types import SimpleNamespace
+
+import trio
+import pendulum
+from async_generator import asynccontextmanager
+
+# The ABCI application logs each transaction and query by default
+os.environ.setdefault("LOGLEVEL", "WARNING")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import abci_server  # noqa: E402
+
+# The core must be imported before the backend to avoid a circular import
+import parsec.core  # noqa: E402,F401
+from parsec.api.protocol import OrganizationID, DeviceID, RealmRole  # noqa: E402
+from parsec.event_bus import EventBus  # noqa: E402
+from parsec.logging import configure_logging  # noqa: E402
+from parsec.backend.config import BackendConfig, MockedBlockStoreConfig  # noqa: E402
+from parsec.backend.realm import RealmGrantedRole  # noqa: E402
+from parsec.backend.tendermint import tendermint_client  # noqa: E402
+from parsec.backend.memory.factory import (  # noqa: E402
+    components_factory as memory_components_factory,
+)
+from parsec.backend.blockchain.factory import (  # noqa: E402
+    components_factory as blockchain_components_factory,
+)
+
+
+BACKENDS = {"memory": memory_components_factory, "blockchain": blockchain_components_factory}
+ORGANIZATION_ID = OrganizationID("BenchOrg")
+AUTHOR = DeviceID("alice@dev1")
+
+
+class TendermintStandIn:
+    """
+    In-process implementation of the Tendermint RPC methods used by the
+    backend, on top of the ABCI application.
+
+    Each transaction is checked, delivered and committed in a block of its
+    own, `block_time` simulating the time spent by Tendermint to commit it.
+    """
+
+    def __init__(self, block_time: float = 0):
+        self.app = abci_server.MetadataBlockchain()
+        self.block_time = block_time
+        self.height = 0
+        self.txs = {}
+        self.tx_count = 0
+        self.tx_bytes = 0
+        self.query_count = 0
+
+    @property
+    def chain_size(self) -> int:
+        # Number of key writes (including deletions) since the genesis
+        return self.app.state.size
+
+    @asynccontextmanager
+    async def installed(self, client=tendermint_client):
+        # The client's connection pool is bypassed, everything else (JSON-RPC
+        # encoding, timeouts, error handling) is kept
+        client._do_request = self._do_request
+        try:
+            yield self
+        finally:
+            del client._do_request
+
+    async def _do_request(self, body: bytes, force_fresh: bool) -> bytes:
+        req = json.loads(body)
+        try:
+            rep = {"result": await self._dispatch(req["method"], req["params"])}
+        except LookupError as exc:
+            rep = {"error": {"code": -32603, "message": "Internal error", "data": str(exc)}}
+        rep.update(jsonrpc="2.0", id=req["id"])
+        return json.dumps(rep).encode()
+
+    async def _dispatch(self, method: str, params: dict) -> dict:
+        await trio.sleep(0)
+        if method == "abci_query":
+            self.query_count += 1
+            query = SimpleNamespace(
+                data=bytes.fromhex(params["data"]), path=params.get("path", ""), prove=False
+            )
+            rep = self.app.query(query)
+            return {
+                "response": {
+                    "code": rep.code,
+                    "key": base64.b64encode(rep.key).decode(),
+                    "value": base64.b64encode(rep.value).decode(),
+                    "height": str(rep.height),
+                }
+            }
+
+        elif method in ("broadcast_tx_commit", "broadcast_tx_sync", "broadcast_tx_async"):
+            tx = base64.b64decode(params["tx"])
+            check_tx = self.app.check_tx(tx)
+            tx_hash = hashlib.sha256(tx).hexdigest().upper()
+            if check_tx.code != 0:
+                return {"code": check_tx.code, "log": check_tx.log, "hash": tx_hash}
+            if method == "broadcast_tx_commit":
+                deliver_tx = await self._commit(tx, tx_hash)
+                return {
+                    "check_tx": {"code": check_tx.code},
+                    "deliver_tx": deliver_tx,
+                    "hash": tx_hash,
+                    "height": str(self.height),
+                }
+            else:
+                # The block is committed in the background, as Tendermint does
+                trio.lowlevel.spawn_system_task(self._commit, tx, tx_hash)
+                return {"code": check_tx.code, "log": "", "data": "", "hash": tx_hash}
+
+        elif method == "tx":
+            tx_hash = base64.b64decode(params["hash"]).hex().upper()
+            return self.txs[tx_hash]
+
+        elif method == "status":
+            return {"sync_info": {"latest_block_height": str(self.height)}}
+
+        elif method == "blockchain":
+            heights = range(int(params["minHeight"]), int(params["maxHeight"]) + 1)
+            return {
+                "block_metas": [{"header": {"height": str(h)}, "num_txs": "1"} for h in heights]
+            }
+
+        else:
+            raise LookupError(f"Method `{method}` not found")
+
+    async def _commit(self, tx: bytes, tx_hash: str) -> dict:
+        if self.block_time:
+            await trio.sleep(self.block_time)
+        self.tx_count += 1
+        self.tx_bytes += len(tx)
+        deliver_tx = self.app.deliver_tx(tx)
+        self.app.commit()
+        self.height += 1
+        result = {"code": deliver_tx.code, "log": deliver_tx.log}
+        self.txs[tx_hash] = {"hash": tx_hash, "height": str(self.height), "tx_result": result}
+        return result
+
+
+class PhaseStats:
+    def __init__(self, backend: str, phase: str, tendermint: TendermintStandIn):
+        self.backend = backend
+        self.phase = phase
+        self.tendermint = tendermint
+        self.latencies = []
+
+    async def __aenter__(self):
+        self._start = time.perf_counter()
+        self._tx_count = self.tendermint.tx_count
+        self._tx_bytes = self.tendermint.tx_bytes
+        self._chain_size = self.tendermint.chain_size
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.duration = time.perf_counter() - self._start
+        self.tx_count = self.tendermint.tx_count - self._tx_count
+        self.tx_bytes = self.tendermint.tx_bytes - self._tx_bytes
+        self.chain_growth = self.tendermint.chain_size - self._chain_size
+
+    async def measure(self, coro):
+        start = time.perf_counter()
+        await coro
+        self.latencies.append(time.perf_counter() - start)
+
+    def percentile(self, percent: float) -> float:
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percent / 100))
+        return latencies[index]
+
+    def row(self) -> tuple:
+        ops = len(self.latencies)
+        return (
+            self.backend,
+            self.phase,
+            ops,
+            f"{ops / self.duration:.1f}",
+            f"{self.percentile(50) * 1000:.2f}",
+            f"{self.percentile(99) * 1000:.2f}",
+            f"{self.tx_count / ops:.2f}",
+            f"{self.tx_bytes / self.tx_count:.0f}" if self.tx_count else "-",
+            f"{self.chain_growth / ops:.2f}",
+        )
+
+
+HEADERS = ("backend", "phase", "ops", "ops/s", "p50 ms", "p99 ms", "txs/op", "B/tx", "keys/op")
+
+
+def print_table(rows):
+    rows = [HEADERS, *rows]
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(HEADERS))]
+    for row in rows:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def make_config(args) -> BackendConfig:
+    return BackendConfig(
+        administration_token="s3cr3t",
+        db_url=args.backend.upper(),
+        db_min_connections=1,
+        db_max_connections=5,
+        blockstore_config=MockedBlockStoreConfig(),
+        email_config=None,
+        ssl_context=False,
+        forward_proto_enforce_https=None,
+        backend_addr=None,
+        spontaneous_organization_bootstrap=False,
+        organization_bootstrap_webhook_url=None,
+        debug=False,
+        epoch_max_operations=args.epoch_max_operations,
+    )
+
+
+async def bench_backend(backend: str, args) -> list:
+    tendermint = TendermintStandIn(block_time=args.block_time)
+    config = make_config(SimpleNamespace(**vars(args), backend=backend))
+    blob = os.urandom(args.blob_size)
+    realm_id = uuid4()
+    vlob_ids = [uuid4() for _ in range(args.vlobs)]
+    # Only the memory backend keeps the signed operation log
+    signed = {"signature": b"<signature>"} if backend == "memory" else {}
+    results = []
+
+    async with tendermint.installed():
+        async with BACKENDS[backend](config, EventBus()) as components:
+            vlob = components["vlob"]
+            await components["realm"].create(
+                ORGANIZATION_ID,
+                RealmGrantedRole(
+                    certificate=b"<certificate>",
+                    realm_id=realm_id,
+                    user_id=AUTHOR.user_id,
+                    role=RealmRole.OWNER,
+                    granted_by=AUTHOR,
+                ),
+            )
+
+            async with PhaseStats(backend, "create", tendermint) as stats:
+                for vlob_id in vlob_ids:
+                    await stats.measure(
+                        vlob.create(
+                            ORGANIZATION_ID,
+                            AUTHOR,
+                            realm_id=realm_id,
+                            encryption_revision=1,
+                            vlob_id=vlob_id,
+                            timestamp=pendulum.now(),
+                            blob=blob,
+                            **signed,
+                        )
+                    )
+            results.append(stats)
+
+            async with PhaseStats(backend, "read", tendermint) as stats:
+                for _ in range(args.reads):
+                    for vlob_id in vlob_ids:
+                        await stats.measure(
+                            vlob.read(
+                                ORGANIZATION_ID,
+                                AUTHOR,
+                                encryption_revision=1,
+                                vlob_id=vlob_id,
+                                **signed,
+                            )
+                        )
+            results.append(stats)
+
+            async with PhaseStats(backend, "update", tendermint) as stats:
+                for version in range(2, args.updates + 2):
+                    for vlob_id in vlob_ids:
+                        await stats.measure(
+                            vlob.update(
+                                ORGANIZATION_ID,
+                                AUTHOR,
+                                encryption_revision=1,
+                                vlob_id=vlob_id,
+                                version=version,
+                                timestamp=pendulum.now(),
+                                blob=blob,
+                                **signed,
+                            )
+                        )
+            results.append(stats)
+
+    return [stats for stats in results if stats.latencies]
+
+
+async def main(args):
+    rows = []
+    for backend in args.backends:
+        rows += [stats.row() for stats in await bench_backend(backend, args)]
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the vlob operations against an in-process blockchain"
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=sorted(BACKENDS), default=["memory", "blockchain"]
+    )
+    parser.add_argument("--vlobs", type=int, default=50, help="Number of vlobs created")
+    parser.add_argument("--reads", type=int, default=5, help="Reads of each vlob")
+    parser.add_argument("--updates", type=int, default=5, help="Updates of each vlob")
+    parser.add_argument("--blob-size", type=int, default=1024, help="Size of the vlob blobs")
+    parser.add_argument(
+        "--block-time", type=float, default=0, help="Simulated block commit time (in seconds)"
+    )
+    parser.add_argument(
+        "--epoch-max-operations",
+        type=int,
+        default=None,
+        help="Close the epoch after this number of operations (disabled by default)",
+    )
+    args = parser.parse_args()
+    configure_logging(log_level="WARNING")
+    trio.run(main, args)
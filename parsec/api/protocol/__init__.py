@@ -116,6 +116,7 @@ from parsec.api.protocol.vlob import (
     vlob_history_serializer,
     vlob_maintenance_get_reencryption_batch_serializer,
     vlob_maintenance_save_reencryption_batch_serializer,
+    VLOB_HISTORY_MAX_PAGE_SIZE,
 )
 from parsec.api.protocol.cmds import (
     AUTHENTICATED_CMDS,
@@ -235,6 +236,7 @@ __all__ = (
     "vlob_history_serializer",
     "vlob_maintenance_get_reencryption_batch_serializer",
     "vlob_maintenance_save_reencryption_batch_serializer",
+    "VLOB_HISTORY_MAX_PAGE_SIZE",
     # Block
     "block_create_serializer",
     "block_read_serializer",
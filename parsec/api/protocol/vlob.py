@@ -14,11 +14,14 @@ __all__ = (
     "vlob_history_serializer",
     "vlob_maintenance_get_reencryption_batch_serializer",
     "vlob_maintenance_save_reencryption_batch_serializer",
+    "VLOB_HISTORY_MAX_PAGE_SIZE",
 )
 
 
 _validate_version = validate.Range(min=1)
 
+VLOB_HISTORY_MAX_PAGE_SIZE = 1000
+
 
 class VlobCreateReqSchema(BaseReqSchema):
     realm_id = fields.UUID(required=True)
@@ -105,6 +108,15 @@ class VlobListVersionsRepSchema(BaseRepSchema):
 vlob_list_versions_serializer = CmdSerializer(VlobListVersionsReqSchema, VlobListVersionsRepSchema)
 
 
+class AggregatedReadSchema(BaseSchema):
+    index = fields.Integer(required=True)
+    author = DeviceIDField(required=True)
+    timestamp = fields.DateTime(required=True, allow_none=True)
+    signature = fields.Bytes(required=True)
+    # Inclusion proof in the Merkle tree of the aggregated reads
+    proof = fields.List(fields.Tuple(fields.String(), fields.Boolean()), required=True)
+
+
 class HistoryEntrySchema(BaseSchema):
     version = fields.Integer(required=True)
     author = DeviceIDField(required=True)
@@ -113,16 +125,45 @@ class HistoryEntrySchema(BaseSchema):
     hash_prev_digest = fields.String(required=True)
     signature = fields.Bytes(required=True)
     is_read_op = fields.Boolean(required=True)
+    # Only for consecutive reads of a version aggregated in a single entry, of
+    # which the signature is the root of the Merkle tree over the reads: number
+    # of reads and the ones made by the requesting device
+    reads_count = fields.Integer()
+    reads = fields.List(fields.Nested(AggregatedReadSchema))
+
+
+class VlobCheckpointSchema(BaseSchema):
+    epoch = fields.Integer(required=True)
+    hash = fields.String(required=True)
+    version = fields.Integer(required=True)
+    # Siblings from the leaf to the root of the epoch Merkle tree,
+    # each one with a flag telling if it is the left node
+    proof = fields.List(fields.Tuple(fields.String(), fields.Boolean()), required=True)
 
 
 class VlobHistoryReqSchema(BaseReqSchema):
     vlob_id = fields.UUID(required=True)
     after_version = fields.Integer(required=True)
-    before_version = fields.Integer(required=True)
+    # None means no upper bound (or up to the checkpoint if requested)
+    before_version = fields.Integer(required=True, allow_none=True)
+    checkpoint = fields.Boolean(missing=False)
+    # Latest checkpoint at or before this epoch, None for the latest one
+    checkpoint_epoch = fields.Integer(missing=None, allow_none=True)
+    # Pagination: `cursor` is the `next_cursor` returned with the previous page,
+    # no `page_size` means the whole history in a single reply
+    cursor = fields.Integer(missing=None, allow_none=True, validate=validate.Range(min=0))
+    page_size = fields.Integer(
+        missing=None,
+        allow_none=True,
+        validate=validate.Range(min=1, max=VLOB_HISTORY_MAX_PAGE_SIZE),
+    )
 
 
 class VlobHistoryRepSchema(BaseRepSchema):
     history = fields.List(fields.Nested(HistoryEntrySchema), required=True)
+    checkpoint = fields.Nested(VlobCheckpointSchema, allow_none=True)
+    # Only provided if `page_size` was requested, None on the last page
+    next_cursor = fields.Integer(allow_none=True)
 
 
 vlob_history_serializer = CmdSerializer(VlobHistoryReqSchema, VlobHistoryRepSchema)
@@ -77,6 +77,7 @@ async def backend_app_factory(config: BackendConfig, event_bus: Optional[EventBu
             blockstore=components["blockstore"],
             block=components["block"],
             events=components["events"],
+            epoch=components["epoch"],
         )
 
 
@@ -97,6 +98,7 @@ class BackendApp:
         blockstore,
         block,
         events,
+        epoch,
     ):
         self.config = config
         self.event_bus = event_bus
@@ -113,6 +115,7 @@ class BackendApp:
         self.blockstore = blockstore
         self.block = block
         self.events = events
+        self.epoch = epoch
 
         self.apis = collect_apis(
             user, invite, organization, message, realm, vlob, ping, blockstore, block, events
@@ -1,10 +1,13 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
 
 from uuid import UUID
+from typing import Optional
 import attr
+from structlog import get_logger
 
 from parsec.api.protocol import DeviceID, OrganizationID
 from parsec.api.protocol import RealmRole
+from parsec.crypto import HashDigest
 from parsec.backend.realm import BaseRealmComponent, RealmNotFoundError
 from parsec.backend.blockstore import BaseBlockStoreComponent
 from parsec.backend.block import (
@@ -14,42 +17,41 @@ from parsec.backend.block import (
     BlockNotFoundError,
     BlockInMaintenanceError,
 )
+from parsec.backend.memory.block import MemoryBlockStoreComponent
 
 
-import requests
-import base64
 import json
 from json import JSONEncoder, JSONDecoder
 
+from parsec.backend.tendermint import tendermint_client
+from parsec.backend.blockchain.cache import blockchain_cache
+from parsec.backend.blockchain.pipeline import write_pipeline
 
-abci_addr = 'http://localhost:26657/'
+
+logger = get_logger()
 
 
 @attr.s(auto_attribs=True)
 class BlockMeta:
     realm_id: UUID
     size: int
+    # Digest of the block's ciphertext
+    digest: HashDigest
 
-"""
-In order to store block in tendermint, we could use the following Encoder/Decoder for  BlockMeta and Block.
 
 class BlockMetaDecoder(JSONDecoder):
-    def decode(self, obj):
+    def decode(self, obj, **kwargs):
         json_obj = json.loads(obj)
-        return BlockMeta(UUID(json_obj['realm_id']), int(json_obj['size']))
+        return BlockMeta(
+            UUID(json_obj['realm_id']), int(json_obj['size']), HashDigest(bytes.fromhex(json_obj['digest']))
+        )
 
-class BlockDecoder(JSONDecoder):
-    def decode(self, obj):
-        json_obj = json.loads(obj)
-        return base64.b64decode(json_obj['blob'].replace(' ', '+'))
 
 class Encoder(JSONEncoder):
     def default(self, obj):
         if isinstance(obj, BlockMeta):
-            return {'realm_id': obj.realm_id.__str__(), 'size': obj.size.__str__()}
-        if isinstance(obj, bytes):
-            return {'blob': base64.b64encode(obj).decode('utf-8')}
-"""
+            return {'realm_id': obj.realm_id.__str__(), 'size': obj.size.__str__(), 'digest': obj.digest.hex()}
+
 
 class BlockchainBlockComponent(BaseBlockComponent):
     def __init__(self):
@@ -63,22 +65,22 @@ class BlockchainBlockComponent(BaseBlockComponent):
         self._blockstore_component = blockstore
         self._realm_component = realm
 
-    def _check_realm_read_access(self, organization_id, realm_id, user_id):
+    async def _check_realm_read_access(self, organization_id, realm_id, user_id):
         can_read_roles = (
             RealmRole.OWNER,
             RealmRole.MANAGER,
             RealmRole.CONTRIBUTOR,
             RealmRole.READER,
         )
-        self._check_realm_access(organization_id, realm_id, user_id, can_read_roles)
+        await self._check_realm_access(organization_id, realm_id, user_id, can_read_roles)
 
-    def _check_realm_write_access(self, organization_id, realm_id, user_id):
+    async def _check_realm_write_access(self, organization_id, realm_id, user_id):
         can_write_roles = (RealmRole.OWNER, RealmRole.MANAGER, RealmRole.CONTRIBUTOR)
-        self._check_realm_access(organization_id, realm_id, user_id, can_write_roles)
+        await self._check_realm_access(organization_id, realm_id, user_id, can_write_roles)
 
-    def _check_realm_access(self, organization_id, realm_id, user_id, allowed_roles):
+    async def _check_realm_access(self, organization_id, realm_id, user_id, allowed_roles):
         try:
-            realm = self._realm_component._get_realm(organization_id, realm_id)
+            realm = await self._realm_component._get_realm(organization_id, realm_id)
         except RealmNotFoundError:
             raise BlockNotFoundError(f"Realm `{realm_id}` doesn't exist")
         if realm.roles.get(user_id) not in allowed_roles:
@@ -90,19 +92,20 @@ class BlockchainBlockComponent(BaseBlockComponent):
     async def read(
         self, organization_id: OrganizationID, author: DeviceID, block_id: UUID
     ) -> bytes:
-        try:
-            blockmeta = self._blockmetas[(organization_id, block_id)]
-        except KeyError:
+        blockmeta = await self._get_blockmeta(organization_id, block_id)
+        if blockmeta is None:
             raise BlockNotFoundError()
-        """
-        if meta_block_exists(organization_id, block_id):
-            return BlockNotFoundError()
-        else:
-            blockmeta = retrieve_block_meta(organization_id, block_id)
-        """
-        self._check_realm_read_access(organization_id, blockmeta.realm_id, author.user_id)
-
-        return await self._blockstore_component.read(organization_id, block_id)
+        await self._check_realm_read_access(organization_id, blockmeta.realm_id, author.user_id)
+
+        block = await self._blockstore_component.read(organization_id, block_id)
+        if HashDigest.from_data(block) != blockmeta.digest:
+            logger.error(
+                "Block doesn't match its anchored digest",
+                organization_id=organization_id,
+                block_id=block_id,
+            )
+            raise BlockNotFoundError()
+        return block
 
     async def create(
         self,
@@ -112,79 +115,65 @@ class BlockchainBlockComponent(BaseBlockComponent):
         realm_id: UUID,
         block: bytes,
     ) -> None:
-        self._check_realm_write_access(organization_id, realm_id, author.user_id)
+        await self._check_realm_write_access(organization_id, realm_id, author.user_id)
 
-        await self._blockstore_component.create(organization_id, block_id, block)
+        if await self._get_blockmeta(organization_id, block_id) is not None:
+            raise BlockAlreadyExistsError()
 
-        self._blockmetas[(organization_id, block_id)] = BlockMeta(realm_id, len(block))
-        """
+        blockmeta = BlockMeta(realm_id, len(block), HashDigest.from_data(block))
+        try:
+            await self._blockstore_component.create(organization_id, block_id, block)
+        except BlockAlreadyExistsError:
+            # Stored by a previous attempt that failed before the anchoring
+            stored = await self._blockstore_component.read(organization_id, block_id)
+            if HashDigest.from_data(stored) != blockmeta.digest:
+                raise
+
+        # Only the digest and size of the block are written on chain
         key = create_key_block_meta(organization_id, block_id)
-        broadcast_tx(key, json.dumps(BlockMeta(realm_id, len(block)), cls=Encoder))
-        """
-
-class BlockchainBlockStoreComponent(BaseBlockStoreComponent):
-    def __init__(self):
-        self._blocks = {}
+        await write_pipeline.submit(tendermint_client, [(key, json.dumps(blockmeta, cls=Encoder))])
+        self._blockmetas[(organization_id, block_id)] = blockmeta
 
-    async def read(self, organization_id: OrganizationID, block_id: UUID) -> bytes:
+    async def _get_blockmeta(self, organization_id, block_id) -> Optional[BlockMeta]:
         try:
-            return self._blocks[(organization_id, block_id)]
+            return self._blockmetas[(organization_id, block_id)]
         except KeyError:
-            raise BlockNotFoundError()
-        """
-        if block_exists(organization_id, block_id):
-            raise BlockNotFoundError()
-        else:
-            return retrieve_block(organization_id, block_id)
-        """
-
-    async def create(self, organization_id: OrganizationID, block_id: UUID, block: bytes) -> None:
+            # Block created before the backend started
+            return await retrieve_block_meta(organization_id, block_id)
 
-        key = (organization_id, block_id)
-        if key in self._blocks:
-            # Should not happen if client play with uuid randomness
-            raise BlockAlreadyExistsError()
+class BlockchainBlockStoreComponent(MemoryBlockStoreComponent):
+    """
+    Blocks are kept off chain (see `MemoryBlockStoreComponent`), only their
+    `BlockMeta` is anchored by `BlockchainBlockComponent`, so the chain size
+    doesn't depend on the data volume.
+    """
 
-        self._blocks[key] = block
-        """
-        if block_exists(organization_id, block_id):
-            raise BlockAlreadyExistsError()
-        else:
-            key = create_key_block(organization_id, block_id)
-            broadcast_tx(key, json.dumps(block, cls=Encoder))
-        """
 
 def create_key_block_meta(organization_id: OrganizationID, block_id: UUID):
     return '(block_meta, ' + organization_id.__str__() + ', ' + block_id.__str__() + ')'
 
-def create_key_block(organization_id: OrganizationID, block_id: UUID):
-    return '(block, ' + organization_id.__str__() + ', ' + block_id.__str__() + ')'
 
-def retrieve_block_meta(organization_id: OrganizationID, block_id: UUID):
+def create_prefix_block_meta():
+    return '(block_meta, '
+
+
+async def retrieve_block_meta(organization_id: OrganizationID, block_id: UUID):
     key = create_key_block_meta(organization_id, block_id)
-    raw_rep = retrieve_tx(key)
-    return BlockMetaDecoder().decode(raw_rep, )
-
-def retrieve_tx(key):
-    cmd = abci_addr + 'abci_query?data="' + key + '"'
-    req = requests.get(cmd)
-    raw_rep = req.json()
-    raw_rep = base64.b64decode(raw_rep['result']['response']['value']).decode('utf-8')
-    return raw_rep.replace('\'', '\"')
-
-def broadcast_tx(key, value):
-    cmd = abci_addr + 'broadcast_tx_commit?tx="Key%3F' + key + '%26Value%3F' + value.replace('\"', '\'') + '"'
-    req = requests.get(cmd)
-
-def meta_block_exists(organization_id: OrganizationID, block_id: UUID):
-    raw_rep = retrieve_tx(create_key_block_meta(organization_id, block_id))
-    return True if raw_rep != "0" else False
-
-def block_exists(organization_id: OrganizationID, block_id: UUID):
-    raw_rep = retrieve_tx(create_key_block(organization_id, block_id))
-    return True if raw_rep != "0" else False
-
-def retrieve_block(organization_id: OrganizationID, block_id: UUID):
-    key = create_key_block(organization_id, block_id)
-    raw_rep = retrieve_tx(key)
-    return BlockDecoder().decode(raw_rep, )
+
+    async def _fetch():
+        raw_rep = await write_pipeline.query(tendermint_client, key)
+        if raw_rep == b"0":
+            return None
+        return BlockMetaDecoder().decode(raw_rep.decode('utf-8'), )
+
+    return await blockchain_cache.get(key, _fetch)
+
+
+async def reset_block_metas():
+    items = [
+        (key, b'')
+        for key, _ in await write_pipeline.query_prefix(tendermint_client, create_prefix_block_meta())
+    ]
+    if items:
+        # An empty value deletes the key
+        await write_pipeline.submit(tendermint_client, items)
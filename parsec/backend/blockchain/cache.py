@@ -0,0 +1,129 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import copy
+import trio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, Optional
+from structlog import get_logger
+
+from parsec.backend.tendermint import TendermintClient, TendermintError
+
+
+logger = get_logger()
+
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_WATCH_INTERVAL = 1
+# Maximum number of block metas returned by Tendermint's `blockchain` call
+MAX_BLOCKCHAIN_RANGE = 20
+
+
+class BlockchainCache:
+    """
+    Read-through LRU cache of the decoded objects retrieved from the blockchain,
+    keyed by blockchain key.
+
+    Entries are invalidated by the backend's own writes (see `invalidate`) and
+    dropped altogether once a block containing transactions from another writer
+    is committed (see `watch_blockchain`).
+
+    Objects are copied on retrieval, so callers are free to mutate them.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Bumped by each invalidation, a value fetched while it changed may be
+        # outdated hence is not stored
+        self._generation = 0
+        self._height = None
+        self._own_heights = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+
+    def invalidate(self, keys: Iterable[str], height: Optional[int] = None) -> None:
+        """
+        Must be called once a transaction writing `keys` has been committed
+        (at block `height` if known, so this block is not mistaken for one
+        from another writer).
+        """
+        for key in keys:
+            self._entries.pop(key, None)
+        self._generation += 1
+        if height is not None and (self._height is None or height > self._height):
+            self._own_heights.add(height)
+
+    async def get(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        try:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+        except KeyError:
+            pass
+
+        generation = self._generation
+        value = await fetch()
+        if generation == self._generation and (cacheable is None or cacheable(value)):
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(value)
+
+    async def _foreign_txs_committed(self, client: TendermintClient, heights: range) -> bool:
+        heights = [h for h in heights if h not in self._own_heights]
+        if not heights:
+            return False
+        if len(heights) > MAX_BLOCKCHAIN_RANGE:
+            return True
+        result = await client.call(
+            "blockchain", minHeight=str(min(heights)), maxHeight=str(max(heights))
+        )
+        for block_meta in result["block_metas"]:
+            height = int(block_meta["header"]["height"])
+            if height in heights and int(block_meta.get("num_txs", 1)) > 0:
+                return True
+        return False
+
+    async def observe_height(self, client: TendermintClient, height: int) -> None:
+        if self._height is not None and height > self._height:
+            try:
+                foreign = await self._foreign_txs_committed(client, range(self._height + 1, height + 1))
+            except (TendermintError, KeyError, ValueError):
+                foreign = True
+            if foreign:
+                logger.debug("Blockchain updated by another writer, clearing cache", height=height)
+                self.clear()
+        if self._height is None or height > self._height:
+            self._height = height
+            self._own_heights = {h for h in self._own_heights if h > height}
+
+    async def watch_blockchain(
+        self, client: TendermintClient, interval: float = DEFAULT_WATCH_INTERVAL
+    ) -> None:
+        """
+        Poll Tendermint's `status` to detect the blocks committed by other
+        writers (the empty blocks are ignored).
+        """
+        while True:
+            try:
+                status = await client.call("status")
+                await self.observe_height(client, int(status["sync_info"]["latest_block_height"]))
+            except (TendermintError, KeyError, ValueError) as exc:
+                # Blocks may have been missed in the meantime
+                logger.debug("Cannot retrieve Tendermint status", reason=exc)
+                self.clear()
+            await trio.sleep(interval)
+
+
+# Shared by all the blockchain components
+blockchain_cache = BlockchainCache()
@@ -12,22 +12,24 @@ from parsec.utils import open_service_nursery
 from parsec.backend.config import BackendConfig
 from parsec.backend.blockstore import blockstore_factory
 from parsec.backend.events import EventsComponent
+from parsec.backend.epoch import EpochScheduler
 from parsec.backend.blockchain.organization import BlockchainOrganizationComponent
 from parsec.backend.blockchain.ping import BlockchainPingComponent
 from parsec.backend.blockchain.user import BlockchainUserComponent
 from parsec.backend.blockchain.invite import BlockchainInviteComponent
 from parsec.backend.blockchain.message import BlockchainMessageComponent
 from parsec.backend.blockchain.realm import BlockchainRealmComponent
-from parsec.backend.blockchain.vlob import BlockchainVlobComponent
-from parsec.backend.blockchain.block import BlockchainBlockComponent
+from parsec.backend.blockchain.vlob import BlockchainVlobComponent, reset_database
+from parsec.backend.blockchain.block import BlockchainBlockComponent, reset_block_metas
+from parsec.backend.blockchain.cache import blockchain_cache
+from parsec.backend.blockchain.pipeline import write_pipeline
+from parsec.backend.tendermint import tendermint_client
 from parsec.backend.webhooks import WebhooksComponent
 from parsec.backend.http import HTTPComponent
 
 from parsec.backend.backend_events import BackendEvent
 
 
-import requests
-
 @asynccontextmanager
 async def components_factory(config: BackendConfig, event_bus: EventBus):
     send_events_channel, receive_events_channel = trio.open_memory_channel[
@@ -54,6 +56,7 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
     block = BlockchainBlockComponent()
     blockstore = blockstore_factory(config.blockstore_config)
     events = EventsComponent(realm, send_event=_send_event)
+    epoch = EpochScheduler(config)
 
     components = {
         "events": events,
@@ -68,16 +71,27 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
         "ping": ping,
         "block": block,
         "blockstore": blockstore,
+        "epoch": epoch,
     }
     for component in components.values():
         method = getattr(component, "register_components", None)
         if method is not None:
             method(**components)
 
+    await reset_database()
+    await reset_block_metas()
+
     async with open_service_nursery() as nursery:
         nursery.start_soon(_dispatch_event)
+        nursery.start_soon(blockchain_cache.watch_blockchain, tendermint_client)
+        nursery.start_soon(write_pipeline.run, tendermint_client)
+        nursery.start_soon(epoch.run)
         try:
             yield components
 
         finally:
+            # Let the pending writes be confirmed before stopping
+            with trio.move_on_after(tendermint_client.commit_timeout) as cancel_scope:
+                cancel_scope.shield = True
+                await write_pipeline.join()
             nursery.cancel_scope.cancel()
@@ -97,9 +97,8 @@ class BlockchainOrganizationComponent(BaseOrganizationComponent):
         await self.get(id)
 
         metadata_size = 0
-        for (vlob_organization_id, _), vlob in self._vlob_component._get_items():
-            if vlob_organization_id == id:
-                metadata_size += sum(len(blob) for (blob, _, _) in vlob.data)
+        for vlob in (await self._vlob_component._get_vlobs(id)).values():
+            metadata_size += sum(len(blob) for (blob, _, _) in vlob.data)
 
         data_size = 0
         for (vlob_organization_id, _), blockmeta in self._block_component._blockmetas.items():
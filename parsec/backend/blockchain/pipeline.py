@@ -0,0 +1,196 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import trio
+import attr
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Tuple, Union
+from structlog import get_logger
+
+from parsec.backend.tendermint import TendermintClient, TendermintError, encode_tx
+from parsec.backend.blockchain.cache import BlockchainCache, blockchain_cache
+
+
+logger = get_logger()
+
+
+# Failures recorded for the keys of failed transactions until they are
+# accessed again, the oldest ones are dropped beyond this number
+MAX_RECORDED_FAILURES = 1024
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _PipelineState:
+    # Key -> (hash of the latest pending transaction writing it, value)
+    overlay: Dict[str, Tuple[str, bytes]] = attr.ib(factory=dict)
+    # Hash and keys of the pending transactions, in submission order
+    pending: Deque[Tuple[str, List[str]]] = attr.ib(factory=deque)
+    # Key -> failure of the latest transaction writing it, in failure order
+    failures: Dict[str, TendermintError] = attr.ib(factory=dict)
+    changed: trio.Event = attr.ib(factory=trio.Event)
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = trio.Event()
+
+
+class WritePipeline:
+    """
+    Write-ahead pipeline of the transactions sent to Tendermint.
+
+    Transactions are submitted with `broadcast_tx_sync` (i.e. a write only
+    waits for the transaction to be accepted in the mempool, not for the block
+    commit) and their key/value couples are kept in an overlay until `run` has
+    confirmed they are part of a committed block, so the backend reads its own
+    writes in the meantime (see `query` and `query_prefix`).
+
+    A transaction failing in `DeliverTx` or not committed in time is logged
+    and its couples are dropped from the overlay. The failure is recorded for
+    each of its keys and raised by the next read or write of one of them (or
+    by the next `flush`), so a lost write is not silently built upon: the
+    following accesses fall back to the committed state.
+
+    Like the Tendermint connection pool, the pending state belongs to the trio
+    run that submitted the transactions.
+    """
+
+    def __init__(self, cache: BlockchainCache):
+        self._cache = cache
+        self._state_var = trio.lowlevel.RunVar("blockchain_write_pipeline")
+
+    def _get_state(self) -> _PipelineState:
+        try:
+            return self._state_var.get()
+        except LookupError:
+            state = _PipelineState()
+            self._state_var.set(state)
+            return state
+
+    def __len__(self):
+        return len(self._get_state().pending)
+
+    @staticmethod
+    def _raise_failure(state: _PipelineState, keys: Iterable[str]) -> None:
+        failures = [state.failures.pop(key) for key in keys if key in state.failures]
+        if failures:
+            raise failures[0]
+
+    async def submit(
+        self, client: TendermintClient, items: Iterable[Tuple[str, Union[str, bytes]]]
+    ) -> str:
+        """
+        Send a transaction writing the key/value couples (an empty value
+        deletes the key) and return its hash once it is in the mempool.
+
+        Raises:
+            TendermintNotAvailable
+            TendermintRPCError: if the transaction is rejected by `CheckTx`
+            TendermintError: if a previous write of one of the keys has failed
+        """
+        items = [
+            (key, value.encode("utf8") if isinstance(value, str) else value)
+            for key, value in items
+        ]
+        state = self._get_state()
+        self._raise_failure(state, [key for key, _ in items])
+        rep = await client.broadcast_tx_sync(encode_tx(items))
+        tx_hash = rep["hash"]
+        for key, value in items:
+            state.overlay[key] = (tx_hash, value)
+        keys = [key for key, _ in items]
+        state.pending.append((tx_hash, keys))
+        # Cached values are now outdated, the next reads go through the overlay
+        self._cache.invalidate(keys)
+        state.notify()
+        return tx_hash
+
+    async def query(self, client: TendermintClient, key: str) -> bytes:
+        """
+        Raises:
+            TendermintError: if the latest write of the key has failed
+        """
+        state = self._get_state()
+        self._raise_failure(state, [key])
+        try:
+            _, value = state.overlay[key]
+        except KeyError:
+            return await client.abci_query(key)
+        # Missing keys are reported with value `0` (see `abci_server.MetadataBlockchain.query`)
+        return value or b"0"
+
+    async def query_prefix(self, client: TendermintClient, prefix: str) -> List[Tuple[str, bytes]]:
+        """
+        Raises:
+            TendermintError: if the latest write of one of the keys has failed
+        """
+        state = self._get_state()
+        self._raise_failure(state, [key for key in state.failures if key.startswith(prefix)])
+        items = dict(await client.abci_query_prefix(prefix))
+        for key, (_, value) in state.overlay.items():
+            if key.startswith(prefix):
+                if value:
+                    items[key] = value
+                else:
+                    items.pop(key, None)
+        return sorted(items.items())
+
+    async def join(self) -> None:
+        """
+        Wait for the transactions submitted so far to be confirmed (or to fail).
+        """
+        state = self._get_state()
+        if state.pending:
+            last_tx_hash = state.pending[-1][0]
+            while any(tx_hash == last_tx_hash for tx_hash, _ in state.pending):
+                await state.changed.wait()
+
+    async def flush(self) -> None:
+        """
+        Wait for the transactions submitted so far and clear the recorded
+        failures.
+
+        Raises:
+            TendermintError: the oldest failure not raised yet
+        """
+        await self.join()
+        state = self._get_state()
+        if state.failures:
+            failures, state.failures = state.failures, {}
+            raise next(iter(failures.values()))
+
+    async def run(self, client: TendermintClient) -> None:
+        """
+        Confirm the pending transactions through Tendermint's `tx` endpoint,
+        in submission order (which is also the order of their commit).
+        """
+        state = self._get_state()
+        while True:
+            if not state.pending:
+                await state.changed.wait()
+                continue
+
+            tx_hash, keys = state.pending[0]
+            try:
+                rep = await client.wait_for_tx(tx_hash)
+                height = int(rep["height"])
+            except (TendermintError, KeyError, ValueError) as exc:
+                logger.error("Transaction not committed", tx_hash=tx_hash, exc_info=exc)
+                if not isinstance(exc, TendermintError):
+                    exc = TendermintError(f"Invalid `tx` reply for {tx_hash}: {exc!r}")
+                for key in keys:
+                    state.failures.pop(key, None)
+                    state.failures[key] = exc
+                while len(state.failures) > MAX_RECORDED_FAILURES:
+                    del state.failures[next(iter(state.failures))]
+                height = None
+
+            state.pending.popleft()
+            for key in keys:
+                # The key may have been written again by a transaction still pending
+                if state.overlay.get(key, (None,))[0] == tx_hash:
+                    del state.overlay[key]
+            self._cache.invalidate(keys, height=height)
+            state.notify()
+
+
+# Shared by all the blockchain components
+write_pipeline = WritePipeline(blockchain_cache)
@@ -32,8 +32,9 @@ from parsec.backend.blockchain.vlob import BlockchainVlobComponent
 from parsec.backend.blockchain.block import BlockchainBlockComponent
 
 import json
-import requests
-import base64
+
+from parsec.backend.tendermint import tendermint_client, encode_tx
+from parsec.backend.blockchain.cache import blockchain_cache
 
 from parsec.api.protocol import (
     realm_create_serializer,
@@ -79,13 +80,13 @@ class BlockchainRealmComponent(BaseRealmComponent):
         self._vlob_component = vlob
         self._block_component = block
 
-    def _get_realm(self, organization_id, realm_id):
+    async def _get_realm(self, organization_id, realm_id):
         try:
             realm = self._realms[(organization_id, realm_id)]
-            realm.checkpoint = retrieve_checkpoint(organization_id, realm_id)
-            return realm
         except KeyError:
             raise RealmNotFoundError(f"Realm `{realm_id}` doesn't exist")
+        realm.checkpoint = await retrieve_checkpoint(organization_id, realm_id)
+        return realm
 
     async def create(
         self, organization_id: OrganizationID, self_granted_role: RealmGrantedRole
@@ -98,7 +99,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
         if key not in self._realms:
             self._realms[key] = Realm(granted_roles=[self_granted_role])
             key = create_key_realm(organization_id, self_granted_role.realm_id)
-            broadcast_tx('updates_changes_', key, {"checkpoint": str(1)})
+            await broadcast_tx(key, {"checkpoint": str(1)})
 
             await self._send_event(
                 BackendEvent.REALM_ROLES_UPDATED,
@@ -115,7 +116,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
     async def get_status(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: UUID
     ) -> RealmStatus:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         if author.user_id not in realm.roles:
             raise RealmAccessError()
         return realm.status
@@ -123,7 +124,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
     async def get_stats(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: UUID
     ) -> RealmStats:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         if author.user_id not in realm.roles:
             raise RealmAccessError()
 
@@ -132,16 +133,15 @@ class BlockchainRealmComponent(BaseRealmComponent):
         for value in self._block_component._blockmetas.values():
             if value.realm_id == realm_id:
                 blocks_size += value.size
-        for value in self._vlob_component._get_values():
-            if value.realm_id == realm_id:
-                vlobs_size += sum(len(blob) for (blob, _, _) in value.data)
+        for value in (await self._vlob_component._get_vlobs(organization_id, realm_id)).values():
+            vlobs_size += sum(len(blob) for (blob, _, _) in value.data)
 
         return RealmStats(blocks_size=blocks_size, vlobs_size=vlobs_size)
 
     async def get_current_roles(
         self, organization_id: OrganizationID, realm_id: UUID
     ) -> Dict[UserID, RealmRole]:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         roles: Dict[UserID, RealmRole] = {}
         for x in realm.granted_roles:
             if x.role is None:
@@ -157,7 +157,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
         realm_id: UUID,
         since: pendulum.DateTime,
     ) -> List[bytes]:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         if author.user_id not in realm.roles:
             raise RealmAccessError()
         if since:
@@ -187,7 +187,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
                 "User with OUTSIDER profile cannot be MANAGER or OWNER"
             )
 
-        realm = self._get_realm(organization_id, new_role.realm_id)
+        realm = await self._get_realm(organization_id, new_role.realm_id)
 
         if realm.status.in_maintenance:
             raise RealmInMaintenanceError("Data realm is currently under maintenance")
@@ -237,7 +237,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
         per_participant_message: Dict[UserID, bytes],
         timestamp: pendulum.DateTime,
     ) -> None:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         if realm.roles.get(author.user_id) != RealmRole.OWNER:
             raise RealmAccessError()
         if realm.status.in_maintenance:
@@ -261,7 +261,7 @@ class BlockchainRealmComponent(BaseRealmComponent):
             maintenance_started_by=author,
             encryption_revision=encryption_revision,
         )
-        self._vlob_component._maintenance_reencryption_start_hook(
+        await self._vlob_component._maintenance_reencryption_start_hook(
             organization_id, realm_id, encryption_revision
         )
 
@@ -285,14 +285,14 @@ class BlockchainRealmComponent(BaseRealmComponent):
         realm_id: UUID,
         encryption_revision: int,
     ) -> None:
-        realm = self._get_realm(organization_id, realm_id)
+        realm = await self._get_realm(organization_id, realm_id)
         if realm.roles.get(author.user_id) != RealmRole.OWNER:
             raise RealmAccessError()
         if not realm.status.in_maintenance:
             raise RealmNotInMaintenanceError(f"Realm `{realm_id}` not under maintenance")
         if encryption_revision != realm.status.encryption_revision:
             raise RealmEncryptionRevisionError("Invalid encryption revision")
-        if not self._vlob_component._maintenance_reencryption_is_finished_hook(
+        if not await self._vlob_component._maintenance_reencryption_is_finished_hook(
             organization_id, realm_id, encryption_revision
         ):
             raise RealmMaintenanceError("Reencryption operations are not over")
@@ -325,19 +325,17 @@ class BlockchainRealmComponent(BaseRealmComponent):
                 pass
         return user_realms
 
-def retrieve_tx(key):
-    cmd = 'http://localhost:26657/abci_query?data="' + key + '"'
-    req = requests.get(cmd)
-    raw_rep = req.json()
-    raw_rep = base64.b64decode(raw_rep['result']['response']['value']).decode('utf-8')
-    return raw_rep.replace('\'', '\"')
+async def retrieve_tx(key):
+    raw_rep = await tendermint_client.abci_query(key)
+    return raw_rep.decode('utf-8')
 
-def broadcast_tx(op, key, value):
-    cmd = 'http://localhost:26657/broadcast_tx_commit?tx="' + op + 'Key%3F' + key + '%26Value%3F' + json.dumps(value).replace('\"','\'') + '"'
-    req = requests.get(cmd)
+async def broadcast_tx(key, value):
+    rep = await tendermint_client.broadcast_tx_commit(encode_tx([(key, json.dumps(value))]))
+    height = rep.get("height")
+    blockchain_cache.invalidate([key], height=int(height) if height else None)
 
-def realm_exists(organization_id: OrganizationID, realm_id: UUID):
-    raw_rep = retrieve_tx(create_key_realm(organization_id, realm_id))
+async def realm_exists(organization_id: OrganizationID, realm_id: UUID):
+    raw_rep = await retrieve_tx(create_key_realm(organization_id, realm_id))
     if raw_rep != "0":
         return True
     else:
@@ -346,7 +344,11 @@ def realm_exists(organization_id: OrganizationID, realm_id: UUID):
 def create_key_realm(organization_id: OrganizationID, realm_id: UUID):
     return '(realm, ' + organization_id.__str__() + ', ' + realm_id.__str__() + ')'
 
-def retrieve_checkpoint(organization_id: OrganizationID, realm_id: UUID):
+async def retrieve_checkpoint(organization_id: OrganizationID, realm_id: UUID):
     key = create_key_realm(organization_id, realm_id)
-    raw_rep = retrieve_tx(key)
-    return json.loads(raw_rep)['checkpoint']
\ No newline at end of file
+
+    async def _fetch():
+        raw_rep = await retrieve_tx(key)
+        return json.loads(raw_rep)['checkpoint']
+
+    return await blockchain_cache.get(key, _fetch)
@@ -2,6 +2,7 @@
 
 import attr
 import pendulum
+from bisect import bisect_left
 from uuid import UUID
 from typing import List, Tuple, Dict, Optional
 
@@ -21,12 +22,12 @@ from parsec.backend.vlob import (
     VlobNotInMaintenanceError,
 )
 
-import requests
-import base64
 import json
 from json import JSONEncoder, JSONDecoder
 
-abci_addr = 'http://localhost:26657/'
+from parsec.backend.tendermint import tendermint_client
+from parsec.backend.blockchain.cache import blockchain_cache
+from parsec.backend.blockchain.pipeline import write_pipeline
 
 
 @attr.s
@@ -49,131 +50,131 @@ class Vlob:
         return False
 
 
-class VlobDecoder(JSONDecoder):
-    def decode(self, obj, **kwargs):
-        json_vlob = json.loads(obj)
-        vlob = Vlob(UUID(json_vlob['realm_id']))
-        # ' ' need to replace '+' otherwise a deserialisation happends
-        for elt in json_vlob['data']:
-            if '.' in elt['timestamp']:
-                vlob.data.append((base64.b64decode(elt['blob'].replace(' ', '+')), DeviceID(elt['author']),
-                                  pendulum.from_format(elt['timestamp'].replace(' ', '+'),
-                                                       'YYYY-MM-DDTHH:mm:ss.SSSSSSZ')))
-            else:
-                vlob.data.append((base64.b64decode(elt['blob'].replace(' ', '+')), DeviceID(elt['author']),
-                                  pendulum.from_format(elt['timestamp'].replace(' ', '+'), 'YYYY-MM-DDTHH:mm:ssZ')))
-        return vlob
+@attr.s
+class VlobHead:
+    """
+    Small record stored under the vlob key: the blob of each version is stored
+    under its own key (see `create_key_vlob_version`), so an update only writes
+    the new version and this head.
+    """
+
+    realm_id: UUID = attr.ib()
+    versions: List[Tuple[DeviceID, pendulum.DateTime]] = attr.ib(factory=list)
 
+    @property
+    def current_version(self):
+        return len(self.versions)
 
-class VlobKeys:
-    # data: List[Tuple[organization_id, vlob_id]]
-    data: List[Tuple[OrganizationID, UUID]]
 
-    def __init__(self, data=None):
-        if data is None:
-            data = []
-        self.data = data
+def _decode_timestamp(raw):
+    # ' ' need to replace '+' otherwise a deserialisation happends
+    raw = raw.replace(' ', '+')
+    if '.' in raw:
+        return pendulum.from_format(raw, 'YYYY-MM-DDTHH:mm:ss.SSSSSSZ')
+    else:
+        return pendulum.from_format(raw, 'YYYY-MM-DDTHH:mm:ssZ')
 
 
-class VlobKeysDecoder(JSONDecoder):
+class VlobHeadDecoder(JSONDecoder):
     def decode(self, obj, **kwargs):
-        json_vlob_keys = json.loads(obj)
-        list_data = []
-        for elt in json_vlob_keys['data']:
-            list_data.append((OrganizationID(elt['organization_id']), UUID(elt['vlob_id'])))
-        return VlobKeys(list_data)
+        json_head = json.loads(obj)
+        head = VlobHead(UUID(json_head['realm_id']))
+        for elt in json_head['versions']:
+            head.versions.append((DeviceID(elt['author']), _decode_timestamp(elt['timestamp'])))
+        return head
 
 
+@attr.s
 class Reencryption:
-    def __init__(self, realm_id, organization_id, vlobs):
-        self.realm_id = realm_id
-        self.organization_id = organization_id
-        self._original_vlobs = vlobs
-        self._todo = {}
-        self._done = {}
-        for vlob_id, vlob in vlobs.items():
-            for index, (data, _, _) in enumerate(vlob.data):
-                version = index + 1
-                self._todo[(vlob_id, version)] = data
-        self._total = len(self._todo)
+    """
+    Progress of a realm reencryption, stored under its own key (see
+    `create_key_reencryption`) so the realm's `Changes` only carry a flag.
 
-    def __eq__(self, other):
-        if isinstance(other, Reencryption):
-            if self.realm_id != other.realm_id:
-                return False
-            if self.organization_id != other.organization_id:
-                return False
-            if self._original_vlobs != other._original_vlobs:
-                return False
-            return True
-        return False
+    The versions to reencrypt are the ones of the realm's vlobs when the
+    maintenance started, each reencrypted blob directly replaces the original
+    one (vlobs cannot be read during the maintenance). A bitmask per vlob
+    tells which versions are done and `cursor` is the index of the first vlob
+    with versions left, so a batch only goes through the remaining items.
+    """
 
-    def get_reencrypted_vlobs(self):
-        assert self.is_finished()
-        vlobs = {}
-        for (vlob_id, version), data in sorted(self._done.items()):
-            try:
-                (_, author, timestamp) = self._original_vlobs[vlob_id].data[version - 1]
+    realm_id: UUID = attr.ib()
+    organization_id: OrganizationID = attr.ib()
+    # (vlob id, number of versions) ordered by vlob id
+    vlobs: List[Tuple[UUID, int]] = attr.ib(factory=list)
+    done: List[int] = attr.ib(factory=list)
+    cursor: int = attr.ib(default=0)
+
+    @classmethod
+    def from_versions(cls, realm_id, organization_id, versions: Dict[UUID, int]):
+        vlobs = sorted(versions.items())
+        self = cls(realm_id, organization_id, vlobs, [0] * len(vlobs))
+        self._advance_cursor()
+        return self
+
+    def _advance_cursor(self):
+        while self.cursor < len(self.vlobs):
+            _, versions = self.vlobs[self.cursor]
+            if self.done[self.cursor] != (1 << versions) - 1:
+                break
+            self.cursor += 1
 
-            except KeyError:
-                raise VlobNotFoundError()
+    def is_finished(self):
+        return self.cursor == len(self.vlobs)
 
-            if vlob_id not in vlobs:
-                vlobs[vlob_id] = Vlob(self.realm_id, [(data, author, timestamp)])
-            else:
-                vlobs[vlob_id].data.append((data, author, timestamp))
-            assert len(vlobs[vlob_id].data) == version
+    def get_batch(self, size) -> List[Tuple[UUID, int]]:
+        batch = []
+        for index in range(self.cursor, len(self.vlobs)):
+            vlob_id, versions = self.vlobs[index]
+            for version in range(1, versions + 1):
+                if len(batch) == size:
+                    return batch
+                if not self.done[index] & 1 << (version - 1):
+                    batch.append((vlob_id, version))
+        return batch
+
+    def save(self, vlob_id: UUID, version: int) -> bool:
+        """
+        Returns False if the version was already done.
+
+        Raises:
+            VlobNotFoundError
+        """
+        index = bisect_left(self.vlobs, (vlob_id,))
+        if index == len(self.vlobs) or self.vlobs[index][0] != vlob_id:
+            raise VlobNotFoundError()
+        if not 1 <= version <= self.vlobs[index][1]:
+            raise VlobNotFoundError()
+        flag = 1 << (version - 1)
+        if self.done[index] & flag:
+            return False
+        self.done[index] |= flag
+        self._advance_cursor()
+        return True
 
-        return vlobs
+    def get_counts(self) -> Tuple[int, int]:
+        total = sum(versions for _, versions in self.vlobs)
+        done = sum(bin(mask).count("1") for mask in self.done)
+        return total, done
 
-    def is_finished(self):
-        return not self._todo
 
-    def get_batch(self, size):
-        batch = []
-        for (vlob_id, version), data in self._todo.items():
-            if (vlob_id, version) in self._done:
-                continue
-            batch.append((vlob_id, version, data))
-        return batch[:size]
-
-    def save_batch(self, batch):
-        for vlob_id, version, data in batch:
-            key = (vlob_id, version)
-            if key in self._done:
-                continue
-            try:
-                del self._todo[key]
-            except KeyError:
-                raise VlobNotFoundError()
-            self._done[key] = data
-
-        return self._total, len(self._done)
+class ReencryptionDecoder(JSONDecoder):
+    def decode(self, obj, **kwargs):
+        json_reencryption = json.loads(obj)
+        return Reencryption(
+            UUID(json_reencryption['realm_id']),
+            OrganizationID(json_reencryption['organization_id']),
+            [(UUID(vlob_id), versions) for vlob_id, versions, _ in json_reencryption['vlobs']],
+            [int(mask, 16) for _, _, mask in json_reencryption['vlobs']],
+            json_reencryption['cursor'],
+        )
 
 
 @attr.s
 class Changes():
     checkpoint: int = attr.ib(default=0)
     changes: Dict[UUID, Tuple[DeviceID, int, int]] = attr.ib(factory=dict)
-    reencryption: Reencryption = attr.ib(default=None)
-
-    def __init__(self, checkpoint=0, changes=None, reencryption=None):
-        if changes is None:
-            changes = {}
-        self.checkpoint = checkpoint
-        self.changes = changes
-        self.reencryption = reencryption
-
-    def __eq__(self, other):
-        if isinstance(other, Changes):
-            if self.checkpoint != other.checkpoint:
-                return False
-            if self.changes != other.changes:
-                return False
-            if self.reencryption != other.reencryption:
-                return False
-            return True
-        return False
+    # Whether a reencryption is in progress (see `Reencryption`)
+    reencryption: bool = attr.ib(default=False)
 
 
 class ChangesDecoder(JSONDecoder):
@@ -182,151 +183,101 @@ class ChangesDecoder(JSONDecoder):
         dict_changes = {}
         for k, v in json_changes['changes'].items():
             dict_changes[UUID(k)] = (DeviceID(v['author']), int(v['checkpoint']), int(v['src_version']))
-
-        # reconstruct reencryption
-        if json_changes['reencryption'] == 'None':
-            return Changes(int(json_changes['checkpoint']), dict_changes, None)
-        else:
-            items = []
-            vlob_keys = retrieve_set_vlob_keys()
-            for k in vlob_keys.data:
-                items.append(((k[0], k[1]), retrieve_vlob(k[0], k[1])))
-            realm_vlobs = {
-                vlob_id: vlob
-                for (orgid, vlob_id), vlob in items
-                if orgid == OrganizationID(json_changes['reencryption'][1]) and vlob.realm_id == UUID(
-                    json_changes['reencryption'][0])
-            }
-            return Changes(int(json_changes['checkpoint']), dict_changes,
-                           Reencryption(UUID(json_changes['reencryption'][0]),
-                                        OrganizationID(json_changes['reencryption'][1]), realm_vlobs))
-
-
-class ChangesKeys:
-    # data: List[Tuple[organization_id, realm_id]]
-    data: List[Tuple[OrganizationID, UUID]]
-
-    def __init__(self, data=None):
-        if data is None:
-            data = []
-        self.data = data
-
-
-class ChangesKeysDecoder(JSONDecoder):
-    def decode(self, obj, **kwargs):
-        json_obj = json.loads(obj)
-        list_data = []
-        for elt in json_obj['data']:
-            list_data.append((OrganizationID(elt['organization_id']), UUID(elt['realm_id'])))
-        return ChangesKeys(list_data)
+        # Previously written as 'None' or the realm and organization ids
+        reencryption = json_changes['reencryption'] not in (None, False, 'None')
+        return Changes(int(json_changes['checkpoint']), dict_changes, reencryption)
 
 
 class Encoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, Vlob):
-            data_to_json_list = []
-            for d in obj.data:
-                data_to_json_list.append({'blob': base64.b64encode(d[0]).decode('utf-8'), 'author': d[1].__str__(),
-                                          'timestamp': d[2].__str__()})
-            return {'realm_id': obj.realm_id.__str__(), 'data': data_to_json_list}
+        if isinstance(obj, VlobHead):
+            versions_to_json_list = []
+            for author, timestamp in obj.versions:
+                versions_to_json_list.append({'author': author.__str__(), 'timestamp': timestamp.__str__()})
+            return {'realm_id': obj.realm_id.__str__(), 'versions': versions_to_json_list}
 
         if isinstance(obj, Changes):
             dict_changes = {}
             for k, v in obj.changes.items():
                 dict_changes[k.__str__()] = {'author': v[0].__str__(), 'checkpoint': str(v[1]),
                                              'src_version': str(v[2])}
-            if obj.reencryption == None:
-                return {'checkpoint': obj.checkpoint.__str__(), 'changes': dict_changes, 'reencryption': 'None'}
-            else:
-                return {'checkpoint': obj.checkpoint.__str__(), 'changes': dict_changes,
-                        'reencryption': [obj.reencryption.realm_id.__str__(),
-                                         obj.reencryption.organization_id.__str__()]}
-
-        if isinstance(obj, VlobKeys):
-            keys_to_json_list = []
-            for d in obj.data:
-                keys_to_json_list.append({'organization_id': d[0].__str__(), 'vlob_id': d[1].__str__()})
-            return {'data': keys_to_json_list}
+            return {'checkpoint': obj.checkpoint.__str__(), 'changes': dict_changes,
+                    'reencryption': obj.reencryption}
 
-        if isinstance(obj, ChangesKeys):
-            keys_to_json_list = []
-            for d in obj.data:
-                keys_to_json_list.append({'organization_id': d[0].__str__(), 'realm_id': d[1].__str__()})
-            return {'data': keys_to_json_list}
+        if isinstance(obj, Reencryption):
+            return {'realm_id': obj.realm_id.__str__(), 'organization_id': obj.organization_id.__str__(),
+                    'vlobs': [[vlob_id.__str__(), versions, format(mask, 'x')]
+                              for (vlob_id, versions), mask in zip(obj.vlobs, obj.done)],
+                    'cursor': obj.cursor}
 
 
 class BlockchainVlobComponent(BaseVlobComponent):
     def __init__(self, send_event):
         self._send_event = send_event
         self._realm_component = None
-        reset_database()
 
     def register_components(self, realm: BaseRealmComponent, **other_components):
         self._realm_component = realm
 
     # this method doesn't need to be a self one but we doesn't change it to avoid error from call from other component
-    def _maintenance_reencryption_start_hook(self, organization_id, realm_id, encryption_revision):
-        changes = retrieve_changes(organization_id, realm_id)
+    async def _maintenance_reencryption_start_hook(self, organization_id, realm_id, encryption_revision):
+        changes = await retrieve_changes(organization_id, realm_id)
 
         assert not changes.reencryption
-        realm_vlobs = {
-            vlob_id: vlob
-            for (orgid, vlob_id), vlob in self._get_items()
-            if orgid == organization_id and vlob.realm_id == realm_id
-        }
-        changes.reencryption = Reencryption(realm_id, organization_id, realm_vlobs)
-        broadcast_tx(create_key_changes(organization_id, realm_id), json.dumps(changes, cls=Encoder))
+        versions = {}
+        for vlob_id in await retrieve_realm_vlob_ids(organization_id, realm_id):
+            versions[vlob_id] = (await get_vlob_head(organization_id, vlob_id)).current_version
+        reencryption = Reencryption.from_versions(realm_id, organization_id, versions)
+        changes.reencryption = True
+        await broadcast_batch_tx(
+            [
+                (create_key_changes(organization_id, realm_id), json.dumps(changes, cls=Encoder)),
+                (create_key_reencryption(organization_id, realm_id), json.dumps(reencryption, cls=Encoder)),
+            ]
+        )
 
     # this method doesn't need to be a self one but we doesn't change it to avoid error from call from other component
-    def _maintenance_reencryption_is_finished_hook(
+    async def _maintenance_reencryption_is_finished_hook(
         self, organization_id, realm_id, encryption_revision
     ):
-        changes = retrieve_changes(organization_id, realm_id)
+        changes = await retrieve_changes(organization_id, realm_id)
         assert changes.reencryption
-        if not changes.reencryption.is_finished():
+        reencryption = await retrieve_reencryption(organization_id, realm_id)
+        if not reencryption.is_finished():
             return False
 
-        realm_vlobs = changes.reencryption.get_reencrypted_vlobs()
-        for vlob_id, vlob in realm_vlobs.items():
-            broadcast_tx(create_key_vlob(organization_id, vlob_id), json.dumps(vlob, cls=Encoder))
-        changes.reencryption = None
-        broadcast_tx(create_key_changes(organization_id, realm_id), json.dumps(changes, cls=Encoder))
+        # Reencrypted blobs are already stored, only the progress is removed
+        changes.reencryption = False
+        await broadcast_batch_tx(
+            [
+                (create_key_changes(organization_id, realm_id), json.dumps(changes, cls=Encoder)),
+                (create_key_reencryption(organization_id, realm_id), b''),
+            ]
+        )
         return True
 
     # this method doesn't need to be a self one but we doesn't change it to avoid error from call from other component
-    def _get_items(self):
-        items = []
-        vlob_keys = retrieve_set_vlob_keys()
-        for k in vlob_keys.data:
-            items.append(((k[0], k[1]), get_vlob(k[0], k[1])))
-        return items
+    async def _get_vlobs(self, organization_id, realm_id=None):
+        return await retrieve_realm_vlobs(organization_id, realm_id)
 
-    # this method doesn't need to be a self one but we doesn't change it to avoid error from call from other component
-    def _get_values(self):
-        values = []
-        vlob_keys = retrieve_set_vlob_keys()
-        for k in vlob_keys.data:
-            values.append((get_vlob(k[0], k[1])))
-        return values
-
-    def _check_realm_read_access(self, organization_id, realm_id, user_id, encryption_revision):
+    async def _check_realm_read_access(self, organization_id, realm_id, user_id, encryption_revision):
         can_read_roles = (
             RealmRole.OWNER,
             RealmRole.MANAGER,
             RealmRole.CONTRIBUTOR,
             RealmRole.READER,
         )
-        self._check_realm_access(
+        await self._check_realm_access(
             organization_id, realm_id, user_id, encryption_revision, can_read_roles
         )
 
-    def _check_realm_write_access(self, organization_id, realm_id, user_id, encryption_revision):
+    async def _check_realm_write_access(self, organization_id, realm_id, user_id, encryption_revision):
         can_write_roles = (RealmRole.OWNER, RealmRole.MANAGER, RealmRole.CONTRIBUTOR)
-        self._check_realm_access(
+        await self._check_realm_access(
             organization_id, realm_id, user_id, encryption_revision, can_write_roles
         )
 
-    def _check_realm_access(
+    async def _check_realm_access(
         self,
         organization_id,
         realm_id,
@@ -336,7 +287,7 @@ class BlockchainVlobComponent(BaseVlobComponent):
         expected_maintenance=False,
     ):
         try:
-            realm = self._realm_component._get_realm(organization_id, realm_id)
+            realm = await self._realm_component._get_realm(organization_id, realm_id)
         except RealmNotFoundError:
             raise VlobNotFoundError(f"Realm `{realm_id}` doesn't exist")
 
@@ -353,11 +304,11 @@ class BlockchainVlobComponent(BaseVlobComponent):
         if encryption_revision not in (None, realm.status.encryption_revision):
             raise VlobEncryptionRevisionError()
 
-    def _check_realm_in_maintenance_access(
+    async def _check_realm_in_maintenance_access(
         self, organization_id, realm_id, user_id, encryption_revision
     ):
         can_do_maintenance_roles = (RealmRole.OWNER,)
-        self._check_realm_access(
+        await self._check_realm_access(
             organization_id,
             realm_id,
             user_id,
@@ -367,11 +318,11 @@ class BlockchainVlobComponent(BaseVlobComponent):
         )
 
     async def _update_changes(self, organization_id, author, realm_id, src_id, src_version=1):
-        changes = retrieve_changes(organization_id, realm_id)
+        changes = await retrieve_changes(organization_id, realm_id)
         changes.checkpoint += 1
         changes.changes[src_id] = (author, changes.checkpoint, src_version)
         key_changes = create_key_changes(organization_id, realm_id)
-        broadcast_tx(key_changes, json.dumps(changes, cls=Encoder))
+        await broadcast_tx(key_changes, json.dumps(changes, cls=Encoder))
 
         await self._send_event(
             BackendEvent.REALM_VLOBS_UPDATED,
@@ -393,21 +344,14 @@ class BlockchainVlobComponent(BaseVlobComponent):
         timestamp: pendulum.DateTime,
         blob: bytes,
     ) -> None:
-        self._check_realm_write_access(
+        await self._check_realm_write_access(
             organization_id, realm_id, author.user_id, encryption_revision
         )
 
-        if not set_vlob_keys_exists():
-            broadcast_tx(create_key_set_vlob_keys(), json.dumps(VlobKeys(), cls=Encoder))
-
-        if (organization_id, vlob_id) in retrieve_set_vlob_keys().data:
+        if await vlob_exists(organization_id, vlob_id):
             raise VlobAlreadyExistsError()
         else:
-            key_vlob = create_key_vlob(organization_id, vlob_id)
-            broadcast_tx(key_vlob, json.dumps(Vlob(realm_id, [(blob, author, timestamp)]), cls=Encoder))
-            set_vlob_keys = retrieve_set_vlob_keys()
-            set_vlob_keys.data.append((organization_id, vlob_id))
-            broadcast_tx(create_key_set_vlob_keys(), json.dumps(set_vlob_keys, cls=Encoder))
+            await store_vlob(organization_id, vlob_id, Vlob(realm_id, [(blob, author, timestamp)]))
             await self._update_changes(organization_id, author, realm_id, vlob_id)
 
     async def read(
@@ -419,28 +363,28 @@ class BlockchainVlobComponent(BaseVlobComponent):
         version: Optional[int] = None,
         timestamp: Optional[pendulum.DateTime] = None,
     ) -> Tuple[int, bytes, DeviceID, pendulum.DateTime]:
-        vlob = get_vlob(organization_id, vlob_id)
+        head = await get_vlob_head(organization_id, vlob_id)
 
-        self._check_realm_read_access(
-            organization_id, vlob.realm_id, author.user_id, encryption_revision
+        await self._check_realm_read_access(
+            organization_id, head.realm_id, author.user_id, encryption_revision
         )
 
         if version is None:
             if timestamp is None:
-                version = vlob.current_version
+                version = head.current_version
             else:
-                for i in range(vlob.current_version, 0, -1):
-                    if vlob.data[i - 1][2] <= timestamp:
+                for i in range(head.current_version, 0, -1):
+                    if head.versions[i - 1][1] <= timestamp:
                         version = i
                         break
                 else:
                     raise VlobVersionError()
 
-        try:
-            return (version, *vlob.data[version - 1])
-
-        except IndexError:
+        if not 1 <= version <= head.current_version:
             raise VlobVersionError()
+        version_author, version_timestamp = head.versions[version - 1]
+        blob = await retrieve_vlob_version(organization_id, vlob_id, version)
+        return (version, blob, version_author, version_timestamp)
 
     async def update(
         self,
@@ -452,28 +396,32 @@ class BlockchainVlobComponent(BaseVlobComponent):
         timestamp: pendulum.DateTime,
         blob: bytes,
     ) -> None:
-        vlob = get_vlob(organization_id, vlob_id)
+        head = await get_vlob_head(organization_id, vlob_id)
 
-        self._check_realm_write_access(
-            organization_id, vlob.realm_id, author.user_id, encryption_revision
+        await self._check_realm_write_access(
+            organization_id, head.realm_id, author.user_id, encryption_revision
         )
-        if version - 1 != vlob.current_version:
+        if version - 1 != head.current_version:
             raise VlobVersionError()
-        if timestamp < vlob.data[vlob.current_version - 1][2]:
-            raise VlobTimestampError(timestamp, vlob.data[vlob.current_version - 1][2])
-        vlob.data.append((blob, author, timestamp))
-
-        key_vlob = create_key_vlob(organization_id, vlob_id)
-        value_vlob = json.dumps(vlob, cls=Encoder)
-        broadcast_tx(key_vlob, value_vlob)
-        await self._update_changes(organization_id, author, vlob.realm_id, vlob_id, version)
+        if timestamp < head.versions[head.current_version - 1][1]:
+            raise VlobTimestampError(timestamp, head.versions[head.current_version - 1][1])
+        head.versions.append((author, timestamp))
+
+        # Only the new version and the head are written
+        await broadcast_batch_tx(
+            [
+                (create_key_vlob_version(organization_id, vlob_id, version), blob),
+                (create_key_vlob(organization_id, vlob_id), json.dumps(head, cls=Encoder)),
+            ]
+        )
+        await self._update_changes(organization_id, author, head.realm_id, vlob_id, version)
 
     async def poll_changes(
         self, organization_id: OrganizationID, author: DeviceID, realm_id: UUID, checkpoint: int
     ) -> Tuple[int, Dict[UUID, int]]:
-        self._check_realm_read_access(organization_id, realm_id, author.user_id, None)
+        await self._check_realm_read_access(organization_id, realm_id, author.user_id, None)
 
-        changes = retrieve_changes(organization_id, realm_id)
+        changes = await retrieve_changes(organization_id, realm_id)
         changes_since_checkpoint = {
             src_id: src_version
             for src_id, (_, change_checkpoint, src_version) in changes.changes.items()
@@ -484,10 +432,10 @@ class BlockchainVlobComponent(BaseVlobComponent):
     async def list_versions(
         self, organization_id: OrganizationID, author: DeviceID, vlob_id: UUID
     ) -> Dict[int, Tuple[pendulum.DateTime, DeviceID]]:
-        vlobs = get_vlob(organization_id, vlob_id)
+        head = await get_vlob_head(organization_id, vlob_id)
 
-        self._check_realm_read_access(organization_id, vlobs.realm_id, author.user_id, None)
-        return {k: (v[2], v[1]) for (k, v) in enumerate(vlobs.data, 1)}
+        await self._check_realm_read_access(organization_id, head.realm_id, author.user_id, None)
+        return {k: (v[1], v[0]) for (k, v) in enumerate(head.versions, 1)}
 
     async def maintenance_get_reencryption_batch(
         self,
@@ -497,14 +445,17 @@ class BlockchainVlobComponent(BaseVlobComponent):
         encryption_revision: int,
         size: int,
     ) -> List[Tuple[UUID, int, bytes]]:
-        self._check_realm_in_maintenance_access(
+        await self._check_realm_in_maintenance_access(
             organization_id, realm_id, author.user_id, encryption_revision
         )
 
-        changes = retrieve_changes(organization_id, realm_id)
-        assert changes.reencryption
+        reencryption = await retrieve_reencryption(organization_id, realm_id)
+        assert reencryption
 
-        return changes.reencryption.get_batch(size)
+        return [
+            (vlob_id, version, await retrieve_vlob_version(organization_id, vlob_id, version))
+            for vlob_id, version in reencryption.get_batch(size)
+        ]
 
     async def maintenance_save_reencryption_batch(
         self,
@@ -514,79 +465,91 @@ class BlockchainVlobComponent(BaseVlobComponent):
         encryption_revision: int,
         batch: List[Tuple[UUID, int, bytes]],
     ) -> Tuple[int, int]:
-        self._check_realm_in_maintenance_access(
+        await self._check_realm_in_maintenance_access(
             organization_id, realm_id, author.user_id, encryption_revision
         )
 
-        changes = retrieve_changes(organization_id, realm_id)
-        assert changes.reencryption
+        reencryption = await retrieve_reencryption(organization_id, realm_id)
+        assert reencryption
 
-        total, done = changes.reencryption.save_batch(batch)
+        items = [
+            (create_key_vlob_version(organization_id, vlob_id, version), data)
+            for vlob_id, version, data in batch
+            if reencryption.save(vlob_id, version)
+        ]
+        if items:
+            # Blobs and progress are written by the same transaction
+            items.append(
+                (create_key_reencryption(organization_id, realm_id), json.dumps(reencryption, cls=Encoder))
+            )
+            await broadcast_batch_tx(items)
 
-        return total, done
+        return reencryption.get_counts()
 
 
 
 """
 To pass the test, we assume we have an empty database. Thus we need to remove transactions from Tendermint, which is something we can't do because this is a blockchain.
-Instead we set all the previous transactions to a kind of "neutral status" to remove all information provided by those transactions
-( we remove the information provide by transactions, not the transactions themselves).
-WARNING: something still missing in the reset function because is we run the test twice, one more test failed in the second run.
+Instead we delete all the keys written by the previous transactions (the transactions themselves are still part
+of the blockchain).
 """
-def reset_database():
-    if set_vlob_keys_exists():
-        vlob_keys = retrieve_set_vlob_keys()
-        for k in vlob_keys.data:
-            if vlob_exists(k[0], k[1]):
-                vlob = get_vlob(k[0], k[1])
-                broadcast_tx(create_key_vlob(k[0], k[1]), json.dumps(Vlob(vlob.realm_id), cls=Encoder))
-        broadcast_tx(create_key_set_vlob_keys(), json.dumps(VlobKeys([]), cls=Encoder))
-
-    if set_changes_keys_exists():
-        changes_keys = retrieve_set_changes_keys()
-        for k in changes_keys.data:
-            if changes_exists(k[0], k[1]):
-                broadcast_tx(create_key_changes(k[0], k[1]), json.dumps(Changes(), cls=Encoder))
-        broadcast_tx(create_key_set_changes_keys(), json.dumps(ChangesKeys([]), cls=Encoder))
-
-
-def get_vlob(organization_id, vlob_id):
-    if vlob_exists(organization_id, vlob_id):
-        return retrieve_vlob(organization_id, vlob_id)
+async def reset_database():
+    items = []
+    for key, raw_vlob_id in await write_pipeline.query_prefix(tendermint_client, create_prefix_realm_vlobs()):
+        organization_id = OrganizationID(key.split(', ')[1])
+        vlob_id = UUID(raw_vlob_id.decode('utf-8'))
+        if await vlob_exists(organization_id, vlob_id):
+            head = await get_vlob_head(organization_id, vlob_id)
+            for version in range(1, head.current_version + 1):
+                items.append((create_key_vlob_version(organization_id, vlob_id, version), b''))
+            items.append((create_key_vlob(organization_id, vlob_id), b''))
+        items.append((key, b''))
+    for key, _ in await write_pipeline.query_prefix(tendermint_client, create_prefix_changes()):
+        items.append((key, b''))
+    for key, _ in await write_pipeline.query_prefix(tendermint_client, create_prefix_reencryption()):
+        items.append((key, b''))
+    if items:
+        # An empty value deletes the key
+        await broadcast_batch_tx(items)
+    blockchain_cache.clear()
+
+
+async def get_vlob(organization_id, vlob_id):
+    if await vlob_exists(organization_id, vlob_id):
+        return await retrieve_vlob(organization_id, vlob_id)
     else:
         raise VlobNotFoundError(f"Vlob `{vlob_id}` doesn't exist")
 
 
-def retrieve_tx(key):
-    cmd = abci_addr + 'abci_query?data="' + key + '"'
-    req = requests.get(cmd)
-    raw_rep = req.json()
-    raw_rep = base64.b64decode(raw_rep['result']['response']['value']).decode('utf-8')
-    return raw_rep.replace('\'', '\"')
+async def get_vlob_head(organization_id, vlob_id):
+    head = await retrieve_vlob_head(organization_id, vlob_id)
+    if head is None:
+        raise VlobNotFoundError(f"Vlob `{vlob_id}` doesn't exist")
+    return head
 
 
-def broadcast_tx(key, value):
-    cmd = abci_addr + 'broadcast_tx_commit?tx="Key%3F' + key + '%26Value%3F' + value.replace('\"', '\'') + '"'
-    req = requests.get(cmd)
+async def retrieve_tx(key):
+    # Pending writes are read from the pipeline's overlay
+    raw_rep = await write_pipeline.query(tendermint_client, key)
+    return raw_rep.decode('utf-8')
 
 
-def vlob_exists(organization_id: OrganizationID, vlob_id: UUID):
-    raw_rep = retrieve_tx(create_key_vlob(organization_id, vlob_id))
-    return True if raw_rep != "0" else False
+async def broadcast_tx(key, value):
+    await broadcast_batch_tx([(key, value)])
 
 
-def changes_exists(organization_id: OrganizationID, realm_id: UUID):
-    raw_rep = retrieve_tx(create_key_changes(organization_id, realm_id))
-    return True if raw_rep != "0" else False
+async def broadcast_batch_tx(items):
+    # All the couples are applied by the same transaction, which is confirmed
+    # in the background (see `WritePipeline`)
+    return await write_pipeline.submit(tendermint_client, items)
 
 
-def set_vlob_keys_exists():
-    raw_rep = retrieve_tx(create_key_set_vlob_keys())
-    return True if raw_rep != "0" else False
+async def vlob_exists(organization_id: OrganizationID, vlob_id: UUID):
+    return await retrieve_vlob_head(organization_id, vlob_id) is not None
 
 
-def set_changes_keys_exists():
-    raw_rep = retrieve_tx(create_key_set_changes_keys())
+async def changes_exists(organization_id: OrganizationID, realm_id: UUID):
+    raw_rep = await retrieve_tx(create_key_changes(organization_id, realm_id))
     return True if raw_rep != "0" else False
 
 
@@ -594,48 +557,109 @@ def create_key_vlob(organization_id: OrganizationID, vlob_id: UUID):
     return '(vlob, ' + organization_id.__str__() + ', ' + vlob_id.__str__() + ')'
 
 
+def create_key_vlob_version(organization_id: OrganizationID, vlob_id: UUID, version: int):
+    return '(vlob, ' + organization_id.__str__() + ', ' + vlob_id.__str__() + ', ' + str(version) + ')'
+
+
 def create_key_changes(organization_id: OrganizationID, realm_id: UUID):
     return '(changes, ' + organization_id.__str__() + ', ' + realm_id.__str__() + ')'
 
 
-def create_key_set_vlob_keys():
-    return '(vlob_keys)'
+def create_key_reencryption(organization_id: OrganizationID, realm_id: UUID):
+    return '(reencryption, ' + organization_id.__str__() + ', ' + realm_id.__str__() + ')'
+
 
+def create_key_realm_vlob(organization_id: OrganizationID, realm_id: UUID, vlob_id: UUID):
+    # Realm index entry, keys are ordered by (organization, realm, vlob) so the
+    # vlobs of a realm are retrieved with a prefix query
+    return create_prefix_realm_vlobs(organization_id, realm_id) + vlob_id.__str__() + ')'
 
-def create_key_set_changes_keys():
-    return '(changes_keys)'
 
+def create_prefix_realm_vlobs(organization_id: Optional[OrganizationID] = None, realm_id: Optional[UUID] = None):
+    prefix = '(realm_vlobs, '
+    if organization_id is not None:
+        prefix += organization_id.__str__() + ', '
+        if realm_id is not None:
+            prefix += realm_id.__str__() + ', '
+    return prefix
 
-def retrieve_changes(organization_id: OrganizationID, realm_id: UUID):
-    key = create_key_changes(organization_id, realm_id)
-    if not set_changes_keys_exists():
-        broadcast_tx(create_key_set_changes_keys(), json.dumps(ChangesKeys(), cls=Encoder))
-    changes_keys = retrieve_set_changes_keys()
-    if changes_exists(organization_id, realm_id):
-        if not ((organization_id, realm_id)) in changes_keys.data:
-            changes_keys.data.append((organization_id, realm_id))
-            broadcast_tx(create_key_set_changes_keys(), json.dumps(changes_keys, cls=Encoder))
-        raw_rep = retrieve_tx(key)
+
+def create_prefix_changes():
+    return '(changes, '
+
+
+def create_prefix_reencryption():
+    return '(reencryption, '
+
+
+async def retrieve_changes(organization_id: OrganizationID, realm_id: UUID):
+    async def _fetch():
+        raw_rep = await retrieve_tx(create_key_changes(organization_id, realm_id))
+        if raw_rep == "0":
+            return Changes()
         return ChangesDecoder().decode(raw_rep, )
-    else:
-        changes_keys.data.append((organization_id, realm_id))
-        broadcast_tx(create_key_set_changes_keys(), json.dumps(changes_keys, cls=Encoder))
-        return Changes()
+
+    return await blockchain_cache.get(create_key_changes(organization_id, realm_id), _fetch)
+
+
+async def retrieve_reencryption(organization_id: OrganizationID, realm_id: UUID):
+    async def _fetch():
+        raw_rep = await retrieve_tx(create_key_reencryption(organization_id, realm_id))
+        if raw_rep == "0":
+            return None
+        return ReencryptionDecoder().decode(raw_rep, )
+
+    return await blockchain_cache.get(create_key_reencryption(organization_id, realm_id), _fetch)
 
 
-def retrieve_vlob(organization_id: OrganizationID, vlob_id: UUID):
-    key = create_key_vlob(organization_id, vlob_id)
-    raw_rep = retrieve_tx(key)
-    return VlobDecoder().decode(raw_rep, )
+async def retrieve_vlob_head(organization_id: OrganizationID, vlob_id: UUID):
+    async def _fetch():
+        raw_rep = await retrieve_tx(create_key_vlob(organization_id, vlob_id))
+        if raw_rep == "0":
+            return None
+        return VlobHeadDecoder().decode(raw_rep, )
 
+    return await blockchain_cache.get(create_key_vlob(organization_id, vlob_id), _fetch)
 
-def retrieve_set_vlob_keys():
-    key = create_key_set_vlob_keys()
-    raw_rep = retrieve_tx(key)
-    return VlobKeysDecoder().decode(raw_rep, )
+
+async def retrieve_vlob(organization_id: OrganizationID, vlob_id: UUID):
+    head = await retrieve_vlob_head(organization_id, vlob_id)
+    vlob = Vlob(head.realm_id)
+    for version, (author, timestamp) in enumerate(head.versions, 1):
+        blob = await retrieve_vlob_version(organization_id, vlob_id, version)
+        vlob.data.append((blob, author, timestamp))
+    return vlob
+
+
+async def retrieve_vlob_version(organization_id: OrganizationID, vlob_id: UUID, version: int):
+    # Blobs are stored raw (the head tells which versions exist)
+    key = create_key_vlob_version(organization_id, vlob_id, version)
+    return await blockchain_cache.get(key, lambda: write_pipeline.query(tendermint_client, key))
+
+
+async def store_vlob(organization_id: OrganizationID, vlob_id: UUID, vlob: Vlob):
+    head = VlobHead(vlob.realm_id, [(author, timestamp) for _, author, timestamp in vlob.data])
+    items = [
+        (create_key_vlob_version(organization_id, vlob_id, version), blob)
+        for version, (blob, _, _) in enumerate(vlob.data, 1)
+    ]
+    items.append((create_key_vlob(organization_id, vlob_id), json.dumps(head, cls=Encoder)))
+    items.append((create_key_realm_vlob(organization_id, vlob.realm_id, vlob_id), vlob_id.__str__()))
+    await broadcast_batch_tx(items)
+
+
+async def retrieve_realm_vlob_ids(organization_id: OrganizationID, realm_id: Optional[UUID] = None):
+    # Only the vlobs of the realm (or of the organization if no realm is provided) are scanned
+    return [
+        UUID(raw_vlob_id.decode('utf-8'))
+        for _, raw_vlob_id in await write_pipeline.query_prefix(
+            tendermint_client, create_prefix_realm_vlobs(organization_id, realm_id)
+        )
+    ]
 
 
-def retrieve_set_changes_keys():
-    key = create_key_set_changes_keys()
-    raw_rep = retrieve_tx(key)
-    return ChangesKeysDecoder().decode(raw_rep, )
+async def retrieve_realm_vlobs(organization_id: OrganizationID, realm_id: Optional[UUID] = None):
+    realm_vlobs = {}
+    for vlob_id in await retrieve_realm_vlob_ids(organization_id, realm_id):
+        realm_vlobs[vlob_id] = await retrieve_vlob(organization_id, vlob_id)
+    return realm_vlobs
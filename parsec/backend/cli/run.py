@@ -24,6 +24,7 @@ from parsec.backend.config import (
     RAID0BlockStoreConfig,
     RAID1BlockStoreConfig,
     RAID5BlockStoreConfig,
+    DEFAULT_EPOCH_MAX_OPERATIONS,
 )
 from parsec.core.types import BackendAddr
 
@@ -332,6 +333,31 @@ with an `application/json` body with the following fields:
 organization_id, device_id, device_label (can be null), human_email (can be null), human_label (can be null)
 """,
 )
+@click.option(
+    "--epoch-interval",
+    envvar="PARSEC_EPOCH_INTERVAL",
+    type=float,
+    default=None,
+    help="Close an organization's epoch this many seconds after its first operation",
+)
+@click.option(
+    "--epoch-max-operations",
+    envvar="PARSEC_EPOCH_MAX_OPERATIONS",
+    type=int,
+    default=DEFAULT_EPOCH_MAX_OPERATIONS,
+    show_default=True,
+    help="Close an organization's epoch once this many vlob operations have been made",
+)
+@click.option(
+    "--epoch-max-bytes",
+    envvar="PARSEC_EPOCH_MAX_BYTES",
+    type=int,
+    default=None,
+    help=(
+        "Close an organization's epoch once this many bytes of vlob data"
+        " have been read or written"
+    ),
+)
 @click.option(
     "--backend-addr",
     envvar="PARSEC_BACKEND_ADDR",
@@ -455,6 +481,9 @@ def run_cmd(
     administration_token,
     spontaneous_organization_bootstrap,
     organization_bootstrap_webhook,
+    epoch_interval,
+    epoch_max_operations,
+    epoch_max_bytes,
     backend_addr,
     email_host,
     email_port,
@@ -522,6 +551,9 @@ def run_cmd(
             forward_proto_enforce_https=forward_proto_enforce_https,
             backend_addr=backend_addr,
             debug=debug,
+            epoch_interval=epoch_interval,
+            epoch_max_operations=epoch_max_operations,
+            epoch_max_bytes=epoch_max_bytes,
         )
 
         click.echo(
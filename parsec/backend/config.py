@@ -89,6 +89,9 @@ class MockedEmailConfig:
 EmailConfig = Union[SmtpEmailConfig, MockedEmailConfig]
 
 
+DEFAULT_EPOCH_MAX_OPERATIONS = 4
+
+
 @attr.s(slots=True, frozen=True, auto_attribs=True)
 class BackendConfig:
     administration_token: str
@@ -109,6 +112,12 @@ class BackendConfig:
 
     debug: bool
 
+    # An organization's epoch is closed as soon as one of those limits is
+    # reached (`None` disables the limit)
+    epoch_interval: Optional[float] = None  # In seconds
+    epoch_max_operations: Optional[int] = DEFAULT_EPOCH_MAX_OPERATIONS
+    epoch_max_bytes: Optional[int] = None
+
     @property
     def db_type(self):
         if self.db_url.upper() == "MOCKED":
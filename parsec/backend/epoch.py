@@ -0,0 +1,177 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
+
+import attr
+import trio
+from typing import Dict, Optional
+from structlog import get_logger
+
+from parsec.api.protocol import DeviceID, OrganizationID
+from parsec.backend.config import BackendConfig
+from parsec.backend.tendermint import TendermintError
+
+
+logger = get_logger()
+
+
+# Delay before trying again to close an epoch after a failure (seconds)
+EPOCH_CLOSE_RETRY_DELAY = 5
+
+
+@attr.s(slots=True, auto_attribs=True)
+class OrganizationEpoch:
+    # Number of the epoch currently open
+    epoch: int = 0
+    operations: int = 0
+    bytes: int = 0
+    # Time of the first operation of the epoch (trio clock)
+    started_at: Optional[float] = None
+    # Author of the latest operation, notified of the epoch end
+    last_author: Optional[DeviceID] = None
+    end_requested: bool = False
+    closing: bool = False
+    # Closing the epoch failed, it is not retried before this time (trio clock)
+    retry_at: Optional[float] = None
+
+
+class EpochScheduler:
+    """
+    Decide when the epoch of each organization ends: after a given time
+    since its first operation, a given number of vlob operations or a given
+    volume of vlob data.
+
+    Vlob operations are only recorded here, the epochs are closed by the
+    `run` background task so the request reaching a limit is not delayed.
+    """
+
+    def __init__(self, config: BackendConfig):
+        self.interval = config.epoch_interval
+        self.max_operations = config.epoch_max_operations
+        self.max_bytes = config.epoch_max_bytes
+        self._vlob_component = None
+        self._organizations: Dict[OrganizationID, OrganizationEpoch] = {}
+        self._wakeup = trio.Event()
+
+    def register_components(self, vlob, **other_components):
+        self._vlob_component = vlob
+
+    def get_epoch(self, organization_id: OrganizationID) -> int:
+        """
+        Number of the epoch currently open for the organization (it only
+        changes once the epoch has been successfully closed).
+        """
+        try:
+            return self._organizations[organization_id].epoch
+        except KeyError:
+            return 0
+
+    def record_operation(
+        self, organization_id: OrganizationID, author: DeviceID, size: int = 0
+    ) -> None:
+        """
+        Called for each vlob operation, `size` being the size of the blob
+        written or read.
+        """
+        state = self._organizations.setdefault(organization_id, OrganizationEpoch())
+        state.operations += 1
+        state.bytes += size
+        state.last_author = author
+        if state.started_at is None:
+            state.started_at = trio.current_time()
+            if self.interval is not None:
+                # New deadline to wait for
+                self._wakeup.set()
+        if self._limit_reached(state):
+            self._wakeup.set()
+
+    def end_epoch(self, organization_id: OrganizationID) -> None:
+        """
+        Close the organization's epoch regardless of the limits (nothing is
+        done if no operation has been made since the previous one).
+        """
+        state = self._organizations.get(organization_id)
+        if state and state.operations:
+            state.end_requested = True
+            self._wakeup.set()
+
+    def _limit_reached(self, state: OrganizationEpoch) -> bool:
+        return (
+            state.end_requested
+            or (self.max_operations is not None and state.operations >= self.max_operations)
+            or (self.max_bytes is not None and state.bytes >= self.max_bytes)
+            or (
+                self.interval is not None
+                and state.started_at is not None
+                and trio.current_time() >= state.started_at + self.interval
+            )
+        )
+
+    def _can_close(self, state: OrganizationEpoch) -> bool:
+        return (
+            not state.closing
+            and (state.retry_at is None or trio.current_time() >= state.retry_at)
+            and self._limit_reached(state)
+        )
+
+    def _next_deadline(self) -> float:
+        deadlines = []
+        for state in self._organizations.values():
+            if state.closing:
+                continue
+            if state.retry_at is not None:
+                deadlines.append(state.retry_at)
+            elif self.interval is not None and state.started_at is not None:
+                deadlines.append(state.started_at + self.interval)
+        return min(deadlines, default=float("inf"))
+
+    async def run(self) -> None:
+        async with trio.open_nursery() as nursery:
+            while True:
+                with trio.move_on_at(self._next_deadline()):
+                    await self._wakeup.wait()
+                self._wakeup = trio.Event()
+                for organization_id, state in self._organizations.items():
+                    if self._can_close(state):
+                        state.closing = True
+                        nursery.start_soon(self._close_epoch, organization_id, state)
+
+    async def _close_epoch(
+        self, organization_id: OrganizationID, state: OrganizationEpoch
+    ) -> None:
+        epoch = state.epoch
+        author = state.last_author
+        operations, size, started_at = state.operations, state.bytes, state.started_at
+        # Operations recorded from now on are part of the next epoch, which
+        # starts as soon as the vlob component has taken its snapshot (i.e.
+        # before the first await of `close_epoch`)
+        state.operations = 0
+        state.bytes = 0
+        state.started_at = None
+        state.end_requested = False
+        try:
+            await self._vlob_component.close_epoch(organization_id, epoch, author)
+        except Exception as exc:
+            if isinstance(exc, TendermintError):
+                logger.error(
+                    "Cannot close epoch", organization_id=organization_id, epoch=epoch, exc_info=exc
+                )
+            else:
+                logger.exception(
+                    "Unexpected error while closing epoch",
+                    organization_id=organization_id,
+                    epoch=epoch,
+                )
+            # The epoch stays open with the operations recorded during the
+            # attempt, closing it is tried again later
+            state.operations += operations
+            state.bytes += size
+            if started_at is not None:
+                state.started_at = started_at
+            state.end_requested = True
+            state.retry_at = trio.current_time() + EPOCH_CLOSE_RETRY_DELAY
+        else:
+            state.epoch += 1
+            state.retry_at = None
+        finally:
+            state.closing = False
+            # Limits may have been reached again in the meantime
+            self._wakeup.set()
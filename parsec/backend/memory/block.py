@@ -5,6 +5,7 @@ import attr
 
 from parsec.api.protocol import DeviceID, OrganizationID
 from parsec.api.protocol import RealmRole
+from parsec.crypto import HashDigest
 from parsec.backend.realm import BaseRealmComponent, RealmNotFoundError
 from parsec.backend.blockstore import BaseBlockStoreComponent
 from parsec.backend.block import (
@@ -87,20 +88,33 @@ class MemoryBlockComponent(BaseBlockComponent):
 
 
 class MemoryBlockStoreComponent(BaseBlockStoreComponent):
+    """
+    Blocks are stored by content (digest of the ciphertext), each block id
+    being an alias of it: identical blocks uploaded under several ids are
+    only stored once.
+    """
+
     def __init__(self):
-        self._blocks = {}
+        # (organization, block id) -> digest
+        self._aliases = {}
+        # (organization, digest) -> block
+        self._contents = {}
 
     async def read(self, organization_id: OrganizationID, block_id: UUID) -> bytes:
         try:
-            return self._blocks[(organization_id, block_id)]
+            digest = self._aliases[(organization_id, block_id)]
 
         except KeyError:
             raise BlockNotFoundError()
 
+        return self._contents[(organization_id, digest)]
+
     async def create(self, organization_id: OrganizationID, block_id: UUID, block: bytes) -> None:
         key = (organization_id, block_id)
-        if key in self._blocks:
+        if key in self._aliases:
             # Should not happen if client play with uuid randomness
             raise BlockAlreadyExistsError()
 
-        self._blocks[key] = block
+        digest = HashDigest.from_data(block)
+        self._contents.setdefault((organization_id, digest), block)
+        self._aliases[key] = digest
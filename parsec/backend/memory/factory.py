@@ -8,6 +8,7 @@ from parsec.event_bus import EventBus
 from parsec.backend.config import BackendConfig
 from parsec.backend.blockstore import blockstore_factory
 from parsec.backend.events import EventsComponent
+from parsec.backend.epoch import EpochScheduler
 from parsec.backend.memory.organization import MemoryOrganizationComponent
 from parsec.backend.memory.ping import MemoryPingComponent
 from parsec.backend.memory.user import MemoryUserComponent
@@ -44,6 +45,7 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
     block = MemoryBlockComponent()
     blockstore = blockstore_factory(config.blockstore_config)
     events = EventsComponent(realm, send_event=_send_event)
+    epoch = EpochScheduler(config)
 
     components = {
         "events": events,
@@ -58,12 +60,14 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
         "ping": ping,
         "block": block,
         "blockstore": blockstore,
+        "epoch": epoch,
     }
-    for component in (organization, user, invite, message, realm, vlob, ping, block):
+    for component in (organization, user, invite, message, realm, vlob, ping, block, epoch):
         component.register_components(**components)
 
     async with trio.open_service_nursery() as nursery:
         nursery.start_soon(_dispatch_event)
+        nursery.start_soon(epoch.run)
         try:
             yield components
 
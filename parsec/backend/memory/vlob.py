@@ -1,15 +1,18 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
 import attr
+import bisect
+import struct
 import pendulum
 from uuid import UUID
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Set
 from collections import defaultdict
 
 from parsec.backend.backend_events import BackendEvent
 from parsec.api.protocol import DeviceID, OrganizationID
 from parsec.api.protocol import RealmRole
 from parsec.backend.realm import BaseRealmComponent, RealmNotFoundError
+from parsec.backend.epoch import EpochScheduler
 from parsec.backend.vlob import (
     BaseVlobComponent,
     VlobAccessError,
@@ -23,31 +26,11 @@ from parsec.backend.vlob import (
 )
 
 import json
-from json import JSONEncoder, JSONDecoder
+from json import JSONEncoder
 import base64
 from hashlib import sha256
-import requests
 
-epoch = 0
-operations_per_epoch = 4
-abci_addr = 'http://localhost:26657/'
-
-
-class CheckpointEpoch:
-    # (epoch, hash, version)
-    checkpoints: List[Tuple[int, str, int]]
-
-    def __init__(self, checkpoints=[]):
-        self.checkpoints = checkpoints
-
-
-class CheckpointEpochDecoder(JSONDecoder):
-    def decode(self, obj):
-        json_obj = json.loads(obj)
-        list_checkpoints = []
-        for elt in json_obj['checkpoints']:
-            list_checkpoints.append((int(elt['epoch']), str(elt['hash']), int(elt['version'])))
-        return CheckpointEpoch(list_checkpoints)
+from parsec.backend.tendermint import tendermint_client, encode_tx
 
 
 class ServerOperation:
@@ -61,11 +44,64 @@ class ServerOperation:
         return str(self.operation)
 
 
+class AggregatedReads(ServerOperation):
+    """
+    Consecutive reads of the same version logged as a single operation.
+
+    The reads (author, timestamp and signature) are the leaves of a Merkle
+    tree of which the root takes the place of the operation's signature, so
+    the hash chain covers all of them while each read can still be proven to
+    its author with an inclusion proof. Author and timestamp are the ones of
+    the last read.
+    """
+
+    def __init__(self, first_read: ServerOperation):
+        version, author, timestamp, state, hash_prev_digest, signature, _ = first_read.operation
+        self.version = version
+        self.state = state
+        self.hash_prev_digest = hash_prev_digest
+        self.reads: List[Tuple[DeviceID, pendulum.DateTime, bytes]] = [(author, timestamp, signature)]
+        self._levels = None
+
+    def add_read(self, author, timestamp, signature, state):
+        self.reads.append((author, timestamp, signature))
+        self.state = state
+        self._levels = None
+
+    @property
+    def levels(self):
+        # Only built when needed, not for each read
+        if self._levels is None:
+            self._levels = merkle_levels([read_leaf(*read) for read in self.reads])
+        return self._levels
+
+    @property
+    def root(self):
+        return self.levels[-1][0].hex()
+
+    def proof(self, index):
+        return merkle_proof(self.levels, index)
+
+    @property
+    def operation(self):
+        author, timestamp, _ = self.reads[-1]
+        return (
+            self.version, author, timestamp, self.state, self.hash_prev_digest,
+            self.root.encode("ascii"), True
+        )
+
+
 @attr.s
 class Vlob:
     realm_id: UUID = attr.ib()
     data: List[Tuple[bytes, DeviceID, pendulum.DateTime]] = attr.ib(factory=list)
     operations: List[ServerOperation] = attr.ib(factory=list)
+    # Position in `operations` of the write of each version, kept up to date
+    # lazily by `_index_operations`
+    _write_positions: List[int] = attr.ib(factory=list, init=False, repr=False, eq=False)
+    _indexed_operations: int = attr.ib(default=0, init=False, repr=False, eq=False)
+    # Operations part of a closed epoch, which can't be modified anymore
+    _sealed_operations: int = attr.ib(default=0, init=False, repr=False, eq=False)
 
     @property
     def current_version(self):
@@ -75,6 +111,193 @@ class Vlob:
     def current_operation(self):
         return len(self.operations)
 
+    def seal(self):
+        """
+        Called when the epoch is closed: the last operation may have been
+        checkpointed, hence further reads are not aggregated with it.
+        """
+        self._sealed_operations = len(self.operations)
+
+    def add_operation(self, version, author, timestamp, signature, is_read_op):
+        """
+        Only the new operation is hashed (chained with the state of the
+        previous one), so the cost doesn't depend on the vlob history.
+
+        A read following a read of the same version (in the same epoch) is
+        aggregated with it (see `AggregatedReads`).
+        """
+        if is_read_op and len(self.operations) > self._sealed_operations:
+            last_op = self.operations[-1]
+            if last_op.operation[6] and last_op.operation[0] == version:
+                if not isinstance(last_op, AggregatedReads):
+                    last_op = self.operations[-1] = AggregatedReads(last_op)
+                state = hash_operation_state(
+                    last_op.state, version, author, timestamp,
+                    sha256(self.data[version - 1][0]).digest(), True)
+                last_op.add_read(author, timestamp, signature, state)
+                return last_op
+
+        hash_obj_after_operation = "0"
+        hash_prev_digest = "0"
+        if self.operations:
+            last_op = self.operations[-1]
+            hash_obj_after_operation = last_op.operation[3]
+            hash_prev_digest = sha256(
+                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+        hash_obj_after_operation = hash_operation_state(
+            hash_obj_after_operation, version, author, timestamp,
+            sha256(self.data[version - 1][0]).digest(), is_read_op)
+        new_operation = ServerOperation(
+            (version, author, timestamp, hash_obj_after_operation, hash_prev_digest, signature, is_read_op))
+        self.operations.append(new_operation)
+        return new_operation
+
+    def _index_operations(self):
+        for position in range(self._indexed_operations, len(self.operations)):
+            # (operation[6] = is_read_op)
+            if not self.operations[position].operation[6]:
+                self._write_positions.append(position)
+        self._indexed_operations = len(self.operations)
+
+    def history_page(
+        self,
+        after_version: int,
+        before_version: Optional[int],
+        cursor: Optional[int] = None,
+        limit: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[List[ServerOperation], Optional[int]]:
+        """
+        Operations on the versions from `after_version` to `before_version`
+        (included), in log order, starting at the log position `cursor` and
+        stopping before the log position `end` (the end of the log if None).
+        Returns at most `limit` operations along with the cursor of the next
+        page (None if there is none).
+
+        An operation on a given version always comes after the write of the
+        previous version, so the scan starts there instead of at the
+        beginning of the log.
+        """
+        self._index_operations()
+        if before_version is None:
+            before_version = self.current_version
+        if after_version <= 1:
+            start = 0
+        elif after_version - 2 < len(self._write_positions):
+            start = self._write_positions[after_version - 2] + 1
+        else:
+            start = len(self.operations)
+        if cursor is not None:
+            start = max(start, cursor)
+
+        if end is None:
+            end = len(self.operations)
+
+        page = []
+        for position in range(start, end):
+            if limit is not None and len(page) >= limit:
+                return page, position
+            op = self.operations[position]
+            if after_version <= op.operation[0] <= before_version:
+                page.append(op)
+        return page, None
+
+
+def hash_operation_state(prev_state, version, author, timestamp, blob_digest, is_read_op):
+    # Fixed layout record: previous state, version, read flag and digest of the
+    # version's blob, followed by author and timestamp
+    prev_state = bytes.fromhex(prev_state) if prev_state != "0" else bytes(32)
+    record = struct.pack("!32sQ?32s", prev_state, version, is_read_op, blob_digest)
+    record += bytes(f"{author}|{timestamp}", encoding='utf-8')
+    return sha256(record).hexdigest()
+
+
+def merkle_leaf(vlob_id, op_hash, version):
+    # Leaves and nodes are domain separated so a node can't be passed off as a leaf
+    return sha256(b"\x00" + bytes(f"{vlob_id}|{op_hash}|{version}", encoding='utf-8')).digest()
+
+
+def read_leaf(author, timestamp, signature):
+    return sha256(b"\x00" + bytes(f"{author}|{timestamp}|", encoding='utf-8') + signature).digest()
+
+
+def merkle_node(left, right):
+    return sha256(b"\x01" + left + right).digest()
+
+
+def merkle_levels(leaves):
+    levels = [leaves]
+    level = leaves
+    while len(level) > 1:
+        # A node without sibling is promoted as is to the upper level
+        level = [
+            merkle_node(*level[i:i + 2]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+        levels.append(level)
+    return levels
+
+
+def merkle_proof(levels, index):
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling].hex(), sibling < index))
+        index //= 2
+    return proof
+
+
+def _merkle_root_from_proof(node, proof):
+    for sibling, sibling_is_left in proof:
+        sibling = bytes.fromhex(sibling)
+        node = merkle_node(sibling, node) if sibling_is_left else merkle_node(node, sibling)
+    return node.hex()
+
+
+def verify_merkle_proof(root, vlob_id, op_hash, version, proof):
+    return _merkle_root_from_proof(merkle_leaf(vlob_id, op_hash, version), proof) == root
+
+
+def verify_read_proof(root, author, timestamp, signature, proof):
+    """
+    Check a read is part of an aggregated reads operation of which `root`
+    is the signature.
+    """
+    return _merkle_root_from_proof(read_leaf(author, timestamp, signature), proof) == root
+
+
+@attr.s
+class EpochCheckpoints:
+    """
+    Merkle tree over the checkpoints (last operation digest and version) of
+    the vlobs of an organization at the end of an epoch. Only the root is
+    published on the blockchain, each vlob checkpoint is then proven with
+    an inclusion proof.
+    """
+
+    epoch: int = attr.ib()
+    # vlob_id -> (leaf index, hash of the last operation, version)
+    checkpoints: Dict[UUID, Tuple[int, str, int]] = attr.ib()
+    levels: List[List[bytes]] = attr.ib()
+
+    @classmethod
+    def build(cls, epoch, leaves):
+        checkpoints = {}
+        level = []
+        for index, (vlob_id, op_hash, version) in enumerate(leaves):
+            checkpoints[vlob_id] = (index, op_hash, version)
+            level.append(merkle_leaf(vlob_id, op_hash, version))
+        return cls(epoch, checkpoints, merkle_levels(level))
+
+    @property
+    def root(self):
+        return self.levels[-1][0].hex()
+
+    def proof(self, vlob_id):
+        index, _, _ = self.checkpoints[vlob_id]
+        return merkle_proof(self.levels, index)
+
 
 class Encoder(JSONEncoder):
     def default(self, obj):
@@ -98,11 +321,6 @@ class Encoder(JSONEncoder):
                     'hash_prev_digest': obj.operation[4].__str__(),
                     'signature': base64.b64encode(obj.operation[5]).decode('utf-8'),
                     'is_read_op': obj.operation[6].__str__()}
-        if isinstance(obj, CheckpointEpoch):
-            checkpoint_epoch_string = []
-            for c in obj.checkpoints:
-                checkpoint_epoch_string.append({'epoch': c[0].__str__(), 'hash': c[1], 'version': c[2].__str__()})
-            return {'checkpoints': checkpoint_epoch_string}
 
 
 class Reencryption:
@@ -171,11 +389,28 @@ class MemoryVlobComponent(BaseVlobComponent):
     def __init__(self, send_event):
         self._send_event = send_event
         self._realm_component = None
+        self._epoch_scheduler = None
         self._vlobs = {}
         self._per_realm_changes = defaultdict(Changes)
+        # Per organization, epoch -> Merkle tree of the checkpoints of the vlobs
+        # modified during this epoch (append only)
+        self._epoch_checkpoints: Dict[OrganizationID, Dict[int, EpochCheckpoints]] = defaultdict(
+            dict
+        )
+        # Per (organization, vlob), sorted epochs in which the vlob has been checkpointed
+        self._vlob_checkpoint_epochs: Dict[Tuple[OrganizationID, UUID], List[int]] = defaultdict(
+            list
+        )
+        # Per (organization, vlob, epoch), log position of the checkpointed operation
+        self._checkpoint_positions: Dict[Tuple[OrganizationID, UUID, int], int] = {}
+        # Per organization, vlobs with operations since the last closed epoch
+        self._dirty_vlobs: Dict[OrganizationID, Set[UUID]] = defaultdict(set)
 
-    def register_components(self, realm: BaseRealmComponent, **other_components):
+    def register_components(
+        self, realm: BaseRealmComponent, epoch: EpochScheduler, **other_components
+    ):
         self._realm_component = realm
+        self._epoch_scheduler = epoch
 
     def _maintenance_reencryption_start_hook(self, organization_id, realm_id, encryption_revision):
         changes = self._per_realm_changes[(organization_id, realm_id)]
@@ -265,6 +500,56 @@ class MemoryVlobComponent(BaseVlobComponent):
             expected_maintenance=True,
         )
 
+    def _record_operation(self, organization_id, author, vlob_id, size):
+        self._dirty_vlobs[organization_id].add(vlob_id)
+        self._epoch_scheduler.record_operation(organization_id, author, size)
+
+    async def close_epoch(self, organization_id, epoch, author):
+        """
+        Checkpoints of the vlobs with operations during the epoch are gathered
+        in a Merkle tree of which only the root is published, the other vlobs
+        keep their checkpoint from a previous epoch. The epoch is finished
+        (the checkpoints are recorded and the clients notified) once the
+        transaction is committed, on failure the vlobs are kept for the next
+        attempt of the `EpochScheduler`.
+        """
+        dirty_vlobs = self._dirty_vlobs.pop(organization_id, set())
+        leaves = []
+        positions = {}
+        for vlob_id in dirty_vlobs:
+            vlob = self._vlobs.get((organization_id, vlob_id))
+            if not vlob or not vlob.operations:
+                continue
+            vlob.seal()
+            positions[vlob_id] = len(vlob.operations) - 1
+            last_op = vlob.operations[-1]
+            leaves.append((vlob_id, sha256(
+                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(),
+                last_op.operation[0]))
+        if not leaves:
+            return
+        epoch_checkpoints = EpochCheckpoints.build(epoch, leaves)
+
+        try:
+            tx_hash = await broadcast_batch_tx(
+                [(create_key_epoch_root(organization_id, epoch), epoch_checkpoints.root)]
+            )
+            await wait_tx_committed(tx_hash)
+        except BaseException:
+            # Sealed vlobs stay so, this only prevents the aggregation of reads
+            self._dirty_vlobs[organization_id] |= dirty_vlobs
+            raise
+        self._epoch_checkpoints[organization_id][epoch] = epoch_checkpoints
+        for vlob_id, _, _ in leaves:
+            bisect.insort(self._vlob_checkpoint_epochs[(organization_id, vlob_id)], epoch)
+            self._checkpoint_positions[(organization_id, vlob_id, epoch)] = positions[vlob_id]
+        await self._send_event(
+            BackendEvent.REALM_EPOCH_FINISHED,
+            organization_id=organization_id,
+            author=author,
+            epoch=epoch + 1,
+        )
+
     async def _update_changes(self, organization_id, author, realm_id, src_id, src_version=1):
         changes = self._per_realm_changes[(organization_id, realm_id)]
         changes.checkpoint += 1
@@ -293,20 +578,14 @@ class MemoryVlobComponent(BaseVlobComponent):
         self._check_realm_write_access(
             organization_id, realm_id, author.user_id, encryption_revision
         )
-        global epoch
 
         key = (organization_id, vlob_id)
         if key in self._vlobs:
             raise VlobAlreadyExistsError()
 
         self._vlobs[key] = Vlob(realm_id, [(blob, author, timestamp)], [])
-
-        hash_obj_after_operation = sha256(
-            bytes(json.dumps(self._vlobs[key], cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-        hash_prev_digest = "0"
-        new_operation = ServerOperation(
-            (1, author, timestamp, hash_obj_after_operation, hash_prev_digest, signature, False))
-        self._vlobs[key].operations.append(new_operation)
+        self._vlobs[key].add_operation(1, author, timestamp, signature, False)
+        self._record_operation(organization_id, author, vlob_id, len(blob))
 
         await self._update_changes(organization_id, author, realm_id, vlob_id)
 
@@ -320,7 +599,6 @@ class MemoryVlobComponent(BaseVlobComponent):
         version: Optional[int] = None,
         timestamp: Optional[pendulum.DateTime] = None,
     ) -> Tuple[int, bytes, DeviceID, pendulum.DateTime]:
-        global epoch
         vlob = self._get_vlob(organization_id, vlob_id)
 
         self._check_realm_read_access(
@@ -338,37 +616,13 @@ class MemoryVlobComponent(BaseVlobComponent):
                 else:
                     raise VlobVersionError()
 
-        hash_obj_after_operation = sha256(bytes(json.dumps(vlob, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-        hash_prev_digest = "0"
-        if vlob.current_operation != 0:
-            hash_prev_digest = sha256(bytes(json.dumps(vlob.operations[vlob.current_operation - 1], cls=Encoder),
-                                            encoding='utf-8')).hexdigest().__str__()
-        new_operation = ServerOperation(
-            (version, author, timestamp, hash_obj_after_operation, hash_prev_digest, signature, True))
-        vlob.operations.append(new_operation)
-        if vlob.current_operation % operations_per_epoch == 0:
-            for k in self._vlobs:
-                if len(self._get_vlob(k[0], k[1]).operations) != 0:
-                    last_op = self._get_vlob(k[0], k[1]).operations[self._get_vlob(k[0], k[1]).current_operation - 1]
-                    list_checkpoints = retrieve_checkpoint(k[0], k[1])
-                    list_checkpoints.checkpoints.append((epoch, sha256(
-                        bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-                    key = create_key_checkpoints(k[0], k[1])
-                    value = json.dumps(list_checkpoints, cls=Encoder)
-                    broadcast_tx(key, value)
-            epoch += 1
-            await self._send_event(
-                BackendEvent.REALM_EPOCH_FINISHED,
-                organization_id=organization_id,
-                author=author,
-                epoch=epoch,
-            )
+        if not 0 < version <= vlob.current_version:
+            raise VlobVersionError()
 
-        try:
-            return (version, *vlob.data[version - 1])
+        vlob.add_operation(version, author, timestamp, signature, True)
+        self._record_operation(organization_id, author, vlob_id, len(vlob.data[version - 1][0]))
 
-        except IndexError:
-            raise VlobVersionError()
+        return (version, *vlob.data[version - 1])
 
     async def update(
         self,
@@ -381,7 +635,6 @@ class MemoryVlobComponent(BaseVlobComponent):
         blob: bytes,
         signature: bytes = b"0",
     ) -> None:
-        global epoch
         vlob = self._get_vlob(organization_id, vlob_id)
 
         self._check_realm_write_access(
@@ -393,32 +646,8 @@ class MemoryVlobComponent(BaseVlobComponent):
         if timestamp < vlob.data[vlob.current_version - 1][2]:
             raise VlobTimestampError(timestamp, vlob.data[vlob.current_version - 1][2])
         vlob.data.append((blob, author, timestamp))
-
-        hash_obj_after_operation = sha256(bytes(json.dumps(vlob, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-        hash_prev_digest = "0"
-        if vlob.current_operation != 0:
-            hash_prev_digest = sha256(bytes(json.dumps(vlob.operations[vlob.current_operation - 1], cls=Encoder),
-                                            encoding='utf-8')).hexdigest().__str__()
-        new_operation = ServerOperation(
-            (version, author, timestamp, hash_obj_after_operation, hash_prev_digest, signature, False))
-        vlob.operations.append(new_operation)
-        if vlob.current_operation % operations_per_epoch == 0:
-            for k in self._vlobs:
-                if len(self._get_vlob(k[0], k[1]).operations) != 0:
-                    last_op = self._get_vlob(k[0], k[1]).operations[self._get_vlob(k[0], k[1]).current_operation - 1]
-                    list_checkpoints = retrieve_checkpoint(k[0], k[1])
-                    list_checkpoints.checkpoints.append((epoch, sha256(
-                        bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-                    key = create_key_checkpoints(k[0], k[1])
-                    value = json.dumps(list_checkpoints, cls=Encoder)
-                    broadcast_tx(key, value)
-            epoch += 1
-            await self._send_event(
-                BackendEvent.REALM_EPOCH_FINISHED,
-                organization_id=organization_id,
-                author=author,
-                epoch=epoch,
-            )
+        vlob.add_operation(version, author, timestamp, signature, False)
+        self._record_operation(organization_id, author, vlob_id, len(blob))
         await self._update_changes(organization_id, author, vlob.realm_id, vlob_id, version)
 
     async def poll_changes(
@@ -442,19 +671,66 @@ class MemoryVlobComponent(BaseVlobComponent):
         self._check_realm_read_access(organization_id, vlobs.realm_id, author.user_id, None)
         return {k: (v[2], v[1]) for (k, v) in enumerate(vlobs.data, 1)}
 
-    async def history(self, organization_id: OrganizationID, author: DeviceID, vlob_id: UUID, after_version: int,
-                      before_version: int) -> List[Tuple[OrganizationID, UUID, int, bool, pendulum.DateTime]]:
+    async def history(
+        self,
+        organization_id: OrganizationID,
+        author: DeviceID,
+        vlob_id: UUID,
+        after_version: int,
+        before_version: Optional[int],
+        cursor: Optional[int] = None,
+        page_size: Optional[int] = None,
+        checkpoint: Optional[dict] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
         vlob = self._get_vlob(organization_id, vlob_id)
         self._check_realm_read_access(organization_id, vlob.realm_id, author.user_id, None)
-        list_history = list(
-            filter(lambda x: x.operation[0] >= after_version and x.operation[0] <= before_version, vlob.operations))
-        history_sent = [
-            {"version": op.operation[0], "author": op.operation[1], "timestamp": op.operation[2],
-             "hash_obj_after_operation": op.operation[3], "hash_prev_digest": op.operation[4],
-             "signature": op.operation[5], "is_read_op": op.operation[6]}
-            for op in list_history
-        ]
-        return history_sent
+        end = None
+        if checkpoint is not None:
+            # Operations logged after the checkpointed one (such as reads of its
+            # version) are part of a later epoch
+            end = self._checkpoint_positions[(organization_id, vlob_id, checkpoint["epoch"])] + 1
+        operations, next_cursor = vlob.history_page(
+            after_version, before_version, cursor=cursor, limit=page_size, end=end
+        )
+        history_sent = []
+        for op in operations:
+            entry = {"version": op.operation[0], "author": op.operation[1], "timestamp": op.operation[2],
+                     "hash_obj_after_operation": op.operation[3], "hash_prev_digest": op.operation[4],
+                     "signature": op.operation[5], "is_read_op": op.operation[6]}
+            if isinstance(op, AggregatedReads):
+                # Only the reads of the requesting device are sent, along with their proof
+                entry["reads_count"] = len(op.reads)
+                entry["reads"] = [
+                    {"index": index, "author": read_author, "timestamp": read_timestamp,
+                     "signature": read_signature, "proof": op.proof(index)}
+                    for index, (read_author, read_timestamp, read_signature) in enumerate(op.reads)
+                    if read_author == author
+                ]
+            history_sent.append(entry)
+        return history_sent, next_cursor
+
+    async def checkpoint(
+        self,
+        organization_id: OrganizationID,
+        author: DeviceID,
+        vlob_id: UUID,
+        epoch: Optional[int] = None,
+    ) -> Optional[dict]:
+        vlob = self._get_vlob(organization_id, vlob_id)
+        self._check_realm_read_access(organization_id, vlob.realm_id, author.user_id, None)
+        epochs = self._vlob_checkpoint_epochs.get((organization_id, vlob_id), ())
+        index = len(epochs) if epoch is None else bisect.bisect_right(epochs, epoch)
+        if not index:
+            # Vlob not checkpointed yet at this epoch
+            return None
+        epoch_checkpoints = self._epoch_checkpoints[organization_id][epochs[index - 1]]
+        _, op_hash, version = epoch_checkpoints.checkpoints[vlob_id]
+        return {
+            "epoch": epoch_checkpoints.epoch,
+            "hash": op_hash,
+            "version": version,
+            "proof": epoch_checkpoints.proof(vlob_id),
+        }
 
     async def maintenance_get_reencryption_batch(
         self,
@@ -493,36 +769,29 @@ class MemoryVlobComponent(BaseVlobComponent):
         return total, done
 
 
-def retrieve_tx(key):
-    cmd = abci_addr + 'abci_query?data="' + key + '"'
-    req = requests.get(cmd)
-    raw_rep = req.json()
-    raw_rep = base64.b64decode(raw_rep['result']['response']['value']).decode('utf-8')
-    return raw_rep.replace('\'', '\"')
+async def retrieve_tx(key):
+    raw_rep = await tendermint_client.abci_query(key)
+    return raw_rep.decode('utf-8')
 
 
-def broadcast_tx(key, value):
-    cmd = abci_addr + 'broadcast_tx_commit?tx="Key%3F' + key + '%26Value%3F' + value.replace('\"', '\'') + '"'
-    req = requests.get(cmd)
+async def broadcast_tx(key, value):
+    await tendermint_client.broadcast_tx_commit(encode_tx([(key, value)]))
 
 
-def create_key_checkpoints(organization_id, vlob_id):
-    return '(checkpoint, ' + organization_id.__str__() + ', ' + vlob_id.__str__() + ')'
+async def broadcast_batch_tx(items):
+    # Multiple key/value couples in a single transaction, returns the transaction hash
+    rep = await tendermint_client.broadcast_tx_sync(encode_tx(items))
+    return rep['hash']
 
 
-def retrieve_checkpoint(organization_id, vlob_id):
-    key = create_key_checkpoints(organization_id, vlob_id)
-    if not checkpoints_exists(organization_id, vlob_id):
-        broadcast_tx(key, json.dumps(CheckpointEpoch([]), cls=Encoder))
-    raw_rep = retrieve_tx(key)
-    return CheckpointEpochDecoder().decode(raw_rep)
+async def wait_tx_committed(tx_hash):
+    await tendermint_client.wait_for_tx(tx_hash)
 
 
-def checkpoints_exists(organization_id, vlob_id):
-    raw_rep = retrieve_tx(create_key_checkpoints(organization_id, vlob_id))
-    return True if raw_rep != "0" else False
+def create_key_epoch_root(organization_id, epoch):
+    return '(epoch, ' + organization_id.__str__() + ', ' + epoch.__str__() + ')'
 
 
-def get_epoch():
-    global epoch
-    return epoch
+async def retrieve_epoch_root(organization_id, epoch):
+    raw_rep = await retrieve_tx(create_key_epoch_root(organization_id, epoch))
+    return raw_rep if raw_rep != "0" else None
@@ -8,6 +8,7 @@ from typing import Optional
 from parsec.event_bus import EventBus
 from parsec.backend.config import BackendConfig
 from parsec.backend.events import EventsComponent
+from parsec.backend.epoch import EpochScheduler
 from parsec.backend.blockstore import blockstore_factory
 from parsec.backend.webhooks import WebhooksComponent
 from parsec.backend.http import HTTPComponent
@@ -48,9 +49,12 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
     blockstore = blockstore_factory(config.blockstore_config, postgresql_dbh=dbh)
     block = PGBlockComponent(dbh, blockstore, vlob)
     events = EventsComponent(realm, send_event=_send_event)
+    epoch = EpochScheduler(config)
+    epoch.register_components(vlob=vlob)
 
     async with trio.open_service_nursery() as nursery:
         await dbh.init(nursery)
+        nursery.start_soon(epoch.run)
         try:
             yield {
                 "events": events,
@@ -65,7 +69,9 @@ async def components_factory(config: BackendConfig, event_bus: EventBus):
                 "ping": ping,
                 "block": block,
                 "blockstore": blockstore,
+                "epoch": epoch,
             }
 
         finally:
             await dbh.teardown()
+            nursery.cancel_scope.cancel()
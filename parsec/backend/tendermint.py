@@ -0,0 +1,321 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import json
+import base64
+import struct
+import trio
+import h11
+from itertools import count
+from trio import open_tcp_stream
+from typing import Optional, Iterable, List, Tuple, Union
+from urllib.parse import urlsplit
+from structlog import get_logger
+from async_generator import asynccontextmanager
+
+
+logger = get_logger()
+
+
+DEFAULT_TENDERMINT_ADDR = "http://localhost:26657/"
+# Tendermint replies are small JSON documents, however `abci_query` can return
+# a whole vlob version blob
+MAX_RECV_SIZE = 64 * 1024
+TX_FORMAT_VERSION = 1
+PREFIX_QUERY_PATH = "/prefix"
+
+
+class TendermintError(Exception):
+    pass
+
+
+class TendermintNotAvailable(TendermintError):
+    pass
+
+
+class TendermintRPCError(TendermintError):
+    pass
+
+
+def encode_tx(items: Iterable[Tuple[Union[str, bytes], Union[str, bytes]]]) -> bytes:
+    """
+    Binary transaction (see `abci_server.decode_tx`): a format version byte
+    followed by the key and value of each operation, both prefixed by their
+    length (4 bytes, big endian).
+    """
+    parts = [bytes([TX_FORMAT_VERSION])]
+    for key, value in items:
+        key = key.encode("utf8") if isinstance(key, str) else key
+        value = value.encode("utf8") if isinstance(value, str) else value
+        parts += [struct.pack("!I", len(key)), key, struct.pack("!I", len(value)), value]
+    return b"".join(parts)
+
+
+def decode_items(raw: bytes) -> List[Tuple[str, bytes]]:
+    """
+    Key/value couples returned by a prefix query (see `abci_server.encode_items`).
+
+    Raises:
+        TendermintRPCError: if the reply is truncated
+    """
+    items = []
+    offset = 0
+    while offset < len(raw):
+        fields = []
+        for _ in range(2):
+            if offset + 4 > len(raw):
+                raise TendermintRPCError("Truncated prefix query reply")
+            (size,) = struct.unpack_from("!I", raw, offset)
+            offset += 4
+            if offset + size > len(raw):
+                raise TendermintRPCError("Truncated prefix query reply")
+            fields.append(raw[offset : offset + size])
+            offset += size
+        items.append((fields[0].decode("utf8"), fields[1]))
+    return items
+
+
+class _HTTPConnection:
+    """
+    Minimal HTTP/1.1 client connection (trio + h11) kept open between
+    requests to avoid paying a TCP handshake for each Tendermint call.
+    """
+
+    def __init__(self, stream: trio.abc.Stream, host: str):
+        self.stream = stream
+        self.host = host
+        self._conn = h11.Connection(our_role=h11.CLIENT)
+
+    @property
+    def reusable(self) -> bool:
+        return self._conn.our_state is h11.IDLE and self._conn.their_state is h11.IDLE
+
+    async def aclose(self) -> None:
+        await trio.aclose_forcefully(self.stream)
+
+    async def request(self, method: str, target: str, body: bytes = b"") -> bytes:
+        headers = [("Host", self.host), ("Connection", "keep-alive")]
+        if body:
+            headers += [("Content-Type", "application/json"), ("Content-Length", str(len(body)))]
+        data = self._conn.send(h11.Request(method=method, target=target, headers=headers))
+        if body:
+            data += self._conn.send(h11.Data(data=body))
+        data += self._conn.send(h11.EndOfMessage())
+        await self.stream.send_all(data)
+
+        status_code = None
+        chunks = []
+        while True:
+            event = self._conn.next_event()
+            if event is h11.NEED_DATA:
+                self._conn.receive_data(await self.stream.receive_some(MAX_RECV_SIZE))
+            elif isinstance(event, h11.Response):
+                status_code = event.status_code
+            elif isinstance(event, h11.Data):
+                chunks.append(event.data)
+            elif isinstance(event, h11.EndOfMessage):
+                break
+            elif isinstance(event, h11.ConnectionClosed):
+                raise TendermintNotAvailable("Connection closed by Tendermint")
+
+        if self._conn.our_state is h11.DONE and self._conn.their_state is h11.DONE:
+            self._conn.start_next_cycle()
+        if status_code != 200:
+            raise TendermintRPCError(f"Bad HTTP status {status_code} for `{target}`")
+        return b"".join(chunks)
+
+
+class _ConnectionPool:
+    def __init__(self, host: str, port: int, max_connections: int):
+        self._host = host
+        self._port = port
+        self._connections = []
+        self._limiter = trio.CapacityLimiter(max_connections)
+
+    async def _connect(self) -> _HTTPConnection:
+        try:
+            stream = await open_tcp_stream(self._host, self._port)
+        except OSError as exc:
+            logger.debug("Impossible to connect to Tendermint", reason=exc)
+            raise TendermintNotAvailable(exc) from exc
+        return _HTTPConnection(stream, f"{self._host}:{self._port}")
+
+    @asynccontextmanager
+    async def acquire(self, force_fresh: bool = False):
+        async with self._limiter:
+            conn = None
+            if not force_fresh:
+                try:
+                    # Lifo style to retrieve the most recently used (hence less
+                    # likely to have been closed by the peer) first
+                    conn = self._connections.pop()
+                except IndexError:
+                    pass
+
+            if not conn:
+                conn = await self._connect()
+
+            try:
+                yield conn
+
+            except BaseException:
+                # Connection is in an unknown state (e.g. request cancelled
+                # while waiting for the reply), hence it cannot be reused
+                await conn.aclose()
+                raise
+
+            else:
+                if conn.reusable:
+                    self._connections.append(conn)
+                else:
+                    await conn.aclose()
+
+
+class TendermintClient:
+    """
+    Trio-native client for the Tendermint RPC endpoint.
+
+    Connections are kept alive in a pool (at most `max_connections` requests are
+    sent concurrently) and each call is bounded by a timeout, so a slow block
+    commit never holds the event loop nor more than a single pool slot.
+
+    Given trio resources cannot outlive the trio run that created them, the pool
+    is stored in a `RunVar` (this allows a single module-level client to be
+    shared by all the components, tests and the core's epoch checks).
+    """
+
+    def __init__(
+        self,
+        addr: str = DEFAULT_TENDERMINT_ADDR,
+        max_connections: int = 8,
+        timeout: float = 10,
+        commit_timeout: float = 60,
+        poll_interval: float = 0.1,
+    ):
+        url = urlsplit(addr)
+        self.addr = addr
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.commit_timeout = commit_timeout
+        self.poll_interval = poll_interval
+        self._pool_var = trio.lowlevel.RunVar(f"tendermint_pool_{addr}")
+        self._request_ids = count()
+
+    def _get_pool(self) -> _ConnectionPool:
+        try:
+            return self._pool_var.get()
+        except LookupError:
+            pool = _ConnectionPool(self.host, self.port, self.max_connections)
+            self._pool_var.set(pool)
+            return pool
+
+    async def _do_request(self, body: bytes, force_fresh: bool) -> bytes:
+        async with self._get_pool().acquire(force_fresh=force_fresh) as conn:
+            return await conn.request("POST", "/", body)
+
+    async def call(self, method: str, timeout: Optional[float] = None, **params) -> dict:
+        """
+        Params are sent in the JSON-RPC body, hence binary ones must already be
+        encoded the way Tendermint expects them (base64 or hex).
+
+        Raises:
+            TendermintNotAvailable
+            TendermintRPCError
+        """
+        body = json.dumps(
+            {"jsonrpc": "2.0", "id": next(self._request_ids), "method": method, "params": params}
+        ).encode()
+
+        try:
+            with trio.fail_after(timeout or self.timeout):
+                try:
+                    raw_rep = await self._do_request(body, force_fresh=False)
+                except (TendermintNotAvailable, trio.BrokenResourceError, h11.ProtocolError):
+                    # Pooled connection may have been closed by Tendermint while idle
+                    raw_rep = await self._do_request(body, force_fresh=True)
+
+        except trio.TooSlowError as exc:
+            raise TendermintNotAvailable(f"Timeout while calling `{method}`") from exc
+
+        except (trio.BrokenResourceError, h11.ProtocolError) as exc:
+            raise TendermintNotAvailable(exc) from exc
+
+        try:
+            rep = json.loads(raw_rep)
+        except ValueError as exc:
+            raise TendermintRPCError(f"Invalid reply for `{method}`: {raw_rep!r}") from exc
+        if rep.get("error"):
+            raise TendermintRPCError(rep["error"])
+        return rep["result"]
+
+    async def abci_query(self, data: str, path: Optional[str] = None) -> bytes:
+        params = {"data": data.encode("utf8").hex()}
+        if path:
+            params["path"] = path
+        result = await self.call("abci_query", **params)
+        return base64.b64decode(result["response"].get("value") or b"")
+
+    async def abci_query_prefix(self, prefix: str) -> List[Tuple[str, bytes]]:
+        """
+        Returns the key/value couples whose key starts with `prefix`, ordered
+        by key (a single range scan on the application side).
+        """
+        return decode_items(await self.abci_query(prefix, path=PREFIX_QUERY_PATH))
+
+    async def broadcast_tx_commit(self, tx: bytes) -> dict:
+        return await self.call(
+            "broadcast_tx_commit", timeout=self.commit_timeout, tx=base64.b64encode(tx).decode()
+        )
+
+    async def broadcast_tx_sync(self, tx: bytes) -> dict:
+        """
+        Returns once the transaction has been accepted in the mempool (i.e.
+        without waiting for the block commit).
+
+        Raises:
+            TendermintNotAvailable
+            TendermintRPCError: if the transaction is rejected by `CheckTx`
+        """
+        rep = await self.call("broadcast_tx_sync", tx=base64.b64encode(tx).decode())
+        if rep.get("code", 0) != 0:
+            raise TendermintRPCError(f"Transaction rejected: {rep.get('log')}")
+        return rep
+
+    async def broadcast_tx_async(self, tx: bytes) -> dict:
+        return await self.call("broadcast_tx_async", tx=base64.b64encode(tx).decode())
+
+    async def tx(self, tx_hash: str) -> dict:
+        return await self.call("tx", hash=base64.b64encode(bytes.fromhex(tx_hash)).decode())
+
+    async def wait_for_tx(self, tx_hash: str) -> dict:
+        """
+        Poll Tendermint until the transaction is part of a committed block.
+
+        Raises:
+            TendermintNotAvailable: if the transaction is not committed
+                within `commit_timeout`
+            TendermintRPCError: if the transaction failed in `DeliverTx`
+        """
+        try:
+            with trio.fail_after(self.commit_timeout):
+                while True:
+                    try:
+                        rep = await self.tx(tx_hash)
+                        break
+                    except TendermintRPCError:
+                        # Transaction not indexed yet
+                        await trio.sleep(self.poll_interval)
+
+        except trio.TooSlowError as exc:
+            raise TendermintNotAvailable(f"Transaction {tx_hash} not committed in time") from exc
+
+        if rep["tx_result"].get("code", 0) != 0:
+            raise TendermintRPCError(
+                f"Transaction {tx_hash} failed: {rep['tx_result'].get('log')}"
+            )
+        return rep
+
+
+# Shared by all the blockchain components
+tendermint_client = TendermintClient()
@@ -213,9 +213,29 @@ class BaseVlobComponent:
     @catch_protocol_errors
     async def api_vlob_history(self, client_ctx, msg):
         msg = vlob_history_serializer.req_load(msg)
+        checkpoint = None
+        before_version = msg["before_version"]
         try:
-            history = await self.history(client_ctx.organization_id, client_ctx.device_id, msg["vlob_id"],
-                                         msg["after_version"], msg["before_version"])
+            if msg["checkpoint"]:
+                # History ends with the checkpointed operation
+                checkpoint = await self.checkpoint(
+                    client_ctx.organization_id,
+                    client_ctx.device_id,
+                    msg["vlob_id"],
+                    epoch=msg["checkpoint_epoch"],
+                )
+                if checkpoint and (before_version is None or checkpoint["version"] < before_version):
+                    before_version = checkpoint["version"]
+            history, next_cursor = await self.history(
+                client_ctx.organization_id,
+                client_ctx.device_id,
+                msg["vlob_id"],
+                msg["after_version"],
+                before_version,
+                cursor=msg["cursor"],
+                page_size=msg["page_size"],
+                checkpoint=checkpoint,
+            )
         except VlobAccessError:
             return vlob_history_serializer.rep_dump({"status": "not_allowed"})
 
@@ -227,15 +247,12 @@ class BaseVlobComponent:
         except VlobInMaintenanceError:
             return vlob_history_serializer.rep_dump({"status": "in_maintenance"})
 
-        return vlob_history_serializer.rep_dump(
-            {
-                "status": "ok",
-                "history": [{'version': x["version"], 'author': x["author"], 'timestamp': x["timestamp"],
-                             'hash_obj_after_operation': x["hash_obj_after_operation"],
-                             'hash_prev_digest': x["hash_prev_digest"], 'signature': x["signature"],
-                             'is_read_op': x["is_read_op"]} for x in history],
-            }
-        )
+        rep = {"status": "ok", "history": history}
+        if msg["checkpoint"]:
+            rep["checkpoint"] = checkpoint
+        if msg["page_size"] is not None:
+            rep["next_cursor"] = next_cursor
+        return vlob_history_serializer.rep_dump(rep)
 
     @api("vlob_maintenance_get_reencryption_batch")
     @catch_protocol_errors
@@ -404,14 +421,60 @@ class BaseVlobComponent:
         """
         raise NotImplementedError()
 
-    def history(
+    async def history(
         self,
         organization_id: OrganizationID,
         author: DeviceID,
         vlob_id: UUID,
         after_version: int,
-        before_version: int,
-    ) -> List[Tuple[OrganizationID, UUID, int, bool, pendulum.DateTime]]:
+        before_version: Optional[int],
+        cursor: Optional[int] = None,
+        page_size: Optional[int] = None,
+        checkpoint: Optional[dict] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """
+        Operations on the versions from `after_version` to `before_version`
+        (the current one if None), at most `page_size` of them starting at
+        `cursor`. Returns them along with the cursor of the next page (None if
+        there is none). If a `checkpoint` (as returned by `checkpoint`) is
+        given, the history ends with the checkpointed operation.
+
+        Raises:
+            VlobNotFoundError
+            VlobAccessError
+        """
+        raise NotImplementedError()
+
+    async def close_epoch(
+        self, organization_id: OrganizationID, epoch: int, author: Optional[DeviceID]
+    ) -> None:
+        """
+        Publish the checkpoints of the organization's vlobs for the given epoch
+        (called by the `EpochScheduler`).
+
+        Raises:
+            TendermintError
+        """
+        raise NotImplementedError()
+
+    async def checkpoint(
+        self,
+        organization_id: OrganizationID,
+        author: DeviceID,
+        vlob_id: UUID,
+        epoch: Optional[int] = None,
+    ) -> Optional[dict]:
+        """
+        Latest checkpoint of the vlob at or before `epoch` (the last closed epoch
+        if None) along with its inclusion proof in the Merkle tree of which the
+        root is published on the blockchain for the checkpoint's epoch.
+        Only the vlobs with operations during an epoch are checkpointed in it.
+        Returns None if the vlob has not been part of an epoch yet.
+
+        Raises:
+            VlobNotFoundError
+            VlobAccessError
+        """
         raise NotImplementedError()
 
     async def maintenance_get_reencryption_batch(
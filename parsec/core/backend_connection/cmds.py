@@ -239,7 +239,11 @@ async def vlob_history(
     transport: Transport,
     vlob_id: UUID,
     after_version: int,
-    before_version: int,
+    before_version: Optional[int],
+    checkpoint: bool = False,
+    checkpoint_epoch: Optional[int] = None,
+    cursor: Optional[int] = None,
+    page_size: Optional[int] = None,
 ) -> dict:
     return await _send_cmd(
         transport,
@@ -248,6 +252,10 @@ async def vlob_history(
         vlob_id=vlob_id,
         after_version=after_version,
         before_version=before_version,
+        checkpoint=checkpoint,
+        checkpoint_epoch=checkpoint_epoch,
+        cursor=cursor,
+        page_size=page_size,
     )
 
 
@@ -63,6 +63,9 @@ class CoreConfig:
     backend_connection_keepalive: Optional[int] = 29
     backend_max_connections: int = 4
 
+    # Size of the in-memory cache of decrypted blocks, for each workspace
+    block_memory_cache_size: int = 32 * 1024 * 1024
+
     invitation_token_size: int = 8
 
     mountpoint_enabled: bool = False
@@ -104,6 +107,7 @@ def config_factory(
     backend_max_cooldown: int = 30,
     backend_connection_keepalive: Optional[int] = 29,
     backend_max_connections: int = 4,
+    block_memory_cache_size: int = 32 * 1024 * 1024,
     telemetry_enabled: bool = True,
     debug: bool = False,
     gui_last_device: str = None,
@@ -144,6 +148,7 @@ def config_factory(
         backend_max_cooldown=backend_max_cooldown,
         backend_connection_keepalive=backend_connection_keepalive,
         backend_max_connections=backend_max_connections,
+        block_memory_cache_size=block_memory_cache_size,
         telemetry_enabled=telemetry_enabled,
         debug=debug,
         sentry_url=environ.get("SENTRY_URL") or None,
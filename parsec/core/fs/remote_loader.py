@@ -1,11 +1,12 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
+import trio
 from contextlib import contextmanager
 from typing import Dict, Optional, List, Tuple, cast, Iterator, Callable
 
 from pendulum import DateTime, now as pendulum_now
 
-from parsec.utils import timestamps_in_the_ballpark
+from parsec.utils import timestamps_in_the_ballpark, open_service_nursery
 from parsec.crypto import HashDigest, CryptoError
 from parsec.api.protocol import UserID, DeviceID, RealmRole
 from parsec.api.data import (
@@ -15,7 +16,7 @@ from parsec.api.data import (
     BaseManifest as BaseRemoteManifest,
 )
 
-from parsec.core.types import EntryID, ChunkID, LocalDevice, WorkspaceEntry
+from parsec.core.types import EntryID, BlockID, ChunkID, LocalDevice, WorkspaceEntry
 
 from parsec.core.backend_connection import (
     BackendConnectionError,
@@ -37,6 +38,7 @@ from parsec.core.remote_devices_manager import (
 )
 from parsec.core.fs.exceptions import (
     FSError,
+    FSLocalMissError,
     FSRemoteSyncError,
     FSRemoteOperationError,
     FSRemoteManifestNotFound,
@@ -58,6 +60,10 @@ import base64
 import json
 
 
+# Same as the default size of the backend connection pool
+DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS = 4
+
+
 @contextmanager
 def translate_remote_devices_manager_errors() -> Iterator[None]:
     try:
@@ -306,22 +312,62 @@ class RemoteLoader(UserRemoteLoader):
         backend_cmds: BackendAuthenticatedCmds,
         remote_devices_manager: RemoteDevicesManager,
         local_storage: BaseWorkspaceStorage,
+        max_concurrent_block_transfers: int = DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS,
     ):
         super().__init__(
             device, workspace_id, get_workspace_entry, backend_cmds, remote_devices_manager
         )
         self.local_storage = local_storage
+        self.max_concurrent_block_transfers = max_concurrent_block_transfers
+        # Blocks being downloaded, set once they are in the local storage
+        self._block_downloads: Dict[BlockID, trio.Event] = {}
 
     async def load_blocks(self, accesses: List[BlockAccess]) -> None:
         """
+        Download the blocks concurrently (at most `max_concurrent_block_transfers`
+        at a time) and store them in the local storage in a single batch.
+
+        Blocks already being downloaded by another call are waited for instead,
+        which doesn't guarantee they are available once it returns (the other
+        download may have failed).
+
         Raises:
             FSError
             FSRemoteBlockNotFound
             FSBackendOfflineError
             FSWorkspaceInMaintenance
+            FSWorkspaceNoAccess
         """
+        # A block can be referenced more than once
+        to_download: Dict[BlockID, BlockAccess] = {}
+        to_wait: List[trio.Event] = []
         for access in accesses:
-            await self.load_block(access)
+            if access.id in to_download:
+                continue
+            try:
+                to_wait.append(self._block_downloads[access.id])
+            except KeyError:
+                to_download[access.id] = access
+                self._block_downloads[access.id] = trio.Event()
+
+        blocks: Dict[BlockID, bytes] = {}
+        limiter = trio.CapacityLimiter(self.max_concurrent_block_transfers)
+
+        async def _download_block(access: BlockAccess) -> None:
+            async with limiter:
+                blocks[access.id] = await self._download_block(access)
+
+        try:
+            async with open_service_nursery() as nursery:
+                for access in to_download.values():
+                    nursery.start_soon(_download_block, access)
+            await self.local_storage.set_clean_blocks(blocks)
+        finally:
+            for block_id in to_download:
+                self._block_downloads.pop(block_id).set()
+
+        for event in to_wait:
+            await event.wait()
 
     async def load_block(self, access: BlockAccess) -> None:
         """
@@ -332,6 +378,10 @@ class RemoteLoader(UserRemoteLoader):
             FSWorkspaceInMaintenance
             FSWorkspaceNoAccess
         """
+        block = await self._download_block(access)
+        await self.local_storage.set_clean_block(access.id, block)
+
+    async def _download_block(self, access: BlockAccess) -> bytes:
         # Download
         with translate_backend_cmds_errors():
             rep = await self.backend_cmds.block_read(access.id)
@@ -347,9 +397,15 @@ class RemoteLoader(UserRemoteLoader):
         elif rep["status"] != "ok":
             raise FSError(f"Cannot download block: `{rep['status']}`")
 
+        # Decryption and digest check are CPU-bound, run them in a worker thread
+        # so concurrent downloads are not held up
+        return await trio.to_thread.run_sync(self._decrypt_block, access, rep["block"])
+
+    @staticmethod
+    def _decrypt_block(access: BlockAccess, ciphered: bytes) -> bytes:
         # Decryption
         try:
-            block = access.key.decrypt(rep["block"])
+            block = access.key.decrypt(ciphered)
 
         # Decryption error
         except CryptoError as exc:
@@ -357,7 +413,40 @@ class RemoteLoader(UserRemoteLoader):
 
         # TODO: let encryption manager do the digest check ?
         assert HashDigest.from_data(block) == access.digest, access
-        await self.local_storage.set_clean_block(access.id, block)
+        return block
+
+    async def upload_blocks(self, accesses: List[BlockAccess]) -> None:
+        """
+        Upload the dirty blocks concurrently (at most `max_concurrent_block_transfers`
+        at a time), then move them from the chunk storage to the block storage
+        in a single batch. Blocks that are not dirty are skipped.
+
+        Raises:
+            FSError
+            FSBackendOfflineError
+            FSWorkspaceInMaintenance
+            FSWorkspaceNoAccess
+        """
+        blocks: Dict[BlockID, bytes] = {}
+        limiter = trio.CapacityLimiter(self.max_concurrent_block_transfers)
+
+        async def _upload_block(access: BlockAccess) -> None:
+            async with limiter:
+                try:
+                    data = await self.local_storage.get_dirty_block(access.id)
+                except FSLocalMissError:
+                    return
+                await self._upload_block(access, data)
+                blocks[access.id] = data
+
+        async with open_service_nursery() as nursery:
+            # A block can be referenced more than once
+            for access in {access.id: access for access in accesses}.values():
+                nursery.start_soon(_upload_block, access)
+
+        # Update local storage
+        await self.local_storage.set_clean_blocks(blocks)
+        await self.local_storage.clear_chunks([ChunkID(block_id) for block_id in blocks])
 
     async def upload_block(self, access: BlockAccess, data: bytes) -> None:
         """
@@ -367,13 +456,16 @@ class RemoteLoader(UserRemoteLoader):
             FSWorkspaceInMaintenance
             FSWorkspaceNoAccess
         """
-        # Encryption
-        try:
-            ciphered = access.key.encrypt(data)
+        await self._upload_block(access, data)
 
-        # Encryption error
-        except CryptoError as exc:
-            raise FSError(f"Cannot encrypt block: {exc}") from exc
+        # Update local storage
+        await self.local_storage.set_clean_block(access.id, data)
+        await self.local_storage.clear_chunk(ChunkID(access.id), miss_ok=True)
+
+    async def _upload_block(self, access: BlockAccess, data: bytes) -> None:
+        # Encryption is CPU-bound, run it in a worker thread so concurrent
+        # uploads are not held up
+        ciphered = await trio.to_thread.run_sync(self._encrypt_block, access, data)
 
         # Upload block
         with translate_backend_cmds_errors():
@@ -391,9 +483,15 @@ class RemoteLoader(UserRemoteLoader):
         elif rep["status"] != "ok":
             raise FSError(f"Cannot upload block: {rep}")
 
-        # Update local storage
-        await self.local_storage.set_clean_block(access.id, data)
-        await self.local_storage.clear_chunk(ChunkID(access.id), miss_ok=True)
+    @staticmethod
+    def _encrypt_block(access: BlockAccess, data: bytes) -> bytes:
+        # Encryption
+        try:
+            return access.key.encrypt(data)
+
+        # Encryption error
+        except CryptoError as exc:
+            raise FSError(f"Cannot encrypt block: {exc}") from exc
 
     async def load_manifest(
         self,
@@ -440,7 +538,7 @@ class RemoteLoader(UserRemoteLoader):
         if rep["status"] == "ok":
             local_read_operation = (timestamp, self.device.local_operation_storage.epoch, signature, True)
             self.device.local_operation_storage.add_op(entry_id, version, local_read_operation)
-            self.device.local_operation_storage.add_read_content(entry_id, rep['version'], base64.b64encode(rep['blob']).decode('utf-8'))
+            self.device.local_operation_storage.add_read_content(entry_id, rep['version'], rep['blob'])
         elif rep["status"] == "not_found":
             raise FSRemoteManifestNotFound(entry_id)
         elif rep["status"] == "not_allowed":
@@ -656,6 +754,9 @@ class RemoteLoaderTimestamped(RemoteLoader):
         self.backend_cmds = remote_loader.backend_cmds
         self.remote_devices_manager = remote_loader.remote_devices_manager
         self.local_storage = remote_loader.local_storage.to_timestamped(timestamp)
+        self.max_concurrent_block_transfers = remote_loader.max_concurrent_block_transfers
+        # The block storage is shared with the remote loader
+        self._block_downloads = remote_loader._block_downloads
         self._realm_role_certificates_cache = None
         self._realm_role_certificates_cache_timestamp = None
         self.timestamp = timestamp
@@ -663,6 +764,9 @@ class RemoteLoaderTimestamped(RemoteLoader):
     async def upload_block(self, access: BlockAccess, data: bytes) -> None:
         raise FSError("Cannot upload block through a timestamped remote loader")
 
+    async def upload_blocks(self, accesses: List[BlockAccess]) -> None:
+        raise FSError("Cannot upload block through a timestamped remote loader")
+
     async def load_manifest(
         self,
         entry_id: EntryID,
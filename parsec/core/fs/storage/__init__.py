@@ -3,6 +3,7 @@
 from parsec.core.fs.storage.local_database import LocalDatabase
 from parsec.core.fs.storage.user_storage import UserStorage
 from parsec.core.fs.storage.manifest_storage import ManifestStorage
+from parsec.core.fs.storage.operation_storage import OperationStorage
 from parsec.core.fs.storage.chunk_storage import ChunkStorage, BlockStorage
 from parsec.core.fs.storage.workspace_storage import (
     BaseWorkspaceStorage,
@@ -13,6 +14,7 @@ from parsec.core.fs.storage.workspace_storage import (
 __all__ = (
     "LocalDatabase",
     "ManifestStorage",
+    "OperationStorage",
     "ChunkStorage",
     "BlockStorage",
     "UserStorage",
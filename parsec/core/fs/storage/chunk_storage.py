@@ -3,11 +3,14 @@
 import time
 
 import trio
+from uuid import UUID
 from pathlib import Path
-from typing import AsyncIterator, AsyncContextManager, TypeVar
+from collections import OrderedDict
+from typing import AsyncIterator, AsyncContextManager, Dict, List, Optional, TypeVar
 from async_generator import asynccontextmanager
 
 
+from parsec.utils import open_service_nursery
 from parsec.core.types import ChunkID
 from parsec.core.types import LocalDevice, DEFAULT_BLOCK_SIZE
 from parsec.core.fs.storage.local_database import LocalDatabase, Cursor
@@ -15,6 +18,11 @@ from parsec.core.fs.exceptions import FSLocalMissError, FSLocalStorageClosedErro
 
 T = TypeVar("T", bound="ChunkStorage")
 
+# Limit of host parameters in a SQLite statement (before SQLite 3.32)
+MAX_SQL_VARIABLES = 999
+
+DEFAULT_BLOCK_MEMORY_CACHE_SIZE = 32 * 1024 * 1024
+
 
 class ChunkStorage:
     """Interface to access the local chunks of data."""
@@ -114,6 +122,39 @@ class ChunkStorage:
 
         return self.local_symkey.decrypt(ciphered)
 
+    async def get_chunks(self, chunk_ids: List[ChunkID]) -> Dict[ChunkID, bytes]:
+        """Return the chunks found in the storage, the missing ones are left out."""
+        raw_ids = {chunk_id.bytes: chunk_id for chunk_id in chunk_ids}
+        ciphered: Dict[ChunkID, bytes] = {}
+        async with self._open_cursor() as cursor:
+            accessed_on = time.time()
+            keys = list(raw_ids)
+            # One parameter is taken by the access time
+            batch_size = MAX_SQL_VARIABLES - 1
+            for i in range(0, len(keys), batch_size):
+                batch = keys[i : i + batch_size]
+                placeholders = ", ".join("?" * len(batch))
+                cursor.execute(
+                    f"UPDATE chunks SET accessed_on = ? WHERE chunk_id IN ({placeholders})",
+                    (accessed_on, *batch),
+                )
+                cursor.execute(
+                    f"SELECT chunk_id, data FROM chunks WHERE chunk_id IN ({placeholders})", batch
+                )
+                for raw_id, data in cursor.fetchall():
+                    ciphered[raw_ids[raw_id]] = data
+
+        # Decrypt the chunks in parallel, in worker threads
+        chunks: Dict[ChunkID, bytes] = {}
+
+        async def _decrypt_chunk(chunk_id: ChunkID, data: bytes) -> None:
+            chunks[chunk_id] = await trio.to_thread.run_sync(self.local_symkey.decrypt, data)
+
+        async with open_service_nursery() as nursery:
+            for chunk_id, data in ciphered.items():
+                nursery.start_soon(_decrypt_chunk, chunk_id, data)
+        return chunks
+
     async def set_chunk(self, chunk_id: ChunkID, raw: bytes) -> None:
         assert isinstance(raw, (bytes, bytearray))
         ciphered = self.local_symkey.encrypt(raw)
@@ -127,6 +168,23 @@ class ChunkStorage:
                 (chunk_id.bytes, len(ciphered), False, time.time(), ciphered),
             )
 
+    async def set_chunks(self, chunks: Dict[ChunkID, bytes]) -> None:
+        assert all(isinstance(raw, (bytes, bytearray)) for raw in chunks.values())
+        accessed_on = time.time()
+        rows = []
+        for chunk_id, raw in chunks.items():
+            ciphered = self.local_symkey.encrypt(raw)
+            rows.append((chunk_id.bytes, len(ciphered), False, accessed_on, ciphered))
+
+        # Update database in a single transaction
+        async with self._open_cursor() as cursor:
+            cursor.executemany(
+                """INSERT OR REPLACE INTO
+                chunks (chunk_id, size, offline, accessed_on, data)
+                VALUES (?, ?, ?, ?, ?)""",
+                rows,
+            )
+
     async def clear_chunk(self, chunk_id: ChunkID) -> None:
         async with self._open_cursor() as cursor:
             cursor.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id.bytes,))
@@ -136,20 +194,91 @@ class ChunkStorage:
         if not changes:
             raise FSLocalMissError(chunk_id)
 
+    async def clear_chunks(self, chunk_ids: List[ChunkID]) -> None:
+        # Missing chunks are ignored
+        async with self._open_cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM chunks WHERE chunk_id = ?",
+                [(chunk_id.bytes,) for chunk_id in chunk_ids],
+            )
 
-class BlockStorage(ChunkStorage):
-    """Interface for caching the data blocks."""
 
-    def __init__(self, device: LocalDevice, localdb: LocalDatabase, cache_size: int):
+class BlockCache:
+    """In-memory LRU cache of decrypted blocks, bounded by their total size."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._blocks: "OrderedDict[ChunkID, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def get(self, chunk_id: ChunkID) -> Optional[bytes]:
+        try:
+            self._blocks.move_to_end(chunk_id)
+        except KeyError:
+            return None
+        return self._blocks[chunk_id]
+
+    def get_many(self, chunk_ids: List[ChunkID]) -> Dict[ChunkID, bytes]:
+        blocks = {}
+        for chunk_id in chunk_ids:
+            block = self.get(chunk_id)
+            if block is not None:
+                blocks[chunk_id] = block
+        return blocks
+
+    def set(self, chunk_id: ChunkID, block: bytes) -> None:
+        self.discard(chunk_id)
+        if len(block) > self.max_size:
+            return
+        self._blocks[chunk_id] = bytes(block)
+        self.size += len(block)
+        while self.size > self.max_size:
+            _, evicted = self._blocks.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, chunk_id: ChunkID) -> None:
+        block = self._blocks.pop(chunk_id, None)
+        if block is not None:
+            self.size -= len(block)
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self.size = 0
+
+
+class BlockStorage(ChunkStorage):
+    """Interface for caching the data blocks.
+
+    The most recently used blocks are also kept decrypted in memory (up to
+    `memory_cache_size` bytes) so they are served without reaching the database.
+    Their access time is not updated in the database when they are read from
+    memory.
+    """
+
+    def __init__(
+        self,
+        device: LocalDevice,
+        localdb: LocalDatabase,
+        cache_size: int,
+        memory_cache_size: int = DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
+    ):
         super().__init__(device, localdb)
         self.cache_size = cache_size
+        self.memory_cache = BlockCache(memory_cache_size)
 
     @classmethod
     @asynccontextmanager
     async def run(  # type: ignore[override]
-        cls, device: LocalDevice, localdb: LocalDatabase, cache_size: int
+        cls,
+        device: LocalDevice,
+        localdb: LocalDatabase,
+        cache_size: int,
+        memory_cache_size: int = DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
     ) -> AsyncIterator["ChunkStorage"]:
-        async with cls(device, localdb, cache_size)._run() as self:
+        async with cls(device, localdb, cache_size, memory_cache_size)._run() as self:
             yield self
 
     def _open_cursor(self) -> AsyncContextManager[Cursor]:
@@ -166,26 +295,64 @@ class BlockStorage(ChunkStorage):
         return self.cache_size // DEFAULT_BLOCK_SIZE
 
     async def clear_all_blocks(self) -> None:
+        self.memory_cache.clear()
         async with self._open_cursor() as cursor:
             cursor.execute("DELETE FROM chunks")
 
     async def clear_old_blocks(self, limit: int) -> None:
         async with self._open_cursor() as cursor:
-            cursor.execute(
-                """
-                DELETE FROM chunks WHERE chunk_id IN (
-                    SELECT chunk_id FROM chunks ORDER BY accessed_on ASC LIMIT ?
-                )
-                """,
-                (limit,),
-            )
+            cursor.execute("SELECT chunk_id FROM chunks ORDER BY accessed_on ASC LIMIT ?", (limit,))
+            rows = cursor.fetchall()
+            cursor.executemany("DELETE FROM chunks WHERE chunk_id = ?", rows)
+        for raw_id, in rows:
+            self.memory_cache.discard(ChunkID(UUID(bytes=raw_id)))
+
+    # Upgraded get methods
 
-    # Upgraded set method
+    async def get_chunk(self, chunk_id: ChunkID) -> bytes:
+        block = self.memory_cache.get(chunk_id)
+        if block is None:
+            block = await super().get_chunk(chunk_id)
+            self.memory_cache.set(chunk_id, block)
+        return block
+
+    async def get_chunks(self, chunk_ids: List[ChunkID]) -> Dict[ChunkID, bytes]:
+        blocks = self.memory_cache.get_many(chunk_ids)
+        remaining = [chunk_id for chunk_id in chunk_ids if chunk_id not in blocks]
+        if remaining:
+            loaded = await super().get_chunks(remaining)
+            for chunk_id, block in loaded.items():
+                self.memory_cache.set(chunk_id, block)
+            blocks.update(loaded)
+        return blocks
+
+    # Upgraded set methods
 
     async def set_chunk(self, chunk_id: ChunkID, raw: bytes) -> None:
         # Actual set operation
         await super().set_chunk(chunk_id, raw)
+        self.memory_cache.set(chunk_id, raw)
+        await self._clean_up()
+
+    async def set_chunks(self, chunks: Dict[ChunkID, bytes]) -> None:
+        # Actual set operation
+        await super().set_chunks(chunks)
+        for chunk_id, raw in chunks.items():
+            self.memory_cache.set(chunk_id, raw)
+        await self._clean_up()
+
+    # Upgraded clear methods
+
+    async def clear_chunk(self, chunk_id: ChunkID) -> None:
+        self.memory_cache.discard(chunk_id)
+        await super().clear_chunk(chunk_id)
+
+    async def clear_chunks(self, chunk_ids: List[ChunkID]) -> None:
+        for chunk_id in chunk_ids:
+            self.memory_cache.discard(chunk_id)
+        await super().clear_chunks(chunk_ids)
 
+    async def _clean_up(self) -> None:
         # Clean up if necessary
         nb_blocks = await self.get_nb_blocks()
         extra_blocks = nb_blocks - self.block_limit
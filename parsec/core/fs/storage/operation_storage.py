@@ -0,0 +1,269 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
+
+import trio
+from pendulum import from_timestamp
+from structlog import get_logger
+from typing import AsyncIterator, AsyncContextManager
+from async_generator import asynccontextmanager
+
+from parsec.utils import open_service_nursery
+from parsec.core.fs.exceptions import FSLocalStorageClosedError
+from parsec.core.types import EntryID, LocalDevice
+from parsec.core.types.local_device import LocalOperationStorage, VlobOperations
+from parsec.core.fs.storage.local_database import LocalDatabase, Cursor
+
+logger = get_logger()
+
+# Changes made within this delay are written in a single transaction
+DEFAULT_FLUSH_DELAY = 0.1
+
+
+class OperationStorage:
+    """Persistent storage for the device's local operations (see `LocalOperationStorage`).
+
+    The in-memory state is kept on the device and written to the local
+    database in batches, appending only the operations and contents read
+    added since the previous flush.
+    """
+
+    def __init__(
+        self,
+        device: LocalDevice,
+        localdb: LocalDatabase,
+        flush_delay: float = DEFAULT_FLUSH_DELAY,
+    ):
+        self.device = device
+        self.localdb = localdb
+        self.flush_delay = flush_delay
+        self._changed = trio.Event()
+
+    @property
+    def local_operation_storage(self) -> LocalOperationStorage:
+        return self.device.local_operation_storage
+
+    @classmethod
+    @asynccontextmanager
+    async def run(
+        cls, device: LocalDevice, localdb: LocalDatabase, flush_delay: float = DEFAULT_FLUSH_DELAY
+    ) -> AsyncIterator["OperationStorage"]:
+        self = cls(device, localdb, flush_delay)
+        los = self.local_operation_storage
+        await self._create_db()
+        # The state is shared by all the storages of the device, only the first
+        # one populates it
+        if not los.attached:
+            await self._load()
+        los.attached += 1
+        los.change_listeners.append(self._notify_change)
+        try:
+            async with open_service_nursery() as nursery:
+                nursery.start_soon(self._flusher)
+                try:
+                    yield self
+                finally:
+                    nursery.cancel_scope.cancel()
+        finally:
+            los.attached -= 1
+            los.change_listeners.remove(self._notify_change)
+            with trio.CancelScope(shield=True):
+                # Flush the remaining changes before closing the storage
+                try:
+                    await self.flush()
+                # Ignore storage closed exceptions, since it follows an operational error
+                except FSLocalStorageClosedError:
+                    pass
+
+    def _open_cursor(self) -> AsyncContextManager[Cursor]:
+        return self.localdb.open_cursor(commit=True)
+
+    # Database initialization
+
+    async def _create_db(self) -> None:
+        async with self._open_cursor() as cursor:
+            # Singleton storing the epoch
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS local_operations_epoch
+                (
+                  _id INTEGER PRIMARY KEY NOT NULL,
+                  epoch INTEGER NOT NULL
+                );
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS local_operation_vlobs
+                (
+                  vlob_id BLOB PRIMARY KEY NOT NULL, -- UUID
+                  latest_safe_content BLOB, -- Digest
+                  safe_version INTEGER NOT NULL,
+                  current_version INTEGER NOT NULL,
+                  hash_latest_operation TEXT NOT NULL,
+                  is_corrupted INTEGER NOT NULL -- Boolean
+                );
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS local_operations
+                (
+                  _id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  vlob_id BLOB NOT NULL, -- UUID
+                  timestamp REAL,
+                  epoch INTEGER NOT NULL,
+                  signature BLOB NOT NULL,
+                  is_read_op INTEGER -- Boolean, NULL for the operations without flag
+                );
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS local_read_contents
+                (
+                  _id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  vlob_id BLOB NOT NULL, -- UUID
+                  version INTEGER NOT NULL,
+                  digest BLOB NOT NULL
+                );
+                """
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS local_operations_vlob ON local_operations (vlob_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS local_read_contents_vlob ON local_read_contents (vlob_id)"
+            )
+
+    async def _load(self) -> None:
+        los = self.local_operation_storage
+        async with self._open_cursor() as cursor:
+            cursor.execute("SELECT epoch FROM local_operations_epoch WHERE _id = 0")
+            row = cursor.fetchone()
+            if row and row[0] > los.epoch:
+                los.epoch = row[0]
+
+            vlobs = {}
+            cursor.execute(
+                "SELECT vlob_id, latest_safe_content, safe_version, current_version, "
+                "hash_latest_operation, is_corrupted FROM local_operation_vlobs"
+            )
+            for row in cursor.fetchall():
+                vlob_id, latest_safe_content, safe_version, current_version, latest_hash, is_corrupted = row
+                vlobs[EntryID(vlob_id)] = VlobOperations(
+                    latest_safe_content=latest_safe_content,
+                    safe_version=safe_version,
+                    current_version=current_version,
+                    hash_latest_operation=latest_hash,
+                    is_corrupted=bool(is_corrupted),
+                )
+
+            cursor.execute(
+                "SELECT vlob_id, timestamp, epoch, signature, is_read_op "
+                "FROM local_operations ORDER BY _id"
+            )
+            for vlob_id, timestamp, epoch, signature, is_read_op in cursor.fetchall():
+                vlob = vlobs.get(EntryID(vlob_id))
+                if vlob is None:
+                    continue
+                timestamp = None if timestamp is None else from_timestamp(timestamp)
+                if is_read_op is None:
+                    vlob.operations.append((timestamp, epoch, signature))
+                else:
+                    vlob.operations.append((timestamp, epoch, signature, bool(is_read_op)))
+
+            cursor.execute(
+                "SELECT vlob_id, version, digest FROM local_read_contents ORDER BY _id"
+            )
+            for vlob_id, version, digest in cursor.fetchall():
+                vlob = vlobs.get(EntryID(vlob_id))
+                if vlob is not None:
+                    vlob.read_contents.append((version, digest))
+
+        # Vlobs already modified in memory take precedence over the persisted ones
+        for vlob_id, vlob in vlobs.items():
+            if vlob_id not in los.vlobs:
+                los.vlobs[vlob_id] = vlob
+                los.persisted_counts[vlob_id] = (len(vlob.operations), len(vlob.read_contents))
+
+    # Flush
+
+    def _notify_change(self) -> None:
+        self._changed.set()
+
+    async def _flusher(self) -> None:
+        while True:
+            await self._changed.wait()
+            # Let the changes accumulate to commit them together
+            await trio.sleep(self.flush_delay)
+            self._changed = trio.Event()
+            try:
+                await self.flush()
+            except FSLocalStorageClosedError:
+                return
+
+    async def flush(self) -> None:
+        """
+        Raises: Nothing !
+        """
+        los = self.local_operation_storage
+        async with self._open_cursor() as cursor:
+            if los.epoch_dirty:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO local_operations_epoch(_id, epoch) VALUES (0, ?)",
+                    (los.epoch,),
+                )
+                los.epoch_dirty = False
+
+            dirty, los.dirty = los.dirty, {}
+            for vlob_id, rewrite in dirty.items():
+                self._flush_vlob(cursor, vlob_id, rewrite)
+
+    def _flush_vlob(self, cursor: Cursor, vlob_id: EntryID, rewrite: bool) -> None:
+        los = self.local_operation_storage
+        vlob = los.vlobs.get(vlob_id)
+        if rewrite or vlob is None:
+            cursor.execute("DELETE FROM local_operations WHERE vlob_id = ?", (vlob_id.bytes,))
+            cursor.execute("DELETE FROM local_read_contents WHERE vlob_id = ?", (vlob_id.bytes,))
+            los.persisted_counts[vlob_id] = (0, 0)
+        if vlob is None:
+            cursor.execute("DELETE FROM local_operation_vlobs WHERE vlob_id = ?", (vlob_id.bytes,))
+            los.persisted_counts.pop(vlob_id, None)
+            return
+
+        cursor.execute(
+            """INSERT OR REPLACE INTO local_operation_vlobs (vlob_id, latest_safe_content,
+            safe_version, current_version, hash_latest_operation, is_corrupted)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (
+                vlob_id.bytes,
+                vlob.latest_safe_content,
+                vlob.safe_version,
+                vlob.current_version,
+                vlob.hash_latest_operation,
+                vlob.is_corrupted,
+            ),
+        )
+
+        operations_count, read_contents_count = los.persisted_counts.get(vlob_id, (0, 0))
+        cursor.executemany(
+            """INSERT INTO local_operations (vlob_id, timestamp, epoch, signature, is_read_op)
+            VALUES (?, ?, ?, ?, ?)""",
+            (
+                (
+                    vlob_id.bytes,
+                    None if op[0] is None else op[0].timestamp(),
+                    op[1],
+                    op[2],
+                    op[3] if len(op) > 3 else None,
+                )
+                for op in vlob.operations[operations_count:]
+            ),
+        )
+        cursor.executemany(
+            "INSERT INTO local_read_contents (vlob_id, version, digest) VALUES (?, ?, ?)",
+            (
+                (vlob_id.bytes, version, digest)
+                for version, digest in vlob.read_contents[read_contents_count:]
+            ),
+        )
+        los.persisted_counts[vlob_id] = (len(vlob.operations), len(vlob.read_contents))
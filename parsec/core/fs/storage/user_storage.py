@@ -10,6 +10,7 @@ from parsec.core.types import EntryID, LocalDevice, LocalUserManifest
 from parsec.core.fs.storage.version import USER_STORAGE_NAME
 from parsec.core.fs.storage.local_database import LocalDatabase
 from parsec.core.fs.storage.manifest_storage import ManifestStorage
+from parsec.core.fs.storage.operation_storage import OperationStorage
 
 
 class UserStorage:
@@ -24,11 +25,13 @@ class UserStorage:
         path: Path,
         user_manifest_id: EntryID,
         manifest_storage: ManifestStorage,
+        operation_storage: OperationStorage,
     ):
         self.path = path
         self.device = device
         self.user_manifest_id = user_manifest_id
         self.manifest_storage = manifest_storage
+        self.operation_storage = operation_storage
 
     @classmethod
     @asynccontextmanager
@@ -42,15 +45,21 @@ class UserStorage:
                 device, localdb, device.user_manifest_id
             ) as manifest_storage:
 
-                # Instanciate the user storage
-                self = cls(device, path, device.user_manifest_id, manifest_storage)
+                # Local operations storage service (the operations are made
+                # on the user manifest as well as on the workspaces' vlobs)
+                async with OperationStorage.run(device, localdb) as operation_storage:
 
-                # Populate the cache with the user manifest to be able to
-                # access it synchronously at all time
-                await self._load_user_manifest()
-                assert self.user_manifest_id in self.manifest_storage._cache
+                    # Instanciate the user storage
+                    self = cls(
+                        device, path, device.user_manifest_id, manifest_storage, operation_storage
+                    )
 
-                yield self
+                    # Populate the cache with the user manifest to be able to
+                    # access it synchronously at all time
+                    await self._load_user_manifest()
+                    assert self.user_manifest_id in self.manifest_storage._cache
+
+                    yield self
 
     # Checkpoint interface
 
@@ -2,7 +2,7 @@
 
 from pathlib import Path
 from collections import defaultdict
-from typing import Dict, Tuple, Set, Optional, Union, AsyncIterator, NoReturn, Pattern
+from typing import Dict, List, Tuple, Set, Optional, Union, AsyncIterator, NoReturn, Pattern
 
 import trio
 from trio import lowlevel
@@ -23,7 +23,11 @@ from parsec.core.fs.exceptions import FSError, FSLocalMissError, FSInvalidFileDe
 
 from parsec.core.fs.storage.local_database import LocalDatabase
 from parsec.core.fs.storage.manifest_storage import ManifestStorage
-from parsec.core.fs.storage.chunk_storage import ChunkStorage, BlockStorage
+from parsec.core.fs.storage.chunk_storage import (
+    ChunkStorage,
+    BlockStorage,
+    DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
+)
 from parsec.core.fs.storage.version import WORKSPACE_DATA_STORAGE_NAME, WORKSPACE_CACHE_STORAGE_NAME
 
 
@@ -44,7 +48,7 @@ class BaseWorkspaceStorage:
         device: LocalDevice,
         path: Path,
         workspace_id: EntryID,
-        block_storage: ChunkStorage,
+        block_storage: BlockStorage,
         chunk_storage: ChunkStorage,
     ):
         self.path = path
@@ -149,6 +153,12 @@ class BaseWorkspaceStorage:
         assert isinstance(block_id, BlockID)
         return await self.block_storage.set_chunk(ChunkID(block_id), block)
 
+    async def set_clean_blocks(self, blocks: Dict[BlockID, bytes]) -> None:
+        assert all(isinstance(block_id, BlockID) for block_id in blocks)
+        return await self.block_storage.set_chunks(
+            {ChunkID(block_id): block for block_id, block in blocks.items()}
+        )
+
     async def clear_clean_block(self, block_id: BlockID) -> None:
         assert isinstance(block_id, BlockID)
         try:
@@ -161,6 +171,12 @@ class BaseWorkspaceStorage:
 
     # Chunk interface
 
+    async def is_chunk(self, chunk_id: ChunkID) -> bool:
+        assert isinstance(chunk_id, ChunkID)
+        if await self.chunk_storage.is_chunk(chunk_id):
+            return True
+        return await self.block_storage.is_chunk(chunk_id)
+
     async def get_chunk(self, chunk_id: ChunkID) -> bytes:
         assert isinstance(chunk_id, ChunkID)
         try:
@@ -168,6 +184,20 @@ class BaseWorkspaceStorage:
         except FSLocalMissError:
             return await self.block_storage.get_chunk(chunk_id)
 
+    async def get_chunks(self, chunk_ids: List[ChunkID]) -> Dict[ChunkID, bytes]:
+        # Missing chunks are left out
+        assert all(isinstance(chunk_id, ChunkID) for chunk_id in chunk_ids)
+
+        # Blocks kept in memory are served without reaching the databases
+        # (a chunk is only in both storages while its block is being uploaded,
+        # with the same content)
+        chunks = self.block_storage.memory_cache.get_many(chunk_ids)
+        for storage in (self.chunk_storage, self.block_storage):
+            remaining = [chunk_id for chunk_id in chunk_ids if chunk_id not in chunks]
+            if remaining:
+                chunks.update(await storage.get_chunks(remaining))
+        return chunks
+
     async def set_chunk(self, chunk_id: ChunkID, block: bytes) -> None:
         assert isinstance(chunk_id, ChunkID)
         return await self.chunk_storage.set_chunk(chunk_id, block)
@@ -180,6 +210,11 @@ class BaseWorkspaceStorage:
             if not miss_ok:
                 raise
 
+    async def clear_chunks(self, chunk_ids: List[ChunkID]) -> None:
+        # Missing chunks are ignored
+        assert all(isinstance(chunk_id, ChunkID) for chunk_id in chunk_ids)
+        await self.chunk_storage.clear_chunks(chunk_ids)
+
     # "Prevent sync" pattern interface
 
     def get_prevent_sync_pattern(self) -> Pattern[str]:
@@ -210,7 +245,7 @@ class WorkspaceStorage(BaseWorkspaceStorage):
         workspace_id: EntryID,
         data_localdb: LocalDatabase,
         cache_localdb: LocalDatabase,
-        block_storage: ChunkStorage,
+        block_storage: BlockStorage,
         chunk_storage: ChunkStorage,
         manifest_storage: ManifestStorage,
     ):
@@ -228,6 +263,7 @@ class WorkspaceStorage(BaseWorkspaceStorage):
         workspace_id: EntryID,
         cache_size: int = DEFAULT_BLOCK_CACHE_SIZE,
         vacuum_threshold: int = DEFAULT_CHUNK_VACUUM_THRESHOLD,
+        memory_cache_size: int = DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
     ) -> AsyncIterator["WorkspaceStorage"]:
         data_path = path / WORKSPACE_DATA_STORAGE_NAME
         cache_path = path / WORKSPACE_CACHE_STORAGE_NAME
@@ -242,7 +278,10 @@ class WorkspaceStorage(BaseWorkspaceStorage):
 
                 # Block storage service
                 async with BlockStorage.run(
-                    device, cache_localdb, cache_size=cache_size
+                    device,
+                    cache_localdb,
+                    cache_size=cache_size,
+                    memory_cache_size=memory_cache_size,
                 ) as block_storage:
 
                     # Manifest storage service
@@ -387,6 +426,9 @@ class WorkspaceStorageTimestamped(BaseWorkspaceStorage):
     async def clear_chunk(self, chunk_id: ChunkID, miss_ok: bool = False) -> NoReturn:
         self._throw_permission_error()
 
+    async def clear_chunks(self, chunk_ids: List[ChunkID]) -> NoReturn:
+        self._throw_permission_error()
+
     async def clear_manifest(self, entry_id: EntryID) -> NoReturn:
         self._throw_permission_error()
 
@@ -55,8 +55,9 @@ from parsec.core.backend_connection import (
 from parsec.core.remote_devices_manager import RemoteDevicesManager
 
 from parsec.core.fs.workspacefs import WorkspaceFS
-from parsec.core.fs.remote_loader import UserRemoteLoader
+from parsec.core.fs.remote_loader import UserRemoteLoader, DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS
 from parsec.core.fs.storage import UserStorage, WorkspaceStorage
+from parsec.core.fs.storage.chunk_storage import DEFAULT_BLOCK_MEMORY_CACHE_SIZE
 from parsec.core.fs.userfs.merging import merge_local_user_manifests, merge_workspace_entry
 from parsec.core.fs.exceptions import (
     FSError,
@@ -176,6 +177,8 @@ class UserFS:
         remote_devices_manager: RemoteDevicesManager,
         event_bus: EventBus,
         prevent_sync_pattern: Pattern[str],
+        max_concurrent_block_transfers: int = DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS,
+        block_memory_cache_size: int = DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
     ):
         self.device = device
         self.path = path
@@ -183,6 +186,8 @@ class UserFS:
         self.remote_devices_manager = remote_devices_manager
         self.event_bus = event_bus
         self.prevent_sync_pattern = prevent_sync_pattern
+        self.max_concurrent_block_transfers = max_concurrent_block_transfers
+        self.block_memory_cache_size = block_memory_cache_size
 
         self.storage: UserStorage  # Setup by UserStorage.run factory
 
@@ -221,9 +226,18 @@ class UserFS:
         remote_devices_manager: RemoteDevicesManager,
         event_bus: EventBus,
         prevent_sync_pattern: Pattern[str],
+        max_concurrent_block_transfers: int = DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS,
+        block_memory_cache_size: int = DEFAULT_BLOCK_MEMORY_CACHE_SIZE,
     ) -> AsyncIterator[UserFSTypeVar]:
         self = cls(
-            device, path, backend_cmds, remote_devices_manager, event_bus, prevent_sync_pattern
+            device,
+            path,
+            backend_cmds,
+            remote_devices_manager,
+            event_bus,
+            prevent_sync_pattern,
+            max_concurrent_block_transfers,
+            block_memory_cache_size,
         )
 
         # Run user storage
@@ -277,7 +291,9 @@ class UserFS:
         async def workspace_storage_task(
             task_status: TaskStatus[WorkspaceStorage] = trio.TASK_STATUS_IGNORED
         ) -> None:
-            async with WorkspaceStorage.run(self.device, path, workspace_id) as workspace_storage:
+            async with WorkspaceStorage.run(
+                self.device, path, workspace_id, memory_cache_size=self.block_memory_cache_size
+            ) as workspace_storage:
                 task_status.started(workspace_storage)
                 await trio.sleep_forever()
 
@@ -305,6 +321,8 @@ class UserFS:
             backend_cmds=self.backend_cmds,
             event_bus=self.event_bus,
             remote_devices_manager=self.remote_devices_manager,
+            max_concurrent_block_transfers=self.max_concurrent_block_transfers,
+            prefetch_nursery=self._workspace_storage_nursery,
         )
 
         # Apply the current "prevent sync" pattern
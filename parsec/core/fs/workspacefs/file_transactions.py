@@ -1,17 +1,26 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
 from parsec.core.core_events import CoreEvent
-from typing import Tuple, List, Callable, Dict, Optional, cast, AsyncIterator
+from typing import Tuple, List, Callable, Dict, Optional, Set, cast, AsyncIterator
 
+import attr
+import trio
 from collections import defaultdict
 from async_generator import asynccontextmanager
+from structlog import get_logger
 
 from parsec.event_bus import EventBus
-from parsec.core.types import FileDescriptor, EntryID, LocalDevice
+from parsec.core.types import FileDescriptor, EntryID, ChunkID, LocalDevice
 
 from parsec.core.fs.remote_loader import RemoteLoader
 from parsec.core.fs.storage import BaseWorkspaceStorage
-from parsec.core.fs.exceptions import FSLocalMissError, FSInvalidFileDescriptor, FSEndOfFileError
+from parsec.core.fs.exceptions import (
+    FSError,
+    FSLocalMissError,
+    FSLocalStorageClosedError,
+    FSInvalidFileDescriptor,
+    FSEndOfFileError,
+)
 
 from parsec.core.types import (
     Chunk,
@@ -33,6 +42,13 @@ from parsec.api.data import BlockAccess
 __all__ = ("FSInvalidFileDescriptor", "FileTransactions")
 
 
+logger = get_logger()
+
+
+# Maximum number of blocks prefetched ahead of a sequential reader
+READ_AHEAD_MAX_BLOCKS = 8
+
+
 # Helpers
 
 
@@ -53,6 +69,23 @@ def padded_data(data: bytes, start: int, stop: int) -> bytes:
     return b"\x00" * (0 - start) + data[0:stop]
 
 
+@attr.s(slots=True, auto_attribs=True)
+class ReadAhead:
+    """Access pattern of the reads on a file descriptor."""
+
+    # Offset of the next read if the reads are sequential
+    next_offset: int
+    # Number of blocks to prefetch, doubled on each sequential read
+    window: int = 0
+    # End of the data already prefetched (or being prefetched)
+    prefetched_until: int = 0
+    cancel_scopes: Set[trio.CancelScope] = attr.ib(factory=set)
+
+    def cancel(self) -> None:
+        for cancel_scope in self.cancel_scopes:
+            cancel_scope.cancel()
+
+
 class FileTransactions:
     """A stateless class to centralize all file transactions.
 
@@ -73,6 +106,9 @@ class FileTransactions:
     - truncate -> affects file size and possibly file content
     - read     -> no side effect
     - flush    -> no-op
+
+    When a prefetch nursery is provided, sequential reads on a file descriptor
+    trigger the download of the next blocks in the background (see `ReadAhead`).
     """
 
     def __init__(
@@ -83,6 +119,7 @@ class FileTransactions:
         local_storage: BaseWorkspaceStorage,
         remote_loader: RemoteLoader,
         event_bus: EventBus,
+        prefetch_nursery: Optional[trio.Nursery] = None,
     ):
         self.workspace_id = workspace_id
         self.get_workspace_entry = get_workspace_entry
@@ -90,7 +127,9 @@ class FileTransactions:
         self.local_storage = local_storage
         self.remote_loader = remote_loader
         self.event_bus = event_bus
+        self.prefetch_nursery = prefetch_nursery
         self._write_count: Dict[FileDescriptor, int] = defaultdict(int)
+        self._read_ahead: Dict[FileDescriptor, ReadAhead] = {}
 
     # Event helper
 
@@ -99,10 +138,6 @@ class FileTransactions:
 
     # Helper
 
-    async def _read_chunk(self, chunk: Chunk) -> bytes:
-        data = await self.local_storage.get_chunk(chunk.id)
-        return data[chunk.start - chunk.raw_offset : chunk.stop - chunk.raw_offset]
-
     async def _write_chunk(self, chunk: Chunk, content: bytes, offset: int = 0) -> int:
         data = padded_data(content, offset, offset + chunk.stop - chunk.start)
         await self.local_storage.set_chunk(chunk.id, data)
@@ -113,16 +148,23 @@ class FileTransactions:
         if not chunks:
             return bytearray(), []
 
+        # Fetch all the chunks at once
+        data = await self.local_storage.get_chunks([chunk.id for chunk in chunks])
+
         # Build byte array
         missing = []
         start, stop = chunks[0].start, chunks[-1].stop
         result = bytearray(stop - start)
         for chunk in chunks:
             try:
-                result[chunk.start - start : chunk.stop - start] = await self._read_chunk(chunk)
-            except FSLocalMissError:
+                view = memoryview(data[chunk.id])
+            except KeyError:
                 assert chunk.access is not None
                 missing.append(chunk.access)
+            else:
+                result[chunk.start - start : chunk.stop - start] = view[
+                    chunk.start - chunk.raw_offset : chunk.stop - chunk.raw_offset
+                ]
 
         # Return byte array
         return result, missing
@@ -202,6 +244,11 @@ class FileTransactions:
             # Clear write count
             self._write_count.pop(fd, None)
 
+            # Stop the prefetching
+            read_ahead = self._read_ahead.pop(fd, None)
+            if read_ahead is not None:
+                read_ahead.cancel()
+
     async def fd_write(
         self, fd: FileDescriptor, content: bytes, offset: int, constrained: bool = False
     ) -> int:
@@ -285,6 +332,7 @@ class FileTransactions:
 
                 # Return the data
                 if not missing:
+                    self._update_read_ahead(fd, manifest, offset, len(data))
                     return data
 
     async def fd_flush(self, fd: FileDescriptor) -> None:
@@ -352,3 +400,65 @@ class FileTransactions:
 
         # Return missing block ids
         return missing
+
+    # Read-ahead helpers
+
+    def _update_read_ahead(
+        self, fd: FileDescriptor, manifest: LocalFileManifest, offset: int, size: int
+    ) -> None:
+        """This internal helper is called after each successful read."""
+        if self.prefetch_nursery is None:
+            return
+
+        # First read or seek: cancel the prefetching and start over
+        read_ahead = self._read_ahead.get(fd)
+        if read_ahead is None or read_ahead.next_offset != offset:
+            if read_ahead is not None:
+                read_ahead.cancel()
+            self._read_ahead[fd] = ReadAhead(next_offset=offset + size)
+            return
+
+        # Sequential read: grow the window
+        read_ahead.next_offset = offset + size
+        read_ahead.window = min(max(2 * read_ahead.window, 1), READ_AHEAD_MAX_BLOCKS)
+        start = max(read_ahead.prefetched_until, offset + size)
+        stop = min(offset + size + read_ahead.window * manifest.blocksize, manifest.size)
+        if start >= stop:
+            return
+        read_ahead.prefetched_until = stop
+
+        # Chunks without access are only stored locally
+        accesses = [
+            chunk.access
+            for chunk in prepare_read(manifest, stop - start, start)
+            if chunk.access is not None
+        ]
+        if accesses:
+            # The scope is registered right away so a seek or a close cancels
+            # the prefetching even if it has not started yet
+            cancel_scope = trio.CancelScope()
+            read_ahead.cancel_scopes.add(cancel_scope)
+            self.prefetch_nursery.start_soon(
+                self._prefetch_blocks, read_ahead, cancel_scope, accesses
+            )
+
+    async def _prefetch_blocks(
+        self, read_ahead: ReadAhead, cancel_scope: trio.CancelScope, accesses: List[BlockAccess]
+    ) -> None:
+        with cancel_scope:
+            try:
+                missing = [
+                    access
+                    for access in accesses
+                    if not await self.local_storage.is_chunk(ChunkID(access.id))
+                ]
+                await self.remote_loader.load_blocks(missing)
+            # Best effort: the blocks still missing are downloaded by the read
+            except (FSError, FSLocalStorageClosedError):
+                pass
+            # The prefetching runs in a nursery shared with other tasks,
+            # which must not be torn down by an unexpected error
+            except Exception:
+                logger.exception("Cannot prefetch blocks", blocks=[access.id for access in accesses])
+            finally:
+                read_ahead.cancel_scopes.discard(cancel_scope)
@@ -31,7 +31,7 @@ from parsec.core.backend_connection import (
     BackendNotAvailable,
     BackendConnectionError,
 )
-from parsec.core.fs.remote_loader import RemoteLoader
+from parsec.core.fs.remote_loader import RemoteLoader, DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS
 from parsec.core.fs import workspacefs  # Needed to break cyclic import with WorkspaceFSTimestamped
 from parsec.core.fs.workspacefs.sync_transactions import SyncTransactions
 from parsec.core.fs.workspacefs.versioning_helpers import VersionLister
@@ -75,6 +75,8 @@ class WorkspaceFS:
         backend_cmds: BackendAuthenticatedCmds,
         event_bus: EventBus,
         remote_devices_manager: RemoteDevicesManager,
+        max_concurrent_block_transfers: int = DEFAULT_MAX_CONCURRENT_BLOCK_TRANSFERS,
+        prefetch_nursery: Optional[trio.Nursery] = None,
     ):
         self.workspace_id = workspace_id
         self.get_workspace_entry = get_workspace_entry
@@ -92,6 +94,7 @@ class WorkspaceFS:
             self.backend_cmds,
             self.remote_devices_manager,
             self.local_storage,
+            max_concurrent_block_transfers=max_concurrent_block_transfers,
         )
         self.transactions = SyncTransactions(
             self.workspace_id,
@@ -100,6 +103,7 @@ class WorkspaceFS:
             self.local_storage,
             self.remote_loader,
             self.event_bus,
+            prefetch_nursery=prefetch_nursery,
         )
 
     def __repr__(self) -> str:
@@ -504,12 +508,7 @@ class WorkspaceFS:
             await self.minimal_sync(child)
 
     async def _upload_blocks(self, manifest: RemoteFileManifest) -> None:
-        for access in manifest.blocks:
-            try:
-                data = await self.local_storage.get_dirty_block(access.id)
-            except FSLocalMissError:
-                continue
-            await self.remote_loader.upload_block(access, data)
+        await self.remote_loader.upload_blocks(list(manifest.blocks))
 
     async def minimal_sync(self, entry_id: EntryID) -> None:
         """
@@ -31,6 +31,7 @@ class WorkspaceFSTimestamped(WorkspaceFS):
             self.local_storage,
             self.remote_loader,
             self.event_bus,
+            prefetch_nursery=workspacefs.transactions.prefetch_nursery,
         )
 
     def timestamp_get_entry(
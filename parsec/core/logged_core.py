@@ -2,18 +2,24 @@
 
 import re
 import attr
+import trio
 import fnmatch
 from uuid import UUID
 from pathlib import Path
 import importlib_resources
 from pendulum import now as pendulum_now
-from typing import Optional, Tuple, List, Pattern
+from typing import Optional, Tuple, List, Dict, Pattern, AsyncIterator
 from structlog import get_logger
 from functools import partial
 from async_generator import asynccontextmanager
 
 from parsec.event_bus import EventBus
-from parsec.api.protocol import UserID, InvitationType, InvitationDeletedReason
+from parsec.api.protocol import (
+    UserID,
+    InvitationType,
+    InvitationDeletedReason,
+    VLOB_HISTORY_MAX_PAGE_SIZE,
+)
 from parsec.api.data import RevokedUserCertificateContent
 from parsec.core.types import LocalDevice, UserInfo, DeviceInfo, BackendInvitationAddr
 from parsec.core import resources as core_resources
@@ -47,13 +53,19 @@ from parsec.api.data.entry import EntryID
 
 from parsec.core.core_events import CoreEvent
 
-from parsec.backend.memory.vlob import retrieve_checkpoint, Encoder, ServerOperation
-from parsec.core.types.local_device import LocalOperationStorage
+from parsec.backend.memory.vlob import (
+    retrieve_epoch_root,
+    verify_merkle_proof,
+    verify_read_proof,
+    Encoder,
+    ServerOperation,
+)
+from parsec.core.types.local_device import LocalOperationStorage, content_digest
 from hashlib import sha256
 import json
 from enum import Enum
 from nacl.exceptions import BadSignatureError
-from parsec.utils import trio_run
+from parsec.utils import trio_run, open_service_nursery
 import threading
 
 
@@ -133,6 +145,190 @@ class OrganizationStats:
     metadata_size: int
 
 
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class _VlobCheckResult:
+    checkpoint_version: int
+    latest_safe_content: Optional[str]
+    latest_hash: str
+
+
+def _hash_history_operation(op: dict) -> str:
+    server_op = ServerOperation(
+        (op["version"], op["author"], op["timestamp"], op["hash_obj_after_operation"],
+         op["hash_prev_digest"], op["signature"], op["is_read_op"])
+    )
+    return sha256(bytes(json.dumps(server_op, cls=Encoder), encoding="utf-8")).hexdigest().__str__()
+
+
+def _verify_vlob_history(
+    device_id,
+    vlob_id: EntryID,
+    v: tuple,
+    rep: dict,
+    root: Optional[str],
+    verify_keys: dict,
+    before_epoch: int,
+) -> Tuple[Optional[CheckError], Optional[_VlobCheckResult]]:
+    """
+    End of epoch checks of a single vlob, given its history (with checkpoint
+    at or before `before_epoch`), the epoch root of the checkpoint and the
+    verify key of each author.
+
+    Pure CPU work (no I/O), hence it runs in a worker thread.
+    Returns the error (None if the vlob is valid) and, if the checkpoint is
+    valid, the check result (None if there is nothing to verify).
+    """
+
+    def get_version_from_sig(sig):
+        sig = json.loads(sig.decode("utf-8"))
+        if sig["version"] == "None":
+            return None
+        else:
+            return int(sig["version"])
+
+    def get_timestamp_from_sig(sig):
+        sig = json.loads(sig.decode("utf-8"))
+        if sig["timestamp"] == "None":
+            return None
+        else:
+            return sig["timestamp"].__str__()
+
+    def get_ciphered_from_sig(sig):
+        sig = json.loads(sig.decode("utf-8"))
+        return sig["ciphered"]
+
+    # Local operations of a later epoch are not part of the history up to the checkpoint
+    # (v[1] = local operations, tagged with their epoch)
+    local_operations = [op for op in v[1] if op[1] <= before_epoch]
+    checkpoint = rep["checkpoint"]
+    if checkpoint is None and not local_operations:
+        # Vlob only used during a later epoch
+        return None, None
+
+    # step 5 from protocole de fin d'epoch : check the checkpoint inclusion proof against the epoch
+    # root published on the blockchain
+    if root is None or not verify_merkle_proof(
+        root, vlob_id, checkpoint["hash"], checkpoint["version"], checkpoint["proof"]
+    ):
+        return CheckError.HASH_HISTORY_ERROR, None
+    history = rep["history"]
+    if not history:
+        # No operation since the last verified one (v[2] = safe_version), the
+        # checkpoint must then be this operation (v[4] = hash_latest_operation)
+        result = _VlobCheckResult(
+            checkpoint_version=checkpoint["version"], latest_safe_content=None, latest_hash=v[4]
+        )
+        if checkpoint["version"] != v[2] or checkpoint["hash"] != v[4]:
+            return CheckError.HASH_HISTORY_ERROR, result
+        if local_operations:
+            # Local operations not part of the history
+            return CheckError.REMOVE_OPERATION_ERROR, result
+        return None, result
+    result = _VlobCheckResult(
+        checkpoint_version=checkpoint["version"],
+        latest_safe_content=None,
+        latest_hash=_hash_history_operation(history[len(history) - 1]),
+    )
+
+    # step 6 from protocole de fin d'epoch : check equality hash latest operation from history and hash from blockchain
+    if checkpoint["hash"] != result.latest_hash:
+        return CheckError.HASH_HISTORY_ERROR, result
+
+    latest_safe_content = None
+    mem_version = checkpoint["version"] + 1
+    for i in range(len(history) - 1, -1, -1):
+        op = history[i]
+        aggregated_reads = bool(op.get("reads_count"))
+
+        if aggregated_reads:
+            # Consecutive reads of a version aggregated by the backend: only the ones of this
+            # device are provided, each one proven against the Merkle root standing as the
+            # operation's signature (steps 7, 8 and 10 are done on them)
+            reads_root = op["signature"].decode("ascii")
+            for read in op["reads"]:
+                if read["author"] != device_id or not verify_read_proof(
+                    reads_root, read["author"], read["timestamp"], read["signature"], read["proof"]
+                ):
+                    return CheckError.HASH_HISTORY_ERROR, result
+                try:
+                    sig = verify_keys[device_id].verify(read["signature"])
+                except BadSignatureError:
+                    return CheckError.SIGNATURE_VALIDITY_ERROR, result
+                if get_version_from_sig(sig) not in (None, op["version"]):
+                    return CheckError.SWITCH_OPERATION_ERROR, result
+                timestamp_from_sig = get_timestamp_from_sig(sig)
+                if timestamp_from_sig is not None and timestamp_from_sig != read["timestamp"].__str__():
+                    return CheckError.TIMESTAMP_VALIDITY_ERROR, result
+            version_from_sig = op["version"]
+
+        else:
+            # step 7 from protocole de fin d'epoch : check signature validity
+            try:
+                sig = verify_keys[op["author"]].verify(op["signature"])
+            except BadSignatureError:
+                return CheckError.SIGNATURE_VALIDITY_ERROR, result
+            version_from_sig = get_version_from_sig(sig)
+
+        # step 8 from protocole de fin d'epoch : check there is no switching operation in the history
+        if version_from_sig != None:
+            # is equal iff write operation is follow by read operation (or read operation followed by another read operation)
+            if version_from_sig > mem_version:
+                return CheckError.SWITCH_OPERATION_ERROR, result
+            mem_version = version_from_sig
+
+        # step 9 from protocole de fin d'epoch : check previous hash validity
+        if i == 0:
+            # check if first operation of the epoch is well chained to the last operation of previous epoch
+            # (v[4] = hash_latest_operation)
+            if op["hash_prev_digest"] != v[4]:
+                return CheckError.HASH_CHAIN_ERROR, result
+        else:
+            # check operation are well chained within an epoch
+            if op["hash_prev_digest"] != _hash_history_operation(history[i - 1]):
+                return CheckError.HASH_CHAIN_ERROR, result
+
+        if aggregated_reads:
+            continue
+
+        # step 10 from protocole de fin d'epoch : check timestamp validity
+        timestamp_from_sig = get_timestamp_from_sig(sig)
+        if timestamp_from_sig != None:
+            # some operation are sent with 'None' timestamp
+            if timestamp_from_sig != op["timestamp"].__str__():
+                return CheckError.TIMESTAMP_VALIDITY_ERROR, result
+
+        # step 11 from protocole de fin d'epoch : update last safe content
+        # WARNING: to be tested.
+        if op["is_read_op"] == False:
+            latest_safe_content = get_ciphered_from_sig(sig)
+
+    # step 12 from protocole de fin d'epoch : check no remove operations
+    history_device_operations = sum(
+        len(op["reads"]) if op.get("reads_count") else op["author"] == device_id for op in history
+    )
+    if history_device_operations != len(local_operations):
+        return CheckError.REMOVE_OPERATION_ERROR, result
+
+    # step 13 from protocole de fin d'epoch : check validity of content read
+    # check that data read are equal to the last data which has been wrote (by the client itself or someone else).
+    # WARNING: to be finished and to be tested. Is it working if there is only read operation in the history ?
+    # (v[6] is List[Tuple[version, content_digest(content_read)]])
+    for elt in v[6]:
+        last_write_op_of_specific_version = [
+            op for op in history if op["version"] == elt[0] and op["is_read_op"] == False
+        ]
+        if len(last_write_op_of_specific_version) != 0:
+            op = last_write_op_of_specific_version[0]
+            try:
+                sig = verify_keys[op["author"]].verify(op["signature"])
+            except BadSignatureError:
+                return CheckError.SIGNATURE_VALIDITY_ERROR, result
+            if elt[1] != content_digest(get_ciphered_from_sig(sig)):
+                return CheckError.CONTENT_ERROR, result
+
+    return None, attr.evolve(result, latest_safe_content=latest_safe_content)
+
+
 @attr.s(frozen=True, slots=True, auto_attribs=True)
 class LoggedCore:
     config: CoreConfig
@@ -143,6 +339,8 @@ class LoggedCore:
     user_fs: UserFS
     _remote_devices_manager: RemoteDevicesManager
     _backend_conn: BackendAuthenticatedConn
+    # Epoch roots already retrieved from the blockchain
+    _epoch_roots: Dict[int, str] = attr.ib(factory=dict)
 
     def are_monitors_idle(self) -> bool:
         return self._backend_conn.are_monitors_idle()
@@ -347,206 +545,192 @@ class LoggedCore:
         initial_ctx = DeviceGreetInitialCtx(cmds=self._backend_conn.cmds, token=token)
         return await initial_ctx.do_wait_peer()
 
+    async def _iter_vlob_history(
+        self,
+        vlob_id: EntryID,
+        after_version: int,
+        limiter: trio.CapacityLimiter,
+        checkpoint_epoch: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Pages of the vlob history from `after_version` up to its latest
+        checkpoint at or before `checkpoint_epoch` (the latest one if None),
+        the first one holding the checkpoint.
+
+        Raises:
+            BackendConnectionError
+        """
+        cursor = None
+        while True:
+            async with limiter:
+                rep = await self._backend_conn.cmds.vlob_history(
+                    vlob_id=vlob_id,
+                    after_version=after_version,
+                    before_version=None,
+                    checkpoint=True,
+                    checkpoint_epoch=checkpoint_epoch,
+                    cursor=cursor,
+                    page_size=VLOB_HISTORY_MAX_PAGE_SIZE,
+                )
+            if rep["status"] != "ok":
+                raise BackendConnectionError(f"Backend error: {rep}")
+            cursor = rep.pop("next_cursor")
+            yield rep
+            if rep["checkpoint"] is None:
+                # Nothing to verify the history against
+                return
+            # Following pages are bounded by the checkpoint of the first one, even
+            # if an epoch is closed in the meantime
+            checkpoint_epoch = rep["checkpoint"]["epoch"]
+            if cursor is None:
+                return
+
     async def check_operations_epoch(self, after_epoch: int, before_epoch: int) -> [CheckError, EntryID]:
-        # we assume we checks epoch operations one by one
-        assert after_epoch == before_epoch
-
-        # Note that only before_epoch is used (all checks valid -> new epoch = before_epoch + 1).
-        # after_epoch could be used later to check 2 epochs at a time (for instance if a device disconnected during 2 epochs or more)
-
-        def parse_signature(sig):
-            element_sig = sig.decode('utf-8')
-            element_sig = element_sig[:-1]
-            element_sig = element_sig[1:]
-            content = element_sig.split(',')
-            return content
-
-        def get_version_from_sig(sig):
-            sig = json.loads(sig.decode('utf-8'))
-            if sig['version'] == 'None':
-                return None
-            else:
-                return int(sig['version'])
+        """
+        Returns the first failure (in local operation storage order), see
+        `verify_operations_epoch` to get all of them.
+        """
+        failures = await self.verify_operations_epoch(after_epoch, before_epoch)
+        for vlob_id in self.device.local_operation_storage.storage.keys():
+            if vlob_id in failures:
+                return [failures[vlob_id], vlob_id]
+        return [CheckError.NO_ERROR, None]
 
-        def get_timestamp_from_sig(sig):
-            sig = json.loads(sig.decode('utf-8'))
-            if sig['timestamp'] == 'None':
-                return None
-            else:
-                return sig['timestamp'].__str__()
+    async def verify_operations_epoch(self, after_epoch: int, before_epoch: int) -> Dict[EntryID, CheckError]:
+        """
+        Check the operations of all the vlobs tracked during the epochs from
+        `after_epoch` to `before_epoch` and return the failures (the epochs are
+        only closed if there is none, the device then moves to `before_epoch + 1`).
+
+        The range is clipped to the epochs the device has not verified yet
+        (nothing is done if it has already moved past `before_epoch`). It
+        cannot start after the device's epoch as the epochs in between would
+        be left unverified.
+
+        A device catching up on several epochs does it in a single pass: the
+        history of each vlob is fetched once, from its safe version up to its
+        latest checkpoint, and hash-chained across the epoch boundaries. Only
+        the range edges are checked: the hash of the last verified operation
+        and the latest checkpoint (against its epoch root). The checkpoints
+        of the intermediate epochs are implied by the hash chain, hence their
+        roots are not retrieved.
+
+        Histories, epoch roots and author verify keys are fetched concurrently
+        (each author's key only once), then the vlobs are verified in worker
+        threads (signature verification and hashing release the GIL).
+
+        Raises:
+            ValueError
+            BackendConnectionError
+        """
+        assert after_epoch <= before_epoch
+        device_epoch = self.device.local_operation_storage.epoch
+        if after_epoch > device_epoch:
+            raise ValueError(
+                f"Cannot verify epochs {after_epoch} to {before_epoch}: "
+                f"epoch {device_epoch} has not been verified yet"
+            )
+        if before_epoch < device_epoch:
+            return {}
 
-        def get_ciphered_from_sig(sig):
-            sig = json.loads(sig.decode('utf-8'))
-            return sig['ciphered']
+        storage = self.device.local_operation_storage.storage
+        vlob_ids = list(storage.keys())
+        limiter = trio.CapacityLimiter(self.config.backend_max_connections)
 
-        latest_safe_content = {}
-        latest_hash = {}
+        # step 3 and 5 from protocole de fin d'epoch : get checkpoint along with the history (up to it)
+        # (v[2] = safe_version)
+        histories = {}
 
-        for vlob_id in list(self.device.local_operation_storage.storage.keys()):
-            v = self.device.local_operation_storage.storage[vlob_id]
-            get_last_write = False
+        async def _fetch_history(vlob_id):
             rep = None
-            sig = None
-
-            # step 3 from protocole de fin d'epoch : get checkpoint from blockchain
-            list_checkpoints_from_blockchain = retrieve_checkpoint(self.device.organization_id, vlob_id)
-            version_checkpoint_from_blockchain = \
-            list_checkpoints_from_blockchain.checkpoints[len(list_checkpoints_from_blockchain.checkpoints) - 1][2]
-            hash_checkpoint_from_blockchain = \
-            list_checkpoints_from_blockchain.checkpoints[len(list_checkpoints_from_blockchain.checkpoints) - 1][1]
-
-            # step 4 from protocole : update current_version if version_checkpoint_from_blockchain > current_version
-            # (v[3] = current_version)
-            if version_checkpoint_from_blockchain > v[3]:
-                v_list = list(v)
-                v_list[3] = version_checkpoint_from_blockchain
-                v = tuple(v_list)
-                self.device.local_operation_storage.storage[vlob_id] = v
-
-            # step 5 from protocole de fin d'epoch : request history
-            # (v[2] = safe_version)
-            rep = await self._backend_conn.cmds.vlob_history(vlob_id=vlob_id, after_version=v[2] + 1,
-                                                             before_version=version_checkpoint_from_blockchain)
-            if rep["status"] != "ok":
-                raise BackendConnectionError(f"Backend error: {rep}")
+            async for page in self._iter_vlob_history(
+                vlob_id, storage[vlob_id][2] + 1, limiter, checkpoint_epoch=before_epoch
+            ):
+                if rep is None:
+                    rep = page
+                else:
+                    rep["history"] += page["history"]
+            histories[vlob_id] = rep
+
+        async with open_service_nursery() as nursery:
+            for vlob_id in vlob_ids:
+                nursery.start_soon(_fetch_history, vlob_id)
+
+        # Epoch roots and verify keys are shared by the vlobs, hence only retrieved once
+        epochs = {rep["checkpoint"]["epoch"] for rep in histories.values() if rep["checkpoint"]}
+        authors = {op["author"] for rep in histories.values() for op in rep["history"]}
+        verify_keys = {self.device.device_id: self.device.signing_key.verify_key}
+
+        async def _fetch_epoch_root(epoch):
+            async with limiter:
+                root = await retrieve_epoch_root(self.device.organization_id, epoch)
+            if root is not None:
+                self._epoch_roots[epoch] = root
+
+        async def _fetch_verify_key(author):
+            async with limiter:
+                device = await self.user_fs.remote_loader.get_device(author)
+            verify_keys[author] = device.verify_key
+
+        async with open_service_nursery() as nursery:
+            for epoch in epochs - self._epoch_roots.keys():
+                nursery.start_soon(_fetch_epoch_root, epoch)
+            for author in authors - verify_keys.keys():
+                nursery.start_soon(_fetch_verify_key, author)
+
+        outcomes = {}
+
+        async def _verify(vlob_id):
+            rep = histories[vlob_id]
+            root = self._epoch_roots.get(rep["checkpoint"]["epoch"]) if rep["checkpoint"] else None
+            async with limiter:
+                outcomes[vlob_id] = await trio.to_thread.run_sync(
+                    _verify_vlob_history,
+                    self.device.device_id,
+                    vlob_id,
+                    storage[vlob_id],
+                    rep,
+                    root,
+                    verify_keys,
+                    before_epoch,
+                )
+
+        async with open_service_nursery() as nursery:
+            for vlob_id in vlob_ids:
+                nursery.start_soon(_verify, vlob_id)
 
-            # step 6 from protocole de fin d'epoch : check equality hash latest operation from history and hash from blockchain
-            # (v[5] = is_corrupted_boolean)
-            last_op_hist = rep['history'][len(rep['history']) - 1]
-            op_to_hash = ServerOperation((last_op_hist['version'], last_op_hist['author'], last_op_hist['timestamp'],
-                                          last_op_hist['hash_obj_after_operation'], last_op_hist['hash_prev_digest'],
-                                          last_op_hist['signature'], last_op_hist['is_read_op']))
-            hash_last_op = sha256(bytes(json.dumps(op_to_hash, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-
-            if hash_checkpoint_from_blockchain != hash_last_op:
-                v_list = list(v)
-                v_list[5] = True
-                v = tuple(v_list)
-                self.device.local_operation_storage.storage[vlob_id] = v
-                return [CheckError.HASH_HISTORY_ERROR, vlob_id]
-
-            mem_version = version_checkpoint_from_blockchain + 1
-            for i in range(len(rep['history']) - 1, -1, -1):
-
-                # step 7 from protocole de fin d'epoch : check signature validity
+        # Local state is updated in storage order once everything is verified
+        failures = {}
+        latest_safe_content = {}
+        latest_hash = {}
+        safe_versions = {}
+        for vlob_id in vlob_ids:
+            error, result = outcomes[vlob_id]
+            v = list(storage[vlob_id])
+            if result is not None:
+                # step 4 from protocole : update current_version if version_checkpoint_from_blockchain > current_version
+                # (v[3] = current_version)
+                v[3] = max(v[3], result.checkpoint_version)
+            if error is None:
+                if result is not None:
+                    v[2] = result.checkpoint_version
+                    safe_versions[vlob_id] = result.checkpoint_version
+                    if result.latest_safe_content is not None:
+                        latest_safe_content[vlob_id] = result.latest_safe_content
+                    latest_hash[vlob_id] = result.latest_hash
+            else:
+                failures[vlob_id] = error
                 # (v[5] = is_corrupted_boolean)
-                if rep['history'][i]['author'] == self.device.device_id:
-                    try:
-                        sig = self.device.signing_key.verify_key.verify(rep['history'][i]['signature'])
-                    except BadSignatureError:
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.SIGNATURE_VALIDITY_ERROR, vlob_id]
-                else:
-                    sender = await self.user_fs.remote_loader.get_device(rep['history'][i]['author'])
-                    try:
-                        sig = sender.verify_key.verify(rep['history'][i]['signature'])
-                    except BadSignatureError:
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.SIGNATURE_VALIDITY_ERROR, vlob_id]
-
-                # step 8 from protocole de fin d'epoch : check there is no switching operation in the history
-                version_from_sig = get_version_from_sig(sig)
-                if version_from_sig != None:
-                    # is equal iff write operation is follow by read operation (or read operation followed by another read operation)
-                    if version_from_sig > mem_version:
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.SWITCH_OPERATION_ERROR, vlob_id]
-                    mem_version = version_from_sig
-
-                # step 9 from protocole de fin d'epoch : check previous hash validity
-                if i == 0:
-                    # check if first operation of the epoch is well chained to the last operation of previous epoch
-                    if rep['history'][i]['hash_prev_digest'] != v[4]:
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.HASH_CHAIN_ERROR, vlob_id]
-                else:
-                    # check operation are well chained within an epoch
-                    prev_elt = rep['history'][i - 1]
-                    prev_elt_to_op = ServerOperation((prev_elt['version'], prev_elt['author'], prev_elt['timestamp'],
-                                                      prev_elt['hash_obj_after_operation'],
-                                                      prev_elt['hash_prev_digest'], prev_elt['signature'],
-                                                      prev_elt['is_read_op']))
-                    hash_prev_op = sha256(
-                        bytes(json.dumps(prev_elt_to_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-
-                    if rep['history'][i]['hash_prev_digest'] != hash_prev_op:
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.HASH_CHAIN_ERROR, vlob_id]
-
-                # step 10 from protocole de fin d'epoch : check timestamp validity
-                timestamp_from_sig = get_timestamp_from_sig(sig)
-                if timestamp_from_sig != None:
-                    # some operation are sent with 'None' timestamp
-                    if timestamp_from_sig != rep['history'][i]['timestamp'].__str__():
-                        v_list = list(v)
-                        v_list[5] = True
-                        v = tuple(v_list)
-                        self.device.local_operation_storage.storage[vlob_id] = v
-                        return [CheckError.TIMESTAMP_VALIDITY_ERROR, vlob_id]
-
-                # step 11 from protocole de fin d'epoch : update last safe content
-                # WARNING: to be tested.
-                if rep['history'][i]['is_read_op'] == False:
-                    latest_safe_content[vlob_id] = get_ciphered_from_sig(sig)
-
-            # step 12 from protocole de fin d'epoch : check no remove operations
-            history_device_operation = list(filter(lambda x: x['author'] == self.device.device_id, rep['history']))
-            if len(history_device_operation) != len(self.device.local_operation_storage.storage[vlob_id][1]):
-                v_list = list(v)
-                v_list[5] = True
-                v = tuple(v_list)
-                self.device.local_operation_storage.storage[vlob_id] = v
-                return [CheckError.REMOVE_OPERATION_ERROR, vlob_id]
-
-            # step 13 from protocole de fin d'epoch : check validity of content read
-            # check that data read are equal to the last data which has been wrote (by the client itself or someone else).
-            # WARNING: to be finished and to be tested. Is it working if there is only read operation in the history ?
-
-            # for each Tuple[version, content_read]
-            # (v[6] is List[Tuple[version, content_read]])
-            for elt in v[6]:
-                last_write_op_of_specific_version = list(
-                    filter(lambda x: x['version'] == elt[0] and x['is_read_op'] == False, rep['history']))
-                if len(last_write_op_of_specific_version) != 0:
-                    sig = last_write_op_of_specific_version[0]['signature']
-                    if last_write_op_of_specific_version[0]['author'] == self.device.device_id:
-                        sig = self.device.signing_key.verify_key.verify(sig)
-                    else:
-                        sender = await self.user_fs.remote_loader.get_device(
-                            last_write_op_of_specific_version[0]['author'])
-                        sig = sender.verify_key.verify(sig)
-                    if elt[1].__str__() != get_ciphered_from_sig(sig):
-                        return [CheckError.CONTENT_ERROR, vlob_id]
-            v_list = list(v)
-            v_list[2] = version_checkpoint_from_blockchain
-            self.device.local_operation_storage.storage[vlob_id] = v_list
-
-            last_digest_vlob = rep['history'][len(rep['history']) - 1]
-            json_last_digest_vlob = ServerOperation((last_digest_vlob['version'], last_digest_vlob['author'],
-                                                     last_digest_vlob['timestamp'],
-                                                     last_digest_vlob['hash_obj_after_operation'],
-                                                     last_digest_vlob['hash_prev_digest'],
-                                                     last_digest_vlob['signature'], last_digest_vlob['is_read_op']))
-            latest_hash[vlob_id] = sha256(
-                bytes(json.dumps(json_last_digest_vlob, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-        self.device.local_operation_storage.update_epoch_device(before_epoch + 1, latest_safe_content, latest_hash)
+                if error != CheckError.CONTENT_ERROR:
+                    v[5] = True
+            storage[vlob_id] = tuple(v)
 
-        return [CheckError.NO_ERROR, None]
+        if not failures:
+            self.device.local_operation_storage.update_epoch_device(
+                before_epoch + 1, latest_safe_content, latest_hash, safe_versions=safe_versions
+            )
+
+        return failures
 
     async def on_epoch_event_finished(self, event, epoch: int):
         # In the unit test, check_operations_epoch is manually invoked. We don't explore a way to automatic invoked that method when epoch_finished_event is received.
@@ -577,7 +761,14 @@ async def logged_core_factory(
     path = config.data_base_dir / device.slug
     remote_devices_manager = RemoteDevicesManager(backend_conn.cmds, device.root_verify_key)
     async with UserFS.run(
-        device, path, backend_conn.cmds, remote_devices_manager, event_bus, prevent_sync_pattern
+        device,
+        path,
+        backend_conn.cmds,
+        remote_devices_manager,
+        event_bus,
+        prevent_sync_pattern,
+        max_concurrent_block_transfers=config.backend_max_connections,
+        block_memory_cache_size=config.block_memory_cache_size,
     ) as user_fs:
         backend_conn.register_monitor(partial(monitor_messages, user_fs, event_bus))
         backend_conn.register_monitor(partial(monitor_sync, user_fs, event_bus))
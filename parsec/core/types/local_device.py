@@ -1,7 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
 import attr
-from typing import Tuple, Optional, List, Dict
+from typing import Tuple, Optional, List, Dict, Union, MutableMapping
 from hashlib import sha256
 from marshmallow import ValidationError
 from pendulum import DateTime, now as pendulum_now
@@ -40,57 +40,160 @@ class LocalOperation:
     Tuple[DateTime, int, bytes, bool]
 
 
-@attr.s(slots=True, auto_attribs=True, kw_only=True, eq=False)
+def content_digest(content: Union[str, bytes]) -> bytes:
+    """
+    Digest kept instead of a content (as base64 when provided as bytes), it is
+    compared to the digest of the `ciphered` field of the write operations.
+    """
+    if isinstance(content, bytes):
+        content = base64.b64encode(content).decode("utf-8")
+    return sha256(content.encode("utf-8")).digest()
+
+
+@attr.s(slots=True, auto_attribs=True)
+class VlobOperations:
+    """Verification state of a vlob for the current epoch"""
+
+    # Digest of the content of the latest safe write (None until the first epoch checks)
+    latest_safe_content: Optional[bytes] = None
+    # List[Tuple[timestamp, epoch, signature, is_read_op]]
+    operations: list = attr.ib(factory=list)
+    safe_version: int = 0
+    current_version: int = 0
+    hash_latest_operation: str = "0"
+    is_corrupted: bool = False
+    # List[Tuple[version, content_digest]]
+    read_contents: List[Tuple[int, bytes]] = attr.ib(factory=list)
+
+    def as_tuple(self):
+        return (
+            self.latest_safe_content,
+            self.operations,
+            self.safe_version,
+            self.current_version,
+            self.hash_latest_operation,
+            self.is_corrupted,
+            self.read_contents,
+        )
+
+    @classmethod
+    def from_tuple(cls, value):
+        return cls(value[0], list(value[1]), value[2], value[3], value[4], value[5], list(value[6]))
+
+
+class _LocalOperationStorageView(MutableMapping):
+    """
+    Exposes the vlobs as (latest_safe_content, operations, safe_version,
+    current_version, hash_latest_operation, is_corrupted, read_contents) tuples
+    """
+
+    def __init__(self, local_operation_storage):
+        self._los = local_operation_storage
+
+    def __getitem__(self, vlob_id):
+        return self._los.vlobs[vlob_id].as_tuple()
+
+    def __setitem__(self, vlob_id, value):
+        self._los.vlobs[vlob_id] = VlobOperations.from_tuple(value)
+        self._los.mark_dirty(vlob_id, rewrite=True)
+
+    def __delitem__(self, vlob_id):
+        del self._los.vlobs[vlob_id]
+        self._los.mark_dirty(vlob_id, rewrite=True)
+
+    def __iter__(self):
+        return iter(list(self._los.vlobs))
+
+    def __len__(self):
+        return len(self._los.vlobs)
+
+
 class LocalOperationStorage:
+    """
+    Operations made on each vlob during the current epoch, checked at the end
+    of the epoch (see `LoggedCore.check_operations_epoch`).
+
+    Contents read are only kept as digests and the state is persisted in the
+    user storage (see `parsec.core.fs.storage.OperationStorage`), which
+    writes the changes tracked here in batches.
+    """
+
     class SCHEMA_CLS(BaseSchema):
         epoch = fields.Integer(required=True)
-        storage = fields.Dict(fields.UUID(), fields.Tuple(fields.String(required=True), fields.List(fields.Nested(LocalOperation), required=True), fields.Integer(required=True), fields.Integer(required=True), fields.String(required=True), fields.Boolean(required=True), fields.List(fields.Tuple((fields.Integer(required=True), fields.Bytes(required=True)), required=True), required=True)), required=True)
+        storage = fields.Dict(fields.UUID(), fields.Tuple(fields.Bytes(allow_none=True), fields.List(fields.Nested(LocalOperation), required=True), fields.Integer(required=True), fields.Integer(required=True), fields.String(required=True), fields.Boolean(required=True), fields.List(fields.Tuple((fields.Integer(required=True), fields.Bytes(required=True)), required=True), required=True)), required=True)
 
-    # (vlob_id, Tuple[latest_safe_content, List[local_operation_within_epoch], safe_version, current_version, hash_latest_operation, is_corrupted, List[Tuple[version, content_read]]])
-    storage: Dict[EntryID, Tuple[str, List[LocalOperation], int, int, str, bool, List[Tuple[int, bytes]]]]
+    vlobs: Dict[EntryID, VlobOperations]
     # epoch is synchronized with backend's epoch
     epoch: int
 
-    def __init__(self, storage={}, epoch=0):
-        self.storage = storage
+    def __init__(self, storage=None, epoch=0):
+        self.vlobs = {}
         self.epoch = epoch
+        # Changes not persisted yet: vlob_id -> whether the vlob must be rewritten
+        # (otherwise only the operations and contents read appended are written)
+        self.dirty = {}
+        # Number of operations and contents read already persisted for each vlob
+        self.persisted_counts: Dict[EntryID, Tuple[int, int]] = {}
+        self.epoch_dirty = False
+        # Set by the storages persisting this state
+        self.attached = 0
+        self.change_listeners = []
+        for vlob_id, value in (storage or {}).items():
+            self.vlobs[vlob_id] = VlobOperations.from_tuple(value)
+            self.dirty[vlob_id] = True
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LocalOperationStorage):
+            return (self.epoch, self.vlobs) == (other.epoch, other.vlobs)
+        return NotImplemented
 
-    def update_epoch_device(self, new_epoch, latest_safe_content, latest_hash_digest):
+    @property
+    def storage(self) -> MutableMapping:
+        return _LocalOperationStorageView(self)
+
+    def mark_dirty(self, vlob_id, rewrite=False):
+        self.dirty[vlob_id] = self.dirty.get(vlob_id, False) or rewrite
+        for listener in self.change_listeners:
+            listener()
+
+    def _get_or_create(self, vlob_id):
+        try:
+            return self.vlobs[vlob_id]
+        except KeyError:
+            vlob = self.vlobs[vlob_id] = VlobOperations()
+            self.mark_dirty(vlob_id, rewrite=True)
+            return vlob
+
+    def update_epoch_device(
+        self, new_epoch, latest_safe_content, latest_hash_digest, safe_versions=None
+    ):
         self.epoch = new_epoch
-        for (k, v) in self.storage.items():
-            v_list = list(v)
-            v_list[0] = latest_safe_content[k] # latest_safe_content
-            v_list[1] = [] # reset list of local operations
-            v_list[2] = v_list[3] # safe_version <- current_version
-            v_list[4] = latest_hash_digest[k] # hash last operation
-            v_list[6] = [] # reset list of content read
-            self.storage[k] = tuple(v_list)
+        self.epoch_dirty = True
+        for k, vlob in self.vlobs.items():
+            # Vlobs without new write keep their latest safe content
+            if k in latest_safe_content:
+                vlob.latest_safe_content = content_digest(latest_safe_content[k])
+            # Only the local operations of the verified epochs are reset, the
+            # ones tagged with a later epoch are left to its own verification
+            vlob.operations = [op for op in vlob.operations if op[1] >= new_epoch]
+            if safe_versions is None:
+                vlob.safe_version = vlob.current_version
+            else:
+                vlob.safe_version = safe_versions.get(k, vlob.safe_version)
+            vlob.hash_latest_operation = latest_hash_digest.get(k, vlob.hash_latest_operation)
+            vlob.read_contents = []  # reset list of content read
+            self.mark_dirty(k, rewrite=True)
 
     def update_current_version(self, vlob_id, new_current_version):
-        if vlob_id in self.storage:
-            v_list = list(self.storage.get(vlob_id))
-            v_list[3] = new_current_version
-            self.storage[vlob_id] = tuple(v_list)
-        else:
-            value = ("0", [], 0, new_current_version, "0", False, [])
-            self.storage[vlob_id] = value
+        self._get_or_create(vlob_id).current_version = new_current_version
+        self.mark_dirty(vlob_id)
 
     def add_op(self, vlob_id, vlob_version, new_operation):
-        if vlob_id in self.storage:
-            self.storage.get(vlob_id)[1].append(new_operation)
-            v_list = list(self.storage.get(vlob_id))
-            self.storage[vlob_id] = tuple(v_list)
-        else:
-            value = ("0", [new_operation], 0, 0, "0", False, [])
-            self.storage[vlob_id] = value
+        self._get_or_create(vlob_id).operations.append(new_operation)
         self.update_current_version(vlob_id, vlob_version)
 
     def add_read_content(self, vlob_id, version, blob):
-        if vlob_id in self.storage:
-            self.storage[vlob_id][6].append((version, blob))
-        else:
-            value = ("0", [], 0, 0, "0", False, [(version, blob)])
-            self.storage[vlob_id] = value
+        self._get_or_create(vlob_id).read_contents.append((version, content_digest(blob)))
         self.update_current_version(vlob_id, version)
 
 
@@ -290,9 +290,10 @@ class Tuple(Field):
 class LocalOperationStorage(Field):
 
     def _serialize(self, value, attr, obj):
-        dict_to_map = Dict(value.storage.keys(),
-            value.storage.values())\
-        ._serialize(value.storage, attr, obj)
+        storage = dict(value.storage)
+        dict_to_map = Dict(storage.keys(),
+            storage.values())\
+        ._serialize(storage, attr, obj)
         return tuple((value.epoch, dict_to_map))
 
     def _deserialize(self, value, attr, obj):
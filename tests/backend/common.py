@@ -245,10 +245,14 @@ vlob_poll_changes = CmdSock(
 vlob_history = CmdSock(
     "vlob_history",
     vlob_history_serializer,
-    parse_args=lambda self, vlob_id, after_version, before_version: {
+    parse_args=lambda self, vlob_id, after_version, before_version, checkpoint=False, checkpoint_epoch=None, cursor=None, page_size=None: {
         "vlob_id": vlob_id,
         "after_version": after_version,
         "before_version": before_version,
+        "checkpoint": checkpoint,
+        "checkpoint_epoch": checkpoint_epoch,
+        "cursor": cursor,
+        "page_size": page_size,
     },
 )
 vlob_maintenance_get_reencryption_batch = CmdSock(
@@ -1,22 +1,25 @@
+import pytest
 from uuid import UUID
 from pendulum import datetime
 
+from parsec.backend.vlob import VlobNotFoundError
+
 from parsec.backend.blockchain.vlob import (
     Vlob,
     Changes,
     Reencryption,
     Encoder,
-    VlobKeys,
-    ChangesKeys,
     broadcast_tx,
-    create_key_vlob,
+    store_vlob,
     retrieve_vlob,
+    retrieve_vlob_version,
+    get_vlob_head,
     retrieve_changes,
     create_key_changes,
-    create_key_set_vlob_keys,
-    retrieve_set_vlob_keys,
-    create_key_set_changes_keys,
-    retrieve_set_changes_keys,
+    create_key_reencryption,
+    retrieve_reencryption,
+    retrieve_realm_vlobs,
+    reset_database,
 )
 
 import json
@@ -29,91 +32,124 @@ OTHER_REALM_ID = UUID("B0000000000000000000000000000000")
 YET_ANOTHER_REALM_ID = UUID("C0000000000000000000000000000000")
 
 
-def test_retrieve_vlob(alice):
+@pytest.mark.trio
+async def test_retrieve_vlob(alice):
     blob = b"Whatever content."
     timestamp = datetime(2000, 1, 1)
     sent_vlob = Vlob(REALM_ID, [(blob, alice.device_id, timestamp)])
-    broadcast_tx(create_key_vlob(alice.organization_id, VLOB_ID), json.dumps(sent_vlob, cls=Encoder))
-    retrieved_vlob = retrieve_vlob(alice.organization_id, VLOB_ID)
+    await store_vlob(alice.organization_id, VLOB_ID, sent_vlob)
+    retrieved_vlob = await retrieve_vlob(alice.organization_id, VLOB_ID)
     assert sent_vlob == retrieved_vlob
 
 
-def test_retrieve_vlob_after_blob_updated(alice):
+@pytest.mark.trio
+async def test_retrieve_vlob_after_blob_updated(alice):
     blob_1 = b"Other whatever content."
     blob_2 = b"Yet another whatever content."
     timestamp_1 = datetime(2000, 1, 1)
     timestamp_2 = datetime(2000, 1, 2)
 
     sent_vlob_1 = Vlob(REALM_ID, [(blob_1, alice.device_id, timestamp_1)])
-    broadcast_tx(create_key_vlob(alice.organization_id, VLOB_ID), json.dumps(sent_vlob_1, cls=Encoder))
+    await store_vlob(alice.organization_id, VLOB_ID, sent_vlob_1)
 
     sent_vlob_2 = Vlob(REALM_ID, [(blob_2, alice.device_id, timestamp_2)])
-    broadcast_tx(create_key_vlob(alice.organization_id, VLOB_ID), json.dumps(sent_vlob_2, cls=Encoder))
+    await store_vlob(alice.organization_id, VLOB_ID, sent_vlob_2)
 
-    retrieved_vlob = retrieve_vlob(alice.organization_id, VLOB_ID)
+    retrieved_vlob = await retrieve_vlob(alice.organization_id, VLOB_ID)
 
     assert sent_vlob_1 != retrieved_vlob
     assert sent_vlob_2 == retrieved_vlob
 
 
-def test_retrieve_default_changes(alice):
+@pytest.mark.trio
+async def test_vlob_versions_stored_separately(alice):
+    blobs = [b"First version.", b"Second version."]
+    timestamps = [datetime(2000, 1, 1), datetime(2000, 1, 2)]
+    sent_vlob = Vlob(REALM_ID, [(blob, alice.device_id, ts) for blob, ts in zip(blobs, timestamps)])
+    await store_vlob(alice.organization_id, VLOB_ID, sent_vlob)
+
+    for version, blob in enumerate(blobs, 1):
+        assert await retrieve_vlob_version(alice.organization_id, VLOB_ID, version) == blob
+    head = await get_vlob_head(alice.organization_id, VLOB_ID)
+    assert head.realm_id == REALM_ID
+    assert head.versions == [(alice.device_id, ts) for ts in timestamps]
+
+
+@pytest.mark.trio
+async def test_retrieve_default_changes(alice):
     sent_changes = Changes()
-    broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
-    retrieved_changes = retrieve_changes(alice.organization_id, REALM_ID)
+    await broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
+    retrieved_changes = await retrieve_changes(alice.organization_id, REALM_ID)
     assert retrieved_changes == Changes()
 
 
-def test_retrieve_changes_none_reencryption(alice):
+@pytest.mark.trio
+async def test_retrieve_changes_none_reencryption(alice):
     dict_changes = {}
     dict_changes[VLOB_ID] = (alice.device_id, 1, 1)
-    sent_changes = Changes(REALM_ID, dict_changes, None)
+    sent_changes = Changes(REALM_ID, dict_changes, False)
     sent_changes.checkpoint = 1
-    broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
-    retrieved_changes = retrieve_changes(alice.organization_id, REALM_ID)
+    await broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
+    retrieved_changes = await retrieve_changes(alice.organization_id, REALM_ID)
     assert sent_changes == retrieved_changes
 
 
-def test_retrieve_changes_with_reencryption(alice):
+@pytest.mark.trio
+async def test_retrieve_changes_with_reencryption(alice):
     dict_changes = {}
-    blob_1 = b"Whatever content."
-    blob_2 = b"Other whatever content."
-    timestamp_1 = datetime(2000, 1, 1)
-    timestamp_2 = datetime(2000, 1, 2)
-    vlob_1 = Vlob(REALM_ID, [(blob_1, alice.device_id, timestamp_1)])
-    broadcast_tx(create_key_vlob(alice.organization_id, VLOB_ID), json.dumps(vlob_1, cls=Encoder))
-    vlob_2 = Vlob(REALM_ID, [(blob_2, alice.device_id, timestamp_2)])
-    broadcast_tx(create_key_vlob(alice.organization_id, OTHER_VLOB_ID), json.dumps(vlob_2, cls=Encoder))
-    broadcast_tx(create_key_set_vlob_keys(),
-                 json.dumps(VlobKeys([(alice.organization_id, VLOB_ID), (alice.organization_id, OTHER_VLOB_ID)]),
-                            cls=Encoder))
-    items = []
-    items.append(((alice.organization_id, VLOB_ID), vlob_1))
-    items.append(((alice.organization_id, OTHER_VLOB_ID), vlob_2))
-    realm_vlobs = {
-        vlob_id: vlob
-        for (orgid, vlob_id), vlob in items
-        if orgid == alice.organization_id and vlob.realm_id == REALM_ID
-    }
-    sent_changes = Changes(REALM_ID, dict_changes, Reencryption(REALM_ID, alice.organization_id, realm_vlobs))
-    sent_changes.checkpoint = 1
-    broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
-    retrieved_changes = retrieve_changes(alice.organization_id, REALM_ID)
+    dict_changes[VLOB_ID] = (alice.device_id, 1, 1)
+    sent_changes = Changes(1, dict_changes, True)
+    await broadcast_tx(create_key_changes(alice.organization_id, REALM_ID), json.dumps(sent_changes, cls=Encoder))
+    retrieved_changes = await retrieve_changes(alice.organization_id, REALM_ID)
     assert sent_changes == retrieved_changes
 
 
-def test_retrieve_key_vlobs(alice):
-    sent_vlob_keys = VlobKeys([(alice.organization_id, VLOB_ID), (alice.organization_id, OTHER_VLOB_ID),
-                               (alice.organization_id, YET_ANOTHER_VLOB_ID)])
-    broadcast_tx(create_key_set_vlob_keys(), json.dumps(sent_vlob_keys, cls=Encoder))
-    retrieved_vlob_keys = retrieve_set_vlob_keys()
-    assert len(retrieved_vlob_keys.data) == 3
-    assert sent_vlob_keys.data == retrieved_vlob_keys.data
-
+@pytest.mark.trio
+async def test_retrieve_reencryption_progress(alice):
+    reencryption = Reencryption.from_versions(
+        REALM_ID, alice.organization_id, {OTHER_VLOB_ID: 1, VLOB_ID: 2, YET_ANOTHER_VLOB_ID: 0}
+    )
+    assert reencryption.get_batch(2) == [(VLOB_ID, 1), (VLOB_ID, 2)]
+    assert reencryption.save(VLOB_ID, 2)
+    assert not reencryption.save(VLOB_ID, 2)
+    with pytest.raises(VlobNotFoundError):
+        reencryption.save(VLOB_ID, 3)
+    with pytest.raises(VlobNotFoundError):
+        reencryption.save(REALM_ID, 1)
+    assert reencryption.get_counts() == (3, 1)
+
+    key = create_key_reencryption(alice.organization_id, REALM_ID)
+    await broadcast_tx(key, json.dumps(reencryption, cls=Encoder))
+    retrieved = await retrieve_reencryption(alice.organization_id, REALM_ID)
+    assert retrieved == reencryption
+
+    # The vlobs done are skipped
+    assert retrieved.save(VLOB_ID, 1)
+    assert retrieved.cursor == 1
+    assert retrieved.get_batch(2) == [(OTHER_VLOB_ID, 1)]
+    assert retrieved.save(OTHER_VLOB_ID, 1)
+    assert retrieved.is_finished()
+    assert retrieved.get_counts() == (3, 3)
+
+
+@pytest.mark.trio
+async def test_retrieve_realm_vlobs(alice, bob):
+    await reset_database()
+    timestamp = datetime(2000, 1, 1)
+    vlob_1 = Vlob(REALM_ID, [(b"Whatever content.", alice.device_id, timestamp)])
+    vlob_2 = Vlob(OTHER_REALM_ID, [(b"Other whatever content.", alice.device_id, timestamp)])
+    vlob_3 = Vlob(REALM_ID, [(b"Yet another whatever content.", bob.device_id, timestamp)])
+    await store_vlob(alice.organization_id, VLOB_ID, vlob_1)
+    await store_vlob(alice.organization_id, OTHER_VLOB_ID, vlob_2)
+    await store_vlob(alice.organization_id, YET_ANOTHER_VLOB_ID, vlob_3)
+
+    assert await retrieve_realm_vlobs(alice.organization_id, REALM_ID) == {
+        VLOB_ID: vlob_1,
+        YET_ANOTHER_VLOB_ID: vlob_3,
+    }
+    assert await retrieve_realm_vlobs(alice.organization_id, OTHER_REALM_ID) == {OTHER_VLOB_ID: vlob_2}
+    assert len(await retrieve_realm_vlobs(alice.organization_id)) == 3
+    assert await retrieve_realm_vlobs(alice.organization_id, YET_ANOTHER_REALM_ID) == {}
 
-def test_retrieve_key_changes(alice):
-    sent_changes_keys = ChangesKeys([(alice.organization_id, REALM_ID), (alice.organization_id, OTHER_REALM_ID),
-                                     (alice.organization_id, YET_ANOTHER_REALM_ID)])
-    broadcast_tx(create_key_set_changes_keys(), json.dumps(sent_changes_keys, cls=Encoder))
-    retrieved_changes_key = retrieve_set_changes_keys()
-    assert len(retrieved_changes_key.data) == 3
-    assert sent_changes_keys.data == retrieved_changes_key.data
+    await reset_database()
+    assert await retrieve_realm_vlobs(alice.organization_id) == {}
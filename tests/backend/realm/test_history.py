@@ -4,25 +4,35 @@ from hashlib import sha256
 from pendulum import now as pendulum_now
 from uuid import uuid4
 
-from tests.backend.common import realm_update_roles, vlob_create, vlob_read, vlob_update, vlob_history
+import trio
+from tests.backend.common import realm_update_roles, vlob_history
+from tests.backend.common import (
+    vlob_create as _vlob_create,
+    vlob_read as _vlob_read,
+    vlob_update as _vlob_update,
+)
 
 from parsec.api.data import RealmRoleCertificateContent
 from parsec.api.protocol import RealmRole
-from parsec.api.protocol import DeviceID, OrganizationID
+from parsec.api.protocol import DeviceID, OrganizationID, VLOB_HISTORY_MAX_PAGE_SIZE
 import pendulum
 
-from unittest.mock import MagicMock
-
 from parsec.backend.memory.vlob import (
     Vlob,
     Encoder,
-    operations_per_epoch,
-    retrieve_checkpoint,
-    get_epoch,
+    hash_operation_state,
+    EpochCheckpoints,
+    create_key_epoch_root,
+    retrieve_epoch_root,
+    verify_merkle_proof,
+    verify_read_proof,
     ServerOperation
 )
+from parsec.backend.config import DEFAULT_EPOCH_MAX_OPERATIONS
+from parsec.backend.tendermint import TendermintError
 
 from parsec.core.logged_core import CheckError
+from parsec.core.types.local_device import content_digest
 
 import json
 from json import JSONEncoder, JSONDecoder
@@ -39,25 +49,66 @@ assert epoch_to_attack <= number_epochs - 1
 # An enhancement : chose the client to attack. WARNING: This is not implemented in the unit test.
 authors_to_attack = []
 
+# Epochs are closed by the backend after a given number of operations in the organization
+operations_per_epoch = DEFAULT_EPOCH_MAX_OPERATIONS
 assert operations_per_epoch >= 0
 assert operations_per_epoch % 2 == 0
 
 
+def hash_reference_state(vlob_reference, version, author, timestamp, is_read_op):
+    prev_state = vlob_reference.operations[-1].operation[3] if vlob_reference.operations else "0"
+    blob_digest = sha256(vlob_reference.data[version - 1][0]).digest()
+    return hash_operation_state(prev_state, version, author, timestamp, blob_digest, is_read_op)
+
+
+async def vlob_create(*args, **kwargs):
+    rep = await _vlob_create(*args, **kwargs)
+    # Epochs are closed in background, let the backend close the one this operation may end
+    await trio.testing.wait_all_tasks_blocked()
+    return rep
+
+
+async def vlob_read(*args, **kwargs):
+    rep = await _vlob_read(*args, **kwargs)
+    await trio.testing.wait_all_tasks_blocked()
+    return rep
+
+
+async def vlob_update(*args, **kwargs):
+    rep = await _vlob_update(*args, **kwargs)
+    await trio.testing.wait_all_tasks_blocked()
+    return rep
+
+
 class MockedBlockchain():
     data = {}
 
-    def broadcast(self, k, v):
+    async def broadcast(self, k, v):
         self.data[k] = v
 
-    def retrieve(self, k):
-        return self.data.get(k, json.dumps({"checkpoints": []}))
+    async def broadcast_batch(self, items):
+        self.data.update(items)
+        return sha256(json.dumps(items).encode()).hexdigest().upper()
+
+    async def wait_committed(self, tx_hash):
+        pass
+
+    async def retrieve(self, k):
+        return self.data.get(k, "0")
 
 
 @pytest.fixture
 async def mocked_alice_backend_sock(monkeypatch, backend_sock_factory, backend, alice):
     mocked_bc = MockedBlockchain()
     monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", mocked_bc.broadcast)
+    monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", mocked_bc.broadcast_batch)
+    monkeypatch.setattr("parsec.backend.memory.vlob.wait_tx_committed", mocked_bc.wait_committed)
     monkeypatch.setattr("parsec.backend.memory.vlob.retrieve_tx", mocked_bc.retrieve)
+    # Operations made while populating the backend are part of a previous epoch
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    # The device starts at the epoch currently open on the backend
+    alice.local_operation_storage.epoch = backend.epoch.get_epoch(alice.organization_id)
     async with backend_sock_factory(backend, alice) as sock:
         yield sock
 
@@ -66,15 +117,51 @@ async def mocked_alice_backend_sock(monkeypatch, backend_sock_factory, backend,
 async def mocked_bob_backend_sock(monkeypatch, backend_sock_factory, backend, bob):
     mocked_bc = MockedBlockchain()
     monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", mocked_bc.broadcast)
+    monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", mocked_bc.broadcast_batch)
+    monkeypatch.setattr("parsec.backend.memory.vlob.wait_tx_committed", mocked_bc.wait_committed)
     monkeypatch.setattr("parsec.backend.memory.vlob.retrieve_tx", mocked_bc.retrieve)
+    # Operations made while populating the backend are part of a previous epoch
+    backend.epoch.end_epoch(bob.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    # The device starts at the epoch currently open on the backend
+    bob.local_operation_storage.epoch = backend.epoch.get_epoch(bob.organization_id)
     async with backend_sock_factory(backend, bob) as sock:
         yield sock
 
 
+async def republish_epoch_checkpoint(backend, organization_id, vlob_id, version, broadcast_batch_tx):
+    # Checkpoint the tampered operation in the epoch Merkle tree and publish the new root
+    epoch = backend.vlob._vlob_checkpoint_epochs[(organization_id, vlob_id)][-1]
+    epoch_checkpoints = backend.vlob._epoch_checkpoints[organization_id][epoch]
+    last_op = backend.vlob._vlobs[(organization_id, vlob_id)].operations[-1]
+    leaves = [
+        (leaf_vlob_id, op_hash, leaf_version)
+        for leaf_vlob_id, (_, op_hash, leaf_version) in sorted(
+            epoch_checkpoints.checkpoints.items(), key=lambda item: item[1][0]
+        )
+    ]
+    index = epoch_checkpoints.checkpoints[vlob_id][0]
+    leaves[index] = (vlob_id, sha256(
+        bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version)
+    epoch_checkpoints = EpochCheckpoints.build(epoch, leaves)
+    backend.vlob._epoch_checkpoints[organization_id][epoch] = epoch_checkpoints
+    await broadcast_batch_tx(
+        [(create_key_epoch_root(organization_id, epoch_checkpoints.epoch), epoch_checkpoints.root)]
+    )
+
+
+async def _end_setup_epoch(backend, organization_id):
+    # Operations made while populating the backend are part of a previous epoch
+    # (whatever the order in which the backend sock fixtures are set up)
+    backend.epoch.end_epoch(organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    return backend.epoch.get_epoch(organization_id)
+
+
 @pytest.fixture
-async def faulty_backend_signature(monkeypatch, backend):
+async def faulty_backend_signature(monkeypatch, backend, coolorg):
     _update = backend.vlob.update
-    starting_epoch = get_epoch()
+    starting_epoch = await _end_setup_epoch(backend, coolorg.organization_id)
 
     async def update(
         self,
@@ -88,36 +175,36 @@ async def faulty_backend_signature(monkeypatch, backend):
         signature: bytes,
     ) -> None:
         global epoch_to_attack
-        from parsec.backend.memory.vlob import broadcast_tx, create_key_checkpoints
+        from parsec.backend.memory.vlob import broadcast_batch_tx
 
-        _broadcast_tx = broadcast_tx
-        broadcast_tx_mock = MagicMock()
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", broadcast_tx_mock)
+        _broadcast_batch_tx = broadcast_batch_tx
+        broadcast_tx_calls = []
+
+        async def broadcast_batch_tx_mock(items):
+            broadcast_tx_calls.append(items)
+            return "0" * 64
+
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch_tx_mock)
         await _update(organization_id, author, encryption_revision, vlob_id, version, timestamp, blob, signature)
-        if starting_epoch + epoch_to_attack == get_epoch() - 1:
+        # Let the backend close the epoch this update may end
+        await trio.testing.wait_all_tasks_blocked()
+        if starting_epoch + epoch_to_attack == backend.epoch.get_epoch(organization_id) - 1:
             op_list = list(backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation)
             op_list[5] = b"0"  # op_list[5] = signature
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation = tuple(op_list)
 
-        if broadcast_tx_mock.call_count:
-            last_op = backend.vlob._vlobs.get((organization_id, vlob_id)).operations[
-                backend.vlob._vlobs.get((organization_id, vlob_id)).current_operation - 1]
-            list_checkpoints = retrieve_checkpoint(organization_id, vlob_id)
-            list_checkpoints.checkpoints.append((get_epoch() - 1, sha256(
-                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-            key = create_key_checkpoints(organization_id, vlob_id)
-            value = json.dumps(list_checkpoints, cls=Encoder)
-            _broadcast_tx(key, value)
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", _broadcast_tx)
+        if broadcast_tx_calls:
+            await republish_epoch_checkpoint(backend, organization_id, vlob_id, version, _broadcast_batch_tx)
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", _broadcast_batch_tx)
 
     backend.vlob.update = update.__get__(backend)
     return backend
 
 
 @pytest.fixture
-async def faulty_backend_switch_operation(monkeypatch, backend):
+async def faulty_backend_switch_operation(monkeypatch, backend, coolorg):
     _update = backend.vlob.update
-    starting_epoch = get_epoch()
+    starting_epoch = await _end_setup_epoch(backend, coolorg.organization_id)
 
     async def update(
         self,
@@ -131,14 +218,22 @@ async def faulty_backend_switch_operation(monkeypatch, backend):
         signature: bytes,
     ) -> None:
         global epoch_to_attack
-        from parsec.backend.memory.vlob import broadcast_tx, create_key_checkpoints
+        from parsec.backend.memory.vlob import broadcast_batch_tx
+
+        _broadcast_batch_tx = broadcast_batch_tx
+        broadcast_tx_calls = []
+
+        async def broadcast_batch_tx_mock(items):
+            broadcast_tx_calls.append(items)
+            return "0" * 64
 
-        _broadcast_tx = broadcast_tx
-        broadcast_tx_mock = MagicMock()
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", broadcast_tx_mock)
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch_tx_mock)
         await _update(organization_id, author, encryption_revision, vlob_id, version, timestamp, blob, signature)
+        # Let the backend close the epoch this update may end
+        await trio.testing.wait_all_tasks_blocked()
 
-        if starting_epoch + epoch_to_attack == get_epoch() - 1:
+        # Only the operations checkpointed by the attacked epoch are switched (once)
+        if broadcast_tx_calls and starting_epoch + epoch_to_attack == backend.epoch.get_epoch(organization_id) - 1:
             mem_prev_op = backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-2].operation
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-2].operation = \
                 backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation
@@ -157,25 +252,18 @@ async def faulty_backend_switch_operation(monkeypatch, backend):
 
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-2].operation = tuple(prev_op_list)
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation = tuple(next_op_list)
-        if broadcast_tx_mock.call_count:
-            last_op = backend.vlob._vlobs.get((organization_id, vlob_id)).operations[
-                backend.vlob._vlobs.get((organization_id, vlob_id)).current_operation - 1]
-            list_checkpoints = retrieve_checkpoint(organization_id, vlob_id)
-            list_checkpoints.checkpoints.append((get_epoch() - 1, sha256(
-                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-            key = create_key_checkpoints(organization_id, vlob_id)
-            value = json.dumps(list_checkpoints, cls=Encoder)
-            _broadcast_tx(key, value)
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", _broadcast_tx)
+        if broadcast_tx_calls:
+            await republish_epoch_checkpoint(backend, organization_id, vlob_id, version, _broadcast_batch_tx)
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", _broadcast_batch_tx)
 
     backend.vlob.update = update.__get__(backend)
     return backend
 
 
 @pytest.fixture
-async def faulty_backend_hash_chain(monkeypatch, backend):
+async def faulty_backend_hash_chain(monkeypatch, backend, coolorg):
     _update = backend.vlob.update
-    starting_epoch = get_epoch()
+    starting_epoch = await _end_setup_epoch(backend, coolorg.organization_id)
 
     async def update(
         self,
@@ -189,37 +277,37 @@ async def faulty_backend_hash_chain(monkeypatch, backend):
         signature: bytes,
     ) -> None:
         global epoch_to_attack
-        from parsec.backend.memory.vlob import broadcast_tx, create_key_checkpoints
+        from parsec.backend.memory.vlob import broadcast_batch_tx
 
-        _broadcast_tx = broadcast_tx
-        broadcast_tx_mock = MagicMock()
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", broadcast_tx_mock)
+        _broadcast_batch_tx = broadcast_batch_tx
+        broadcast_tx_calls = []
+
+        async def broadcast_batch_tx_mock(items):
+            broadcast_tx_calls.append(items)
+            return "0" * 64
+
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch_tx_mock)
         await _update(organization_id, author, encryption_revision, vlob_id, version, timestamp, blob, signature)
+        # Let the backend close the epoch this update may end
+        await trio.testing.wait_all_tasks_blocked()
 
-        if starting_epoch + epoch_to_attack == get_epoch() - 1:
+        if starting_epoch + epoch_to_attack == backend.epoch.get_epoch(organization_id) - 1:
             op_list = list(backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation)
             op_list[4] = "0"  # op_list[4] = hash prev digest
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation = tuple(op_list)
 
-        if broadcast_tx_mock.call_count:
-            last_op = backend.vlob._vlobs.get((organization_id, vlob_id)).operations[
-                backend.vlob._vlobs.get((organization_id, vlob_id)).current_operation - 1]
-            list_checkpoints = retrieve_checkpoint(organization_id, vlob_id)
-            list_checkpoints.checkpoints.append((get_epoch() - 1, sha256(
-                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-            key = create_key_checkpoints(organization_id, vlob_id)
-            value = json.dumps(list_checkpoints, cls=Encoder)
-            _broadcast_tx(key, value)
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", _broadcast_tx)
+        if broadcast_tx_calls:
+            await republish_epoch_checkpoint(backend, organization_id, vlob_id, version, _broadcast_batch_tx)
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", _broadcast_batch_tx)
 
     backend.vlob.update = update.__get__(backend)
     return backend
 
 
 @pytest.fixture
-async def faulty_backend_timestamp(monkeypatch, backend):
+async def faulty_backend_timestamp(monkeypatch, backend, coolorg):
     _update = backend.vlob.update
-    starting_epoch = get_epoch()
+    starting_epoch = await _end_setup_epoch(backend, coolorg.organization_id)
 
     async def update(
         self,
@@ -233,27 +321,27 @@ async def faulty_backend_timestamp(monkeypatch, backend):
         signature: bytes,
     ) -> None:
         global epoch_to_attack
-        from parsec.backend.memory.vlob import broadcast_tx, create_key_checkpoints
+        from parsec.backend.memory.vlob import broadcast_batch_tx
+
+        _broadcast_batch_tx = broadcast_batch_tx
+        broadcast_tx_calls = []
 
-        _broadcast_tx = broadcast_tx
-        broadcast_tx_mock = MagicMock()
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", broadcast_tx_mock)
+        async def broadcast_batch_tx_mock(items):
+            broadcast_tx_calls.append(items)
+            return "0" * 64
+
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch_tx_mock)
         await _update(organization_id, author, encryption_revision, vlob_id, version, timestamp, blob, signature)
-        if starting_epoch + epoch_to_attack == get_epoch() - 1:
+        # Let the backend close the epoch this update may end
+        await trio.testing.wait_all_tasks_blocked()
+        if starting_epoch + epoch_to_attack == backend.epoch.get_epoch(organization_id) - 1:
             op_list = list(backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation)
             op_list[2] = op_list[2].add(seconds=1)
             backend.vlob._vlobs.get((organization_id, vlob_id)).operations[-1].operation = tuple(op_list)
 
-        if broadcast_tx_mock.call_count:
-            last_op = backend.vlob._vlobs.get((organization_id, vlob_id)).operations[
-                backend.vlob._vlobs.get((organization_id, vlob_id)).current_operation - 1]
-            list_checkpoints = retrieve_checkpoint(organization_id, vlob_id)
-            list_checkpoints.checkpoints.append((get_epoch() - 1, sha256(
-                bytes(json.dumps(last_op, cls=Encoder), encoding='utf-8')).hexdigest().__str__(), version))
-            key = create_key_checkpoints(organization_id, vlob_id)
-            value = json.dumps(list_checkpoints, cls=Encoder)
-            _broadcast_tx(key, value)
-        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", _broadcast_tx)
+        if broadcast_tx_calls:
+            await republish_epoch_checkpoint(backend, organization_id, vlob_id, version, _broadcast_batch_tx)
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", _broadcast_batch_tx)
 
     backend.vlob.update = update.__get__(backend)
     return backend
@@ -286,8 +374,8 @@ def create_signature_read(user, vlob_id, encryption_revision, timestamp, version
 
 
 @pytest.mark.trio
-async def test_retrieve_history_single_create_operation(alice, mocked_alice_backend_sock, realm):
-    current_epoch = get_epoch()
+async def test_retrieve_history_single_create_operation(backend, alice, mocked_alice_backend_sock, realm):
+    current_epoch = backend.epoch.get_epoch(alice.organization_id)
     assert current_epoch >= 0
 
     history = []
@@ -306,8 +394,7 @@ async def test_retrieve_history_single_create_operation(alice, mocked_alice_back
     vlob_reference_version += 1
 
     vlob_reference = Vlob(realm, [(blob, alice.device_id, timestamp)], [])
-    hash_obj_after_operation = sha256(
-        bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+    hash_obj_after_operation = hash_reference_state(vlob_reference, 1, alice.device_id, timestamp, False)
 
     history.append({"version": 1, "author": alice.device_id, "timestamp": timestamp,
                     "hash_obj_after_operation": hash_obj_after_operation, "hash_prev_digest": "0",
@@ -319,8 +406,8 @@ async def test_retrieve_history_single_create_operation(alice, mocked_alice_back
 
 
 @pytest.mark.trio
-async def test_retrieve_history_create_update_read_operation(alice, mocked_alice_backend_sock, realm):
-    current_epoch = get_epoch()
+async def test_retrieve_history_create_update_read_operation(backend, alice, mocked_alice_backend_sock, realm):
+    current_epoch = backend.epoch.get_epoch(alice.organization_id)
     assert current_epoch >= 0
 
     history = []
@@ -335,8 +422,7 @@ async def test_retrieve_history_create_update_read_operation(alice, mocked_alice
     signature = create_signature_write(alice, vlob_id, encryption_revision, blob, timestamp, vlob_reference_version)
 
     vlob_reference = Vlob(realm, [(blob, alice.device_id, timestamp)], [])
-    hash_obj_after_operation = sha256(
-        bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+    hash_obj_after_operation = hash_reference_state(vlob_reference, 1, alice.device_id, timestamp, False)
     new_operation = ServerOperation(
         (vlob_reference_version, alice.device_id, timestamp, hash_obj_after_operation, "0", signature, False))
     vlob_reference.operations.append(new_operation)
@@ -370,8 +456,8 @@ async def test_retrieve_history_create_update_read_operation(alice, mocked_alice
                 signature = create_signature_write(alice, vlob_id, encryption_revision, blob, timestamp,
                                                    vlob_reference_version)
                 vlob_reference.data.append((blob, alice.device_id, timestamp))
-                hash_obj_after_operation = sha256(
-                    bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+                hash_obj_after_operation = hash_reference_state(vlob_reference, vlob_reference_version,
+                                                                alice.device_id, timestamp, False)
                 hash_prev_digest = "0"
                 if vlob_reference.current_operation != 0:
                     last_op = vlob_reference.operations[vlob_reference.current_operation - 1].operation
@@ -401,8 +487,8 @@ async def test_retrieve_history_create_update_read_operation(alice, mocked_alice
                 # read reference vlob
                 signature = create_signature_read(alice, vlob_id, encryption_revision, timestamp,
                                                   vlob_reference_version - 1)
-                hash_obj_after_operation = sha256(
-                    bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+                hash_obj_after_operation = hash_reference_state(vlob_reference, vlob_reference_version - 1,
+                                                                alice.device_id, timestamp, True)
                 hash_prev_digest = "0"
                 if vlob_reference.current_operation != 0:
                     last_op = vlob_reference.operations[vlob_reference.current_operation - 1].operation
@@ -441,8 +527,181 @@ async def test_retrieve_history_create_update_read_operation(alice, mocked_alice
 
 
 @pytest.mark.trio
-async def test_check_operations_alice(running_backend, alice, mocked_alice_backend_sock, alice_core, realm):
-    current_epoch = get_epoch()
+async def test_history_pagination(backend, alice, mocked_alice_backend_sock, realm):
+    vlob_id = uuid4()
+    encryption_revision = 1
+    for version in range(1, 6):
+        timestamp = pendulum_now()
+        blob = b"v" + bytes([version])
+        signature = create_signature_write(alice, vlob_id, encryption_revision, blob, timestamp, version)
+        if version == 1:
+            rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=blob, timestamp=timestamp,
+                                    signature=signature)
+        else:
+            rep = await vlob_update(mocked_alice_backend_sock, vlob_id, version=version, blob=blob,
+                                    timestamp=timestamp, signature=signature)
+        assert rep["status"] == "ok"
+        # Read the new version along with an older one
+        for read_version in (version, max(version - 2, 1)):
+            timestamp = pendulum_now()
+            signature = create_signature_read(alice, vlob_id, encryption_revision, timestamp, read_version)
+            rep = await vlob_read(mocked_alice_backend_sock, vlob_id, version=read_version, signature=signature,
+                                  timestamp=timestamp)
+            assert rep["status"] == "ok"
+
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None)
+    assert rep["status"] == "ok"
+    assert "next_cursor" not in rep
+    operations = rep["history"]
+    # The two consecutive reads of the first version are aggregated
+    assert len(operations) == 14
+
+    for after_version, before_version in ((1, None), (3, None), (2, 4), (5, 5), (6, None)):
+        full_history = [op for op in operations if after_version <= op["version"] <= (before_version or 5)]
+        rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=after_version,
+                                 before_version=before_version)
+        assert rep["status"] == "ok"
+        assert rep["history"] == full_history
+
+        for page_size in (1, 2, 3, 100):
+            history = []
+            cursor = None
+            while True:
+                rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=after_version,
+                                         before_version=before_version, cursor=cursor, page_size=page_size)
+                assert rep["status"] == "ok"
+                assert len(rep["history"]) <= page_size
+                history += rep["history"]
+                cursor = rep["next_cursor"]
+                if cursor is None:
+                    break
+            assert history == full_history
+
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None,
+                             page_size=VLOB_HISTORY_MAX_PAGE_SIZE + 1)
+    assert rep["status"] == "bad_message"
+
+
+@pytest.mark.trio
+async def test_history_ends_with_checkpointed_operation(backend, alice, mocked_alice_backend_sock, realm):
+    vlob_id = uuid4()
+    encryption_revision = 1
+    for version in range(1, 3):
+        timestamp = pendulum_now()
+        blob = b"v" + bytes([version])
+        signature = create_signature_write(alice, vlob_id, encryption_revision, blob, timestamp, version)
+        if version == 1:
+            rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=blob, timestamp=timestamp,
+                                    signature=signature)
+        else:
+            rep = await vlob_update(mocked_alice_backend_sock, vlob_id, version=version, blob=blob,
+                                    timestamp=timestamp, signature=signature)
+        assert rep["status"] == "ok"
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+
+    # Reads of checkpointed versions made during the next epoch
+    for read_version in (2, 1):
+        timestamp = pendulum_now()
+        signature = create_signature_read(alice, vlob_id, encryption_revision, timestamp, read_version)
+        rep = await vlob_read(mocked_alice_backend_sock, vlob_id, version=read_version, signature=signature,
+                              timestamp=timestamp)
+        assert rep["status"] == "ok"
+
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None)
+    assert len(rep["history"]) == 4
+    for page_size in (None, 1):
+        history = []
+        cursor = None
+        while True:
+            rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None,
+                                     checkpoint=True, cursor=cursor, page_size=page_size)
+            assert rep["status"] == "ok"
+            assert rep["checkpoint"]["version"] == 2
+            history += rep["history"]
+            cursor = rep.get("next_cursor")
+            if cursor is None:
+                break
+        assert [(op["version"], op["is_read_op"]) for op in history] == [(1, False), (2, False)]
+        assert hash_history_entry(history[-1]) == rep["checkpoint"]["hash"]
+
+
+def hash_history_entry(entry):
+    return sha256(bytes(json.dumps(ServerOperation((
+        entry["version"], entry["author"], entry["timestamp"], entry["hash_obj_after_operation"],
+        entry["hash_prev_digest"], entry["signature"], entry["is_read_op"])), cls=Encoder), encoding='utf-8')).hexdigest()
+
+
+@pytest.mark.trio
+async def test_history_aggregated_reads(backend, alice, bob, mocked_alice_backend_sock, mocked_bob_backend_sock,
+                                        realm):
+    rep = await _realm_generate_certif_and_update_roles_or_fail(mocked_alice_backend_sock, alice, realm, bob.user_id,
+                                                                RealmRole.CONTRIBUTOR)
+    assert rep["status"] == "ok"
+    vlob_id = uuid4()
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+    rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+
+    async def read(device, sock, version):
+        timestamp = pendulum_now()
+        signature = create_signature_read(device, vlob_id, 1, timestamp, version)
+        rep = await vlob_read(sock, vlob_id, version=version, signature=signature, timestamp=timestamp)
+        assert rep["status"] == "ok"
+        return timestamp, signature
+
+    alice_reads = [await read(alice, mocked_alice_backend_sock, 1)]
+    bob_reads = [await read(bob, mocked_bob_backend_sock, 1)]
+    alice_reads.append(await read(alice, mocked_alice_backend_sock, 1))
+
+    # Consecutive reads of a version are a single entry, each device only gets its own reads
+    for device, sock, reads in ((alice, mocked_alice_backend_sock, alice_reads),
+                                (bob, mocked_bob_backend_sock, bob_reads)):
+        rep = await vlob_history(sock, vlob_id, after_version=1, before_version=None)
+        assert rep["status"] == "ok"
+        assert len(rep["history"]) == 2
+        write_entry, reads_entry = rep["history"]
+        assert "reads_count" not in write_entry
+        assert reads_entry["is_read_op"] and reads_entry["version"] == 1
+        assert reads_entry["reads_count"] == 3
+        assert reads_entry["hash_prev_digest"] == hash_history_entry(write_entry)
+        assert [(read["author"], read["timestamp"], read["signature"]) for read in reads_entry["reads"]] == [
+            (device.device_id, timestamp, signature) for timestamp, signature in reads
+        ]
+        root = reads_entry["signature"].decode("ascii")
+        for read_entry in reads_entry["reads"]:
+            assert verify_read_proof(root, read_entry["author"], read_entry["timestamp"], read_entry["signature"],
+                                     read_entry["proof"])
+            assert not verify_read_proof(root, read_entry["author"], read_entry["timestamp"], b"0",
+                                         read_entry["proof"])
+
+    # The aggregated entry is part of the hash chain
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_id, 1, b"v2", timestamp, 2)
+    rep = await vlob_update(mocked_alice_backend_sock, vlob_id, version=2, blob=b"v2", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None)
+    assert rep["history"][2]["hash_prev_digest"] == hash_history_entry(rep["history"][1])
+
+    # Reads are not aggregated with an operation part of a closed epoch
+    await read(alice, mocked_alice_backend_sock, 2)
+    await read(alice, mocked_alice_backend_sock, 2)
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    await read(alice, mocked_alice_backend_sock, 2)
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=2, before_version=None)
+    assert [entry.get("reads_count") for entry in rep["history"]] == [None, 2, None]
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=2, before_version=None,
+                             checkpoint=True)
+    assert rep["checkpoint"]["hash"] == hash_history_entry(rep["history"][1])
+
+
+@pytest.mark.trio
+async def test_check_operations_alice(backend, running_backend, alice, mocked_alice_backend_sock, alice_core, realm):
+    current_epoch = backend.epoch.get_epoch(alice.organization_id)
     assert current_epoch >= 0
 
     vlob_id = uuid4()
@@ -466,8 +725,7 @@ async def test_check_operations_alice(running_backend, alice, mocked_alice_backe
             if epoch == 0 and i == 0:
                 # initialize vlob reference locally
                 vlob_reference = Vlob(realm, [(blob, alice.device_id, timestamp)], [])
-                hash_obj_after_operation = sha256(
-                    bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+                hash_obj_after_operation = hash_reference_state(vlob_reference, 1, alice.device_id, timestamp, False)
                 new_operation = ServerOperation((vlob_reference_version, alice.device_id, timestamp,
                                                  hash_obj_after_operation, "0", signature, False))
                 vlob_reference.operations.append(new_operation)
@@ -488,8 +746,8 @@ async def test_check_operations_alice(running_backend, alice, mocked_alice_backe
                 if i % 2 == 0:
                     # update data of reference vlob locally
                     vlob_reference.data.append((blob, alice.device_id, timestamp))
-                    hash_obj_after_operation = sha256(
-                        bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+                    hash_obj_after_operation = hash_reference_state(vlob_reference, vlob_reference_version,
+                                                                    alice.device_id, timestamp, False)
                     hash_prev_digest = "0"
                     if vlob_reference.current_operation != 0:
                         last_op = vlob_reference.operations[vlob_reference.current_operation - 1].operation
@@ -524,8 +782,8 @@ async def test_check_operations_alice(running_backend, alice, mocked_alice_backe
                         int(i - 1 + epoch * number_epochs).__str__(), encoding='utf-8') + bytes(".", encoding='utf-8')
                     signature = create_signature_read(alice, vlob_id, encryption_revision, timestamp,
                                                       vlob_reference_version - 1)
-                    hash_obj_after_operation = sha256(
-                        bytes(json.dumps(vlob_reference, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
+                    hash_obj_after_operation = hash_reference_state(vlob_reference, vlob_reference_version - 1,
+                                                                    alice.device_id, timestamp, True)
                     hash_prev_digest = "0"
                     if vlob_reference.current_operation != 0:
                         last_op = vlob_reference.operations[vlob_reference.current_operation - 1].operation
@@ -553,7 +811,7 @@ async def test_check_operations_alice(running_backend, alice, mocked_alice_backe
                         assert alice.local_operation_storage.storage.get(vlob_id)[3] == vlob_backend_version - 1
                         val_list = list(alice.local_operation_storage.storage[vlob_id])
                         # print(rep['blob'])
-                        val_list[6].append((rep['version'], base64.b64encode(rep['blob']).decode('utf-8')))
+                        val_list[6].append((rep['version'], content_digest(rep['blob'])))
                         alice.local_operation_storage.storage[vlob_id] = tuple(val_list)
         assert (await alice_core.check_operations_epoch(after_epoch=alice.local_operation_storage.epoch,
                                                         before_epoch=alice.local_operation_storage.epoch))[
@@ -583,7 +841,7 @@ async def test_check_operations_alice(running_backend, alice, mocked_alice_backe
 @pytest.mark.trio
 async def test_check_operations_same_epoch_alice_and_bob(running_backend, alice, bob, mocked_alice_backend_sock,
                                                          mocked_bob_backend_sock, alice_core, bob_core, realm, backend):
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
 
@@ -639,7 +897,7 @@ async def test_check_operations_same_epoch_alice_and_bob(running_backend, alice,
                         # the most current version is update after every operation
                         assert bob.local_operation_storage.storage.get(vlob_id)[3] == vlob_backend_version - 1
                         val_list = list(bob.local_operation_storage.storage[vlob_id])
-                        val_list[6].append((rep['version'], base64.b64encode(rep['blob']).decode('utf-8')))
+                        val_list[6].append((rep['version'], content_digest(rep['blob'])))
                         bob.local_operation_storage.storage[vlob_id] = tuple(val_list)
 
         assert (await alice_core.check_operations_epoch(after_epoch=alice.local_operation_storage.epoch,
@@ -654,7 +912,7 @@ async def test_check_operations_same_epoch_alice_and_bob(running_backend, alice,
 async def test_check_operations_different_epoch_alice_and_bob(running_backend, alice, bob, mocked_alice_backend_sock,
                                                               mocked_bob_backend_sock, alice_core, bob_core, realm,
                                                               backend):
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
 
@@ -721,8 +979,133 @@ async def test_check_operations_different_epoch_alice_and_bob(running_backend, a
 
 
 @pytest.mark.trio
-async def test_equality_hash_latest_digest_from_history_and_from_blockchain(alice, mocked_alice_backend_sock, realm):
-    current_epoch = get_epoch()
+async def test_check_operations_catch_up_several_epochs(running_backend, alice, mocked_alice_backend_sock,
+                                                        alice_core, realm, backend, monkeypatch):
+    # History is retrieved over several pages
+    monkeypatch.setattr("parsec.core.logged_core.VLOB_HISTORY_MAX_PAGE_SIZE", 3)
+    vlob_id = uuid4()
+    untouched_vlob_id = uuid4()
+    encryption_revision = 1
+
+    for vid in (vlob_id, untouched_vlob_id):
+        timestamp = pendulum_now()
+        signature = create_signature_write(alice, vid, encryption_revision, b"v1", timestamp, 1)
+        rep = await vlob_create(mocked_alice_backend_sock, realm, vid, blob=b"v1", timestamp=timestamp,
+                                signature=signature)
+        assert rep["status"] == "ok"
+        alice.local_operation_storage.add_op(vid, 1, (timestamp, alice.local_operation_storage.epoch, signature))
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    assert (await alice_core.check_operations_epoch(after_epoch=alice.local_operation_storage.epoch,
+                                                    before_epoch=alice.local_operation_storage.epoch))[
+               0] == CheckError.NO_ERROR
+
+    # Device misses several epochs, during which only one of its vlobs is modified
+    after_epoch = alice.local_operation_storage.epoch
+    vlob_backend_version = 2
+    for epoch in range(number_epochs):
+        for i in range(operations_per_epoch):
+            timestamp = pendulum_now()
+            blob = b"Catch up " + bytes([i + epoch * number_epochs])
+            signature = create_signature_write(alice, vlob_id, encryption_revision, blob, timestamp,
+                                               vlob_backend_version)
+            rep = await vlob_update(mocked_alice_backend_sock, vlob_id, encryption_revision=encryption_revision,
+                                    version=vlob_backend_version, blob=blob, timestamp=timestamp,
+                                    signature=signature)
+            assert rep["status"] == "ok"
+            alice.local_operation_storage.add_op(vlob_id, vlob_backend_version,
+                                                 (timestamp, alice.local_operation_storage.epoch, signature))
+            vlob_backend_version += 1
+        backend.epoch.end_epoch(alice.organization_id)
+        await trio.testing.wait_all_tasks_blocked()
+    before_epoch = after_epoch + number_epochs - 1
+
+    # All the missed epochs are verified at once
+    assert (await alice_core.check_operations_epoch(after_epoch=after_epoch, before_epoch=before_epoch))[
+               0] == CheckError.NO_ERROR
+    assert alice.local_operation_storage.epoch == before_epoch + 1
+    assert alice.local_operation_storage.storage[vlob_id][1] == []
+    assert alice.local_operation_storage.storage[vlob_id][2] == vlob_backend_version - 1
+    assert alice.local_operation_storage.storage[untouched_vlob_id][2] == 1
+    assert not alice.local_operation_storage.storage[untouched_vlob_id][5]
+
+    # Epochs already verified are not checked again
+    assert await alice_core.verify_operations_epoch(after_epoch=after_epoch, before_epoch=before_epoch) == {}
+    assert alice.local_operation_storage.epoch == before_epoch + 1
+    # The epoch of the device cannot be skipped
+    with pytest.raises(ValueError):
+        await alice_core.verify_operations_epoch(after_epoch=before_epoch + 2, before_epoch=before_epoch + 2)
+
+
+@pytest.mark.trio
+async def test_check_operations_aggregated_reads_alice_and_bob(running_backend, alice, bob, mocked_alice_backend_sock,
+                                                               mocked_bob_backend_sock, alice_core, bob_core, realm,
+                                                               backend):
+    rep = await _realm_generate_certif_and_update_roles_or_fail(mocked_alice_backend_sock, alice, realm, bob.user_id,
+                                                                RealmRole.CONTRIBUTOR)
+    assert rep["status"] == "ok"
+    vlob_id = uuid4()
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+    rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+    alice.local_operation_storage.add_op(vlob_id, 1, (timestamp, alice.local_operation_storage.epoch, signature))
+
+    # Reads of both devices aggregated in a single entry
+    for device, sock in ((alice, mocked_alice_backend_sock), (bob, mocked_bob_backend_sock),
+                         (alice, mocked_alice_backend_sock)):
+        timestamp = pendulum_now()
+        signature = create_signature_read(device, vlob_id, 1, timestamp, 1)
+        rep = await vlob_read(sock, vlob_id, version=1, signature=signature, timestamp=timestamp)
+        assert rep["status"] == "ok"
+        device.local_operation_storage.add_op(
+            vlob_id, 1, (timestamp, device.local_operation_storage.epoch, signature, True))
+        device.local_operation_storage.add_read_content(vlob_id, 1, rep["blob"])
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+
+    assert (await alice_core.check_operations_epoch(after_epoch=alice.local_operation_storage.epoch,
+                                                    before_epoch=alice.local_operation_storage.epoch))[
+               0] == CheckError.NO_ERROR
+    assert (await bob_core.check_operations_epoch(after_epoch=bob.local_operation_storage.epoch,
+                                                  before_epoch=bob.local_operation_storage.epoch))[
+               0] == CheckError.NO_ERROR
+
+
+@pytest.mark.trio
+async def test_check_operations_read_after_epoch_closed(running_backend, alice, mocked_alice_backend_sock, alice_core,
+                                                        realm, backend):
+    vlob_id = uuid4()
+    epoch = alice.local_operation_storage.epoch
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+    rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+    alice.local_operation_storage.add_op(vlob_id, 1, (timestamp, epoch, signature))
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+
+    # Read made during the next epoch, before the device verifies the closed one
+    timestamp = pendulum_now()
+    signature = create_signature_read(alice, vlob_id, 1, timestamp, 1)
+    rep = await vlob_read(mocked_alice_backend_sock, vlob_id, version=1, signature=signature, timestamp=timestamp)
+    assert rep["status"] == "ok"
+    read_operation = (timestamp, epoch + 1, signature, True)
+    alice.local_operation_storage.add_op(vlob_id, 1, read_operation)
+
+    # The history ends with the checkpoint of the closed epoch, the read is left to the next one
+    assert await alice_core.verify_operations_epoch(after_epoch=epoch, before_epoch=epoch) == {}
+    assert alice.local_operation_storage.epoch == epoch + 1
+    assert alice.local_operation_storage.storage[vlob_id][1] == [read_operation]
+    assert alice.local_operation_storage.storage[vlob_id][2] == 1
+    assert not alice.local_operation_storage.storage[vlob_id][5]
+
+
+@pytest.mark.trio
+async def test_equality_hash_latest_digest_from_history_and_from_blockchain(backend, alice, mocked_alice_backend_sock, realm):
+    current_epoch = backend.epoch.get_epoch(alice.organization_id)
     assert current_epoch >= 0
 
     vlob_id = uuid4()
@@ -752,29 +1135,31 @@ async def test_equality_hash_latest_digest_from_history_and_from_blockchain(alic
                 vlob_backend_version += 1
 
         rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=latest_safe_version_vlob_backend,
-                                 before_version=vlob_backend_version)
+                                 before_version=vlob_backend_version, checkpoint=True)
         assert rep["status"] == "ok"
 
-        checkpoints_list = retrieve_checkpoint(alice.organization_id, vlob_id)
-
         last_op = rep['history'][len(rep['history']) - 1]
         op_to_hash = ServerOperation((last_op['version'], last_op['author'], last_op['timestamp'],
                                       last_op['hash_obj_after_operation'], last_op['hash_prev_digest'],
                                       last_op['signature'], last_op['is_read_op']))
 
-        assert checkpoints_list.checkpoints[epoch][0] == current_epoch + epoch
-        assert checkpoints_list.checkpoints[epoch][1] == sha256(
+        checkpoint = rep['checkpoint']
+        assert checkpoint['epoch'] == current_epoch + epoch
+        assert checkpoint['hash'] == sha256(
             bytes(json.dumps(op_to_hash, cls=Encoder), encoding='utf-8')).hexdigest().__str__()
-        assert checkpoints_list.checkpoints[epoch][2] == vlob_backend_version - 1
+        assert checkpoint['version'] == vlob_backend_version - 1
+
+        root = await retrieve_epoch_root(alice.organization_id, checkpoint['epoch'])
+        assert verify_merkle_proof(root, vlob_id, checkpoint['hash'], checkpoint['version'], checkpoint['proof'])
 
 
 @pytest.mark.trio
-async def test_invalid_signature_error_alice_and_bob_faulty_backend(running_backend, alice, bob,
+async def test_invalid_signature_error_alice_and_bob_faulty_backend(backend, running_backend, alice, bob,
                                                                     mocked_alice_backend_sock, mocked_bob_backend_sock,
                                                                     alice_core, bob_core, realm,
                                                                     faulty_backend_signature):
     global epoch_to_attack
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
     blob = b"Initial commit."
@@ -858,12 +1243,12 @@ async def test_invalid_signature_error_alice_and_bob_faulty_backend(running_back
 
 
 @pytest.mark.trio
-async def test_switch_operation_error_alice_and_bob_faulty_backend(running_backend, alice, bob,
+async def test_switch_operation_error_alice_and_bob_faulty_backend(backend, running_backend, alice, bob,
                                                                    mocked_alice_backend_sock, mocked_bob_backend_sock,
                                                                    alice_core, bob_core, realm,
                                                                    faulty_backend_switch_operation):
     global epoch_to_attack
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
 
@@ -948,11 +1333,11 @@ async def test_switch_operation_error_alice_and_bob_faulty_backend(running_backe
 
 
 @pytest.mark.trio
-async def test_hash_chain_error_alice_and_bob_faulty_backend(running_backend, alice, bob, mocked_alice_backend_sock,
+async def test_hash_chain_error_alice_and_bob_faulty_backend(backend, running_backend, alice, bob, mocked_alice_backend_sock,
                                                              mocked_bob_backend_sock, alice_core, bob_core, realm,
                                                              faulty_backend_hash_chain):
     global epoch_to_attack
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
 
@@ -1036,12 +1421,12 @@ async def test_hash_chain_error_alice_and_bob_faulty_backend(running_backend, al
 
 
 @pytest.mark.trio
-async def test_check_timestamp_error_alice_and_bob_faulty_backend(running_backend, alice, bob,
+async def test_check_timestamp_error_alice_and_bob_faulty_backend(backend, running_backend, alice, bob,
                                                                   mocked_alice_backend_sock, mocked_bob_backend_sock,
                                                                   alice_core, bob_core, realm,
                                                                   faulty_backend_timestamp):
     global epoch_to_attack
-    assert get_epoch() >= 0
+    assert backend.epoch.get_epoch(alice.organization_id) >= 0
 
     vlob_id = uuid4()
 
@@ -1117,3 +1502,167 @@ async def test_check_timestamp_error_alice_and_bob_faulty_backend(running_backen
             assert (await bob_core.check_operations_epoch(after_epoch=bob.local_operation_storage.epoch,
                                                           before_epoch=bob.local_operation_storage.epoch))[
                        0] == CheckError.NO_ERROR
+
+
+@pytest.mark.trio
+async def test_epoch_checkpoints_published_as_merkle_root(backend, monkeypatch, alice, mocked_alice_backend_sock, realm):
+    from parsec.backend.memory.vlob import broadcast_batch_tx
+
+    batches = []
+
+    async def broadcast_batch_tx_spy(items):
+        batches.append(items)
+        return await broadcast_batch_tx(items)
+
+    async def broadcast_tx_spy(key, value):
+        assert False, "checkpoints must not be published one by one"
+
+    monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch_tx_spy)
+    monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_tx", broadcast_tx_spy)
+
+    vlob_ids = [uuid4(), uuid4(), uuid4()]
+    for vlob_id in vlob_ids:
+        timestamp = pendulum_now()
+        signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+        rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                                signature=signature)
+        assert rep["status"] == "ok"
+
+    # Vlob not checkpointed yet
+    rep = await vlob_history(mocked_alice_backend_sock, vlob_ids[0], after_version=1, before_version=None,
+                             checkpoint=True)
+    assert rep["status"] == "ok"
+    assert rep["checkpoint"] is None
+
+    # The epoch ends with the organization's `operations_per_epoch`-th operation
+    last_version = operations_per_epoch - len(vlob_ids) + 1
+    for version in range(2, last_version + 1):
+        timestamp = pendulum_now()
+        signature = create_signature_write(alice, vlob_ids[0], 1, b"vx", timestamp, version)
+        rep = await vlob_update(mocked_alice_backend_sock, vlob_ids[0], version=version, blob=b"vx",
+                                timestamp=timestamp, signature=signature)
+        assert rep["status"] == "ok"
+
+    # A single root is published for the whole epoch
+    assert len(batches) == 1
+    ((key, root),) = batches[0]
+    epoch = backend.epoch.get_epoch(alice.organization_id) - 1
+    assert key == create_key_epoch_root(alice.organization_id, epoch)
+    assert await retrieve_epoch_root(alice.organization_id, epoch) == root
+
+    for vlob_id, version in zip(vlob_ids, (last_version, 1, 1)):
+        rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None,
+                                 checkpoint=True)
+        assert rep["status"] == "ok"
+        checkpoint = rep["checkpoint"]
+        assert checkpoint["epoch"] == epoch
+        assert checkpoint["version"] == version
+        assert rep["history"][-1]["version"] == version
+        assert verify_merkle_proof(root, vlob_id, checkpoint["hash"], checkpoint["version"], checkpoint["proof"])
+        # Proof is bound to the vlob and its checkpoint
+        assert not verify_merkle_proof(root, vlob_id, checkpoint["hash"], checkpoint["version"] + 1,
+                                       checkpoint["proof"])
+        assert not verify_merkle_proof(root, uuid4(), checkpoint["hash"], checkpoint["version"],
+                                       checkpoint["proof"])
+
+
+@pytest.mark.trio
+async def test_checkpoints_only_for_vlobs_modified_during_epoch(backend, alice, mocked_alice_backend_sock, realm):
+    vlob_ids = [uuid4(), uuid4()]
+    for vlob_id in vlob_ids:
+        timestamp = pendulum_now()
+        signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+        rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                                signature=signature)
+        assert rep["status"] == "ok"
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    first_epoch = backend.epoch.get_epoch(alice.organization_id) - 1
+
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_ids[0], 1, b"v2", timestamp, 2)
+    rep = await vlob_update(mocked_alice_backend_sock, vlob_ids[0], version=2, blob=b"v2", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+    backend.epoch.end_epoch(alice.organization_id)
+    await trio.testing.wait_all_tasks_blocked()
+    second_epoch = backend.epoch.get_epoch(alice.organization_id) - 1
+    assert second_epoch > first_epoch
+
+    # Only the modified vlob is part of the new epoch
+    assert list(backend.vlob._epoch_checkpoints[alice.organization_id][second_epoch].checkpoints) == [vlob_ids[0]]
+
+    async def get_checkpoint(vlob_id, checkpoint_epoch=None):
+        rep = await vlob_history(mocked_alice_backend_sock, vlob_id, after_version=1, before_version=None,
+                                 checkpoint=True, checkpoint_epoch=checkpoint_epoch)
+        assert rep["status"] == "ok"
+        checkpoint = rep["checkpoint"]
+        if checkpoint:
+            root = await retrieve_epoch_root(alice.organization_id, checkpoint["epoch"])
+            assert verify_merkle_proof(root, vlob_id, checkpoint["hash"], checkpoint["version"],
+                                       checkpoint["proof"])
+            assert rep["history"][-1]["version"] == checkpoint["version"]
+        return checkpoint
+
+    checkpoint = await get_checkpoint(vlob_ids[0])
+    assert (checkpoint["epoch"], checkpoint["version"]) == (second_epoch, 2)
+    # Untouched vlob keeps its checkpoint from the previous epoch
+    checkpoint = await get_checkpoint(vlob_ids[1])
+    assert (checkpoint["epoch"], checkpoint["version"]) == (first_epoch, 1)
+
+    # Latest checkpoint at or before a given epoch
+    checkpoint = await get_checkpoint(vlob_ids[0], checkpoint_epoch=second_epoch - 1)
+    assert (checkpoint["epoch"], checkpoint["version"]) == (first_epoch, 1)
+    checkpoint = await get_checkpoint(vlob_ids[1], checkpoint_epoch=second_epoch + 10)
+    assert (checkpoint["epoch"], checkpoint["version"]) == (first_epoch, 1)
+    assert await get_checkpoint(vlob_ids[0], checkpoint_epoch=first_epoch - 1) is None
+
+
+@pytest.mark.trio
+async def test_checkpoints_kept_pending_when_epoch_publication_fails(
+    backend, alice, mocked_alice_backend_sock, realm, monkeypatch
+):
+    organization_id = alice.organization_id
+    epoch = backend.epoch.get_epoch(organization_id)
+    vlob_id = uuid4()
+    timestamp = pendulum_now()
+    signature = create_signature_write(alice, vlob_id, 1, b"v1", timestamp, 1)
+    rep = await vlob_create(mocked_alice_backend_sock, realm, vlob_id, blob=b"v1", timestamp=timestamp,
+                            signature=signature)
+    assert rep["status"] == "ok"
+
+    async def failing_broadcast_batch(items):
+        raise TendermintError("unreachable")
+
+    async def failing_wait_committed(tx_hash):
+        raise TendermintError("not committed")
+
+    # Transaction not sent, then sent but not committed
+    mocked_bc = MockedBlockchain()
+    for broadcast_batch, wait_committed in [
+        (failing_broadcast_batch, mocked_bc.wait_committed),
+        (mocked_bc.broadcast_batch, failing_wait_committed),
+    ]:
+        monkeypatch.setattr("parsec.backend.memory.vlob.broadcast_batch_tx", broadcast_batch)
+        monkeypatch.setattr("parsec.backend.memory.vlob.wait_tx_committed", wait_committed)
+        with pytest.raises(TendermintError):
+            await backend.vlob.close_epoch(organization_id, epoch, alice.device_id)
+        # Nothing is recorded for the unpublished epoch
+        assert epoch not in backend.vlob._epoch_checkpoints[organization_id]
+        assert not backend.vlob._vlob_checkpoint_epochs.get((organization_id, vlob_id))
+
+    # The vlob is checkpointed by the next attempt
+    monkeypatch.setattr("parsec.backend.memory.vlob.wait_tx_committed", mocked_bc.wait_committed)
+    await backend.vlob.close_epoch(organization_id, epoch, alice.device_id)
+    assert list(backend.vlob._epoch_checkpoints[organization_id][epoch].checkpoints) == [vlob_id]
+    assert backend.vlob._vlob_checkpoint_epochs[(organization_id, vlob_id)] == [epoch]
+
+
+def test_merkle_proofs():
+    leaves = [(uuid4(), sha256(bytes([i])).hexdigest(), i + 1) for i in range(7)]
+    for size in range(1, len(leaves) + 1):
+        epoch_checkpoints = EpochCheckpoints.build(0, leaves[:size])
+        for vlob_id, op_hash, version in leaves[:size]:
+            proof = epoch_checkpoints.proof(vlob_id)
+            assert verify_merkle_proof(epoch_checkpoints.root, vlob_id, op_hash, version, proof)
+            assert not verify_merkle_proof(epoch_checkpoints.root, vlob_id, "0" * 64, version, proof)
@@ -0,0 +1,140 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import pytest
+import rlp
+
+from parsec.backend.tendermint import encode_tx, decode_items
+
+pytest.importorskip("abci")
+from abci_server import (  # noqa: E402
+    MetadataBlockchain,
+    State,
+    decode_tx,
+    verify_proof,
+    _prefix_upper_bound,
+)
+
+
+class QueryRequest:
+    def __init__(self, data, prove=False, path=""):
+        self.data = data
+        self.prove = prove
+        self.path = path
+
+
+def _query(app, key):
+    rep = app.query(QueryRequest(key, prove=True))
+    return rep.value, rlp.decode(rep.proof.ops[0].data)
+
+
+def test_state_persisted_across_restarts(tmpdir):
+    db = str(tmpdir / "state.db")
+    app = MetadataBlockchain(State.load_state(db))
+    assert app.info(None).last_block_height == 0
+
+    assert app.deliver_tx(encode_tx([(b"a", b"1"), (b"b", b"2")])).code == 0
+    app_hash = app.commit().data
+    app.state.db.close()
+
+    app = MetadataBlockchain(State.load_state(db))
+    info = app.info(None)
+    assert info.last_block_height == 1
+    assert info.last_block_app_hash == app_hash
+    assert app.query(QueryRequest(b"b")).value == b"2"
+
+    # Uncommitted block is discarded on restart
+    app.deliver_tx(encode_tx([(b"b", b"3")]))
+    app.state.db.close()
+    app = MetadataBlockchain(State.load_state(db))
+    assert app.state.apphash == app_hash
+    assert app.query(QueryRequest(b"b")).value == b"2"
+
+
+def test_app_hash_is_state_root():
+    app_1 = MetadataBlockchain()
+    app_2 = MetadataBlockchain()
+    app_1.deliver_tx(encode_tx([(b"a", b"1"), (b"b", b"2")]))
+    app_2.deliver_tx(encode_tx([(b"b", b"2")]))
+    app_2.deliver_tx(encode_tx([(b"a", b"1")]))
+    assert app_1.commit().data == app_2.commit().data
+
+    app_2.deliver_tx(encode_tx([(b"a", b"2")]))
+    assert app_1.commit().data != app_2.commit().data
+
+
+def test_query_proof():
+    app = MetadataBlockchain()
+    app.deliver_tx(encode_tx([(b"a", b"1"), (b"b", b"2")]))
+    app_hash = app.commit().data
+
+    value, proof = _query(app, b"a")
+    assert value == b"1"
+    assert verify_proof(app_hash, b"a", b"1", proof)
+    assert not verify_proof(app_hash, b"a", b"2", proof)
+    assert not verify_proof(app_hash, b"a", b"1", [])
+
+    # Absence of a key is proven as well
+    value, proof = _query(app, b"c")
+    assert value == b"0"
+    assert verify_proof(app_hash, b"c", b"", proof)
+
+
+def test_snapshot_restore(tmpdir):
+    app = MetadataBlockchain(State.load_state(str(tmpdir / "state.db")))
+    app.deliver_tx(encode_tx([(b"a", b"1")]))
+    app_hash = app.commit().data
+    snapshot = app.state.snapshot(str(tmpdir / "snapshot.db"))
+    app.deliver_tx(encode_tx([(b"a", b"2")]))
+    app.commit()
+
+    app = MetadataBlockchain(State.restore(snapshot, str(tmpdir / "restored.db")))
+    info = app.info(None)
+    assert info.last_block_height == 1
+    assert info.last_block_app_hash == app_hash
+    assert app.query(QueryRequest(b"a")).value == b"1"
+
+
+def test_binary_transaction():
+    items = [(b"(vlob, CoolOrg, 1)", b'{"blob": "a+b/c=="}'), (b"k&e?y", b""), (b"", b"\x00" * 300)]
+    tx = encode_tx(items)
+    assert [(bytes(key), bytes(value)) for key, value in decode_tx(tx)] == items
+
+    app = MetadataBlockchain()
+    assert app.check_tx(tx).code == 0
+    assert app.deliver_tx(tx).code == 0
+    app.commit()
+    assert app.query(QueryRequest(b"k&e?y")).value == b"0"  # Empty value
+    assert app.query(QueryRequest(b"(vlob, CoolOrg, 1)")).value == b'{"blob": "a+b/c=="}'
+
+    for malformed in (b"", b"Key?a&Value?b", tx[:-1], tx[:3], encode_tx([])):
+        with pytest.raises(ValueError):
+            decode_tx(malformed)
+        assert app.check_tx(malformed).code != 0
+        assert app.deliver_tx(malformed).code != 0
+
+
+def test_prefix_query():
+    app = MetadataBlockchain()
+    realm_a = [(f"(realm_vlobs, Org, A, {i})".encode(), str(i).encode()) for i in range(3)]
+    others = [(b"(realm_vlobs, Org, AB, 0)", b"x"), (b"(realm_vlobs, Org2, A, 0)", b"y"), (b"~", b"z")]
+    app.deliver_tx(encode_tx(others + list(reversed(realm_a))))
+    # Index only reflects the committed state
+    assert app.query(QueryRequest(b"(realm_vlobs, Org, A, ", path="/prefix")).value == b""
+    app.commit()
+
+    def _prefix(prefix):
+        rep = app.query(QueryRequest(prefix, path="/prefix"))
+        return [(key.encode(), value) for key, value in decode_items(rep.value)]
+
+    assert _prefix(b"(realm_vlobs, Org, A, ") == realm_a
+    assert _prefix(b"(realm_vlobs, Org, ") == realm_a + others[:1]
+    assert _prefix(b"~") == others[2:]
+    assert _prefix(b"(unknown") == []
+    assert _prefix_upper_bound(b"a\xff") == b"b"
+    assert _prefix_upper_bound(b"\xff\xff") is None
+
+    # Empty value deletes the key
+    app.deliver_tx(encode_tx([(realm_a[1][0], b"")]))
+    app.commit()
+    assert _prefix(b"(realm_vlobs, Org, A, ") == [realm_a[0], realm_a[2]]
+    assert app.query(QueryRequest(realm_a[1][0])).value == b"0"
@@ -0,0 +1,114 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import pytest
+import trio
+
+from parsec.backend.tendermint import TendermintRPCError
+from parsec.backend.blockchain.cache import BlockchainCache
+
+
+class Fetcher:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class FakeClient:
+    def __init__(self, block_txs):
+        # height -> number of transactions in the block
+        self.block_txs = block_txs
+
+    async def call(self, method, **params):
+        assert method == "blockchain"
+        if not self.block_txs:
+            raise TendermintRPCError("Method not found")
+        heights = range(int(params["minHeight"]), int(params["maxHeight"]) + 1)
+        return {
+            "block_metas": [
+                {"header": {"height": str(h)}, "num_txs": str(self.block_txs[h])} for h in heights
+            ]
+        }
+
+
+@pytest.mark.trio
+async def test_read_through_and_invalidation():
+    cache = BlockchainCache()
+    fetch = Fetcher({"checkpoint": 1})
+    assert await cache.get("a", fetch) == {"checkpoint": 1}
+    value = await cache.get("a", fetch)
+    assert fetch.calls == 1
+
+    # Cached value cannot be modified through the returned copy
+    value["checkpoint"] = 2
+    assert await cache.get("a", fetch) == {"checkpoint": 1}
+
+    cache.invalidate(["a"])
+    await cache.get("a", fetch)
+    assert fetch.calls == 2
+
+    not_cacheable = Fetcher(None)
+    await cache.get("b", not_cacheable, cacheable=lambda value: value is not None)
+    await cache.get("b", not_cacheable, cacheable=lambda value: value is not None)
+    assert not_cacheable.calls == 2
+
+
+@pytest.mark.trio
+async def test_lru_eviction():
+    cache = BlockchainCache(max_size=2)
+    fetchers = {key: Fetcher(key) for key in "abc"}
+    await cache.get("a", fetchers["a"])
+    await cache.get("b", fetchers["b"])
+    await cache.get("a", fetchers["a"])  # "b" is now the least recently used
+    await cache.get("c", fetchers["c"])
+    assert len(cache) == 2
+    await cache.get("a", fetchers["a"])
+    await cache.get("b", fetchers["b"])
+    assert fetchers["a"].calls == 1
+    assert fetchers["b"].calls == 2
+
+
+@pytest.mark.trio
+async def test_value_fetched_during_write_not_cached():
+    cache = BlockchainCache()
+    fetched = trio.Event()
+    written = trio.Event()
+
+    async def slow_fetch():
+        fetched.set()
+        await written.wait()
+        return "outdated"
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(cache.get, "a", slow_fetch)
+        await fetched.wait()
+        cache.invalidate(["a"])
+        written.set()
+
+    assert await cache.get("a", Fetcher("new")) == "new"
+
+
+@pytest.mark.trio
+async def test_cleared_by_foreign_blocks():
+    client = FakeClient({2: 1, 3: 0, 4: 1})
+    cache = BlockchainCache()
+    fetch = Fetcher("value")
+    await cache.observe_height(client, 1)
+    await cache.get("a", fetch)
+
+    # Block 2 is our own write, block 3 is empty
+    cache.invalidate(["b"], height=2)
+    await cache.observe_height(client, 3)
+    assert len(cache) == 1
+
+    # Block 4 contains a transaction from another writer
+    await cache.observe_height(client, 4)
+    assert len(cache) == 0
+
+    # Block metas not available
+    await cache.get("a", fetch)
+    await cache.observe_height(FakeClient({}), 5)
+    assert len(cache) == 0
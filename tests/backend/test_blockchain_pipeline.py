@@ -0,0 +1,160 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import pytest
+import trio
+
+from parsec.backend.tendermint import TendermintRPCError, encode_tx
+from parsec.backend.blockchain.cache import BlockchainCache
+from parsec.backend.blockchain.pipeline import WritePipeline, MAX_RECORDED_FAILURES
+
+
+class FakeClient:
+    def __init__(self):
+        self.state = {}
+        self.mempool = {}
+        self.results = {}
+        self.height = 0
+
+    async def broadcast_tx_sync(self, tx):
+        tx_hash = f"{len(self.mempool) + len(self.results):064X}"
+        self.mempool[tx_hash] = tx
+        return {"code": 0, "hash": tx_hash}
+
+    def commit(self, items, code=0):
+        # Transactions are committed in submission order
+        tx_hash, tx = next(iter(self.mempool.items()))
+        assert tx == encode_tx(items)
+        del self.mempool[tx_hash]
+        self.height += 1
+        if code == 0:
+            for key, value in items:
+                if value:
+                    self.state[key] = value
+                else:
+                    self.state.pop(key, None)
+        self.results[tx_hash] = {"height": str(self.height), "tx_result": {"code": code}}
+
+    async def wait_for_tx(self, tx_hash):
+        while tx_hash not in self.results:
+            await trio.sleep(0.01)
+        rep = self.results[tx_hash]
+        if rep["tx_result"]["code"]:
+            raise TendermintRPCError(f"Transaction {tx_hash} failed")
+        return rep
+
+    async def abci_query(self, key):
+        return self.state.get(key, b"0")
+
+    async def abci_query_prefix(self, prefix):
+        return sorted((k, v) for k, v in self.state.items() if k.startswith(prefix))
+
+
+@pytest.mark.trio
+async def test_read_pending_writes():
+    client = FakeClient()
+    pipeline = WritePipeline(BlockchainCache())
+    client.state = {"a": b"1", "b": b"2"}
+
+    await pipeline.submit(client, [("a", "3"), ("b", b""), ("c", b"4")])
+    assert len(pipeline) == 1
+    assert await pipeline.query(client, "a") == b"3"
+    assert await pipeline.query(client, "b") == b"0"
+    assert await pipeline.query_prefix(client, "") == [("a", b"3"), ("c", b"4")]
+
+    # Pending couples are dropped once committed
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(pipeline.run, client)
+        client.commit([("a", b"3"), ("b", b""), ("c", b"4")])
+        await pipeline.flush()
+        assert len(pipeline) == 0
+        client.state["a"] = b"5"
+        assert await pipeline.query(client, "a") == b"5"
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_key_written_again_while_pending():
+    client = FakeClient()
+    pipeline = WritePipeline(BlockchainCache())
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(pipeline.run, client)
+        await pipeline.submit(client, [("a", b"1")])
+        await pipeline.submit(client, [("a", b"2")])
+
+        client.commit([("a", b"1")])
+        await trio.testing.wait_all_tasks_blocked()
+        assert len(pipeline) == 1
+        # Still the value of the second transaction
+        assert await pipeline.query(client, "a") == b"2"
+
+        client.commit([("a", b"2")])
+        await pipeline.flush()
+        assert await pipeline.query(client, "a") == b"2"
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_failed_transaction():
+    client = FakeClient()
+    pipeline = WritePipeline(BlockchainCache())
+    client.state = {"a": b"1"}
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(pipeline.run, client)
+        await pipeline.submit(client, [("a", b"2")])
+        assert await pipeline.query(client, "a") == b"2"
+
+        client.commit([("a", b"2")], code=1)
+        with pytest.raises(TendermintRPCError):
+            await pipeline.flush()
+        # The committed value is read again
+        assert await pipeline.query(client, "a") == b"1"
+
+        # Failures are only raised once
+        await pipeline.flush()
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_failed_transaction_raised_on_next_access_of_its_keys():
+    client = FakeClient()
+    pipeline = WritePipeline(BlockchainCache())
+    client.state = {"a": b"1", "b": b"1"}
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(pipeline.run, client)
+        await pipeline.submit(client, [("a", b"2"), ("b", b"2")])
+        await pipeline.submit(client, [("c", b"3")])
+        client.commit([("a", b"2"), ("b", b"2")], code=1)
+        client.commit([("c", b"3")])
+        await pipeline.join()
+
+        # Other keys are not concerned
+        assert await pipeline.query(client, "c") == b"3"
+        # Each key of the failed transaction raises once, on read or write
+        with pytest.raises(TendermintRPCError):
+            await pipeline.query(client, "a")
+        assert await pipeline.query(client, "a") == b"1"
+        with pytest.raises(TendermintRPCError):
+            await pipeline.submit(client, [("b", b"4")])
+        assert len(pipeline) == 0
+        assert await pipeline.query_prefix(client, "") == [("a", b"1"), ("b", b"1"), ("c", b"3")]
+        await pipeline.flush()
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_recorded_failures_are_capped():
+    client = FakeClient()
+    pipeline = WritePipeline(BlockchainCache())
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(pipeline.run, client)
+        keys = [f"k{i}" for i in range(MAX_RECORDED_FAILURES + 1)]
+        await pipeline.submit(client, [(key, b"1") for key in keys])
+        client.commit([(key, b"1") for key in keys], code=1)
+        await pipeline.join()
+
+        # The oldest failure has been dropped
+        assert await pipeline.query(client, keys[0]) == b"0"
+        with pytest.raises(TendermintRPCError):
+            await pipeline.query_prefix(client, "k")
+        assert await pipeline.query_prefix(client, "k") == []
+        nursery.cancel_scope.cancel()
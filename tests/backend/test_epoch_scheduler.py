@@ -0,0 +1,176 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
+
+import pytest
+import trio
+from types import SimpleNamespace
+
+from parsec.api.protocol import DeviceID, OrganizationID
+from parsec.backend.epoch import EpochScheduler, EPOCH_CLOSE_RETRY_DELAY
+from parsec.backend.tendermint import TendermintError
+
+
+class VlobComponent:
+    def __init__(self):
+        self.closed = []
+        self.release = trio.Event()
+        self.release.set()
+        self.errors = []
+
+    async def close_epoch(self, organization_id, epoch, author):
+        self.closed.append((organization_id, epoch, author))
+        await self.release.wait()
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def scheduler_factory(interval=None, max_operations=None, max_bytes=None):
+    config = SimpleNamespace(
+        epoch_interval=interval, epoch_max_operations=max_operations, epoch_max_bytes=max_bytes
+    )
+    scheduler = EpochScheduler(config)
+    vlob = VlobComponent()
+    scheduler.register_components(vlob=vlob)
+    return scheduler, vlob
+
+
+ORG1 = OrganizationID("Org1")
+ORG2 = OrganizationID("Org2")
+ALICE = DeviceID("alice@dev1")
+BOB = DeviceID("bob@dev1")
+
+
+@pytest.mark.trio
+async def test_close_on_operations_count_per_organization():
+    scheduler, vlob = scheduler_factory(max_operations=3)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        for _ in range(2):
+            scheduler.record_operation(ORG1, ALICE)
+            scheduler.record_operation(ORG2, ALICE)
+        scheduler.record_operation(ORG1, BOB)
+        # Epoch is not closed by the operation reaching the limit
+        assert vlob.closed == []
+        assert scheduler.get_epoch(ORG1) == 0
+
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, BOB)]
+        assert scheduler.get_epoch(ORG1) == 1
+        assert scheduler.get_epoch(ORG2) == 0
+
+        # Counter is reset for the new epoch
+        scheduler.record_operation(ORG1, ALICE)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, BOB)]
+
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_close_on_bytes():
+    scheduler, vlob = scheduler_factory(max_bytes=100)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        scheduler.record_operation(ORG1, ALICE, 60)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == []
+
+        scheduler.record_operation(ORG1, ALICE, 40)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_close_on_interval(autojump_clock):
+    scheduler, vlob = scheduler_factory(interval=10)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        # No operation, no epoch to close
+        await trio.sleep(30)
+        assert vlob.closed == []
+
+        # Interval starts with the first operation of the epoch
+        scheduler.record_operation(ORG1, ALICE)
+        await trio.sleep(5)
+        scheduler.record_operation(ORG2, BOB)
+        await trio.sleep(6)
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+        await trio.sleep(5)
+        assert vlob.closed == [(ORG1, 0, ALICE), (ORG2, 0, BOB)]
+
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_operations_during_close_count_for_next_epoch():
+    scheduler, vlob = scheduler_factory(max_operations=2)
+    vlob.release = trio.Event()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        scheduler.record_operation(ORG1, ALICE)
+        scheduler.record_operation(ORG1, ALICE)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+
+        # Limit reached again while the previous epoch is still being closed
+        scheduler.record_operation(ORG1, BOB)
+        scheduler.record_operation(ORG1, BOB)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+
+        vlob.release.set()
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE), (ORG1, 1, BOB)]
+        assert scheduler.get_epoch(ORG1) == 2
+
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_end_epoch():
+    scheduler, vlob = scheduler_factory(max_operations=10)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        # Nothing to close
+        scheduler.end_epoch(ORG1)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == []
+
+        scheduler.record_operation(ORG1, ALICE)
+        scheduler.end_epoch(ORG1)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+@pytest.mark.parametrize("error", [TendermintError("unreachable"), RuntimeError("unexpected")])
+async def test_failed_close_is_retried(autojump_clock, error):
+    scheduler, vlob = scheduler_factory(max_operations=2)
+    vlob.errors.append(error)
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(scheduler.run)
+
+        scheduler.record_operation(ORG1, ALICE)
+        scheduler.record_operation(ORG1, ALICE)
+        await trio.testing.wait_all_tasks_blocked()
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+        # The epoch is not skipped and the scheduler keeps running
+        assert scheduler.get_epoch(ORG1) == 0
+
+        scheduler.record_operation(ORG1, BOB)
+        await trio.sleep(EPOCH_CLOSE_RETRY_DELAY / 2)
+        assert vlob.closed == [(ORG1, 0, ALICE)]
+
+        await trio.sleep(EPOCH_CLOSE_RETRY_DELAY)
+        assert vlob.closed == [(ORG1, 0, ALICE), (ORG1, 0, BOB)]
+        assert scheduler.get_epoch(ORG1) == 1
+
+        nursery.cancel_scope.cancel()
@@ -0,0 +1,31 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import pytest
+from uuid import uuid4
+
+from parsec.api.protocol import OrganizationID
+from parsec.backend.block import BlockAlreadyExistsError
+from parsec.backend.memory import MemoryBlockStoreComponent
+
+
+ORG1 = OrganizationID("Org1")
+ORG2 = OrganizationID("Org2")
+
+
+@pytest.mark.trio
+async def test_identical_blocks_stored_once():
+    blockstore = MemoryBlockStoreComponent()
+    block_ids = [uuid4() for _ in range(3)]
+    await blockstore.create(ORG1, block_ids[0], b"content")
+    await blockstore.create(ORG1, block_ids[1], b"content")
+    await blockstore.create(ORG1, block_ids[2], b"other content")
+    assert len(blockstore._contents) == 2
+    for block_id, block in zip(block_ids, [b"content", b"content", b"other content"]):
+        assert await blockstore.read(ORG1, block_id) == block
+
+    # Contents are not shared between organizations
+    await blockstore.create(ORG2, block_ids[0], b"content")
+    assert len(blockstore._contents) == 3
+
+    with pytest.raises(BlockAlreadyExistsError):
+        await blockstore.create(ORG1, block_ids[0], b"content")
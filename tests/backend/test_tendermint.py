@@ -0,0 +1,174 @@
+# Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2016-2021 Scille SAS
+
+import json
+import base64
+import pytest
+import trio
+import h11
+
+from parsec.backend.tendermint import (
+    TendermintClient,
+    TendermintNotAvailable,
+    TendermintRPCError,
+    encode_tx,
+)
+
+
+class FakeTendermintRPC:
+    def __init__(self):
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.handlers = {}
+
+    async def handle_connection(self, stream):
+        self.connections += 1
+        conn = h11.Connection(our_role=h11.SERVER)
+        chunks = []
+        while True:
+            event = conn.next_event()
+            if event is h11.NEED_DATA:
+                data = await stream.receive_some(4096)
+                if not data:
+                    return
+                conn.receive_data(data)
+            elif isinstance(event, h11.Request):
+                assert event.method == b"POST"
+                chunks = []
+            elif isinstance(event, h11.Data):
+                chunks.append(event.data)
+            elif isinstance(event, h11.EndOfMessage):
+                req = json.loads(b"".join(chunks))
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    rep = await self.handlers[req["method"]](**req["params"])
+                finally:
+                    self.in_flight -= 1
+                body = json.dumps({"jsonrpc": "2.0", "id": req["id"], **rep}).encode()
+                headers = [("Content-Type", "application/json"), ("Content-Length", str(len(body)))]
+                await stream.send_all(
+                    conn.send(h11.Response(status_code=200, headers=headers))
+                    + conn.send(h11.Data(data=body))
+                    + conn.send(h11.EndOfMessage())
+                )
+                conn.start_next_cycle()
+            else:
+                return
+
+
+@pytest.fixture
+async def tendermint_rpc():
+    rpc = FakeTendermintRPC()
+    async with trio.open_nursery() as nursery:
+        listeners = await nursery.start(trio.serve_tcp, rpc.handle_connection, 0)
+        port = listeners[0].socket.getsockname()[1]
+        rpc.addr = f"http://127.0.0.1:{port}/"
+        yield rpc
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.trio
+async def test_connection_kept_alive(tendermint_rpc):
+    async def abci_query(data):
+        value = base64.b64encode(bytes.fromhex(data)).decode()
+        return {"result": {"response": {"value": value}}}
+
+    tendermint_rpc.handlers["abci_query"] = abci_query
+    client = TendermintClient(tendermint_rpc.addr)
+    for key in ("(vlob, CoolOrg, 1)", "(vlob, CoolOrg, 2)", "a&b?c"):
+        assert await client.abci_query(key) == key.encode()
+    assert tendermint_rpc.connections == 1
+
+
+@pytest.mark.trio
+async def test_concurrent_calls_limited_by_pool(tendermint_rpc):
+    async def status():
+        await trio.sleep(0.01)
+        return {"result": {}}
+
+    tendermint_rpc.handlers["status"] = status
+    client = TendermintClient(tendermint_rpc.addr, max_connections=2)
+    async with trio.open_nursery() as nursery:
+        for _ in range(6):
+            nursery.start_soon(client.call, "status")
+    assert tendermint_rpc.max_in_flight == 2
+    assert tendermint_rpc.connections == 2
+
+
+@pytest.mark.trio
+async def test_rpc_error(tendermint_rpc):
+    async def broadcast_tx_commit(tx):
+        return {"error": {"code": -32603, "message": "Internal error"}}
+
+    tendermint_rpc.handlers["broadcast_tx_commit"] = broadcast_tx_commit
+    client = TendermintClient(tendermint_rpc.addr)
+    with pytest.raises(TendermintRPCError):
+        await client.broadcast_tx_commit(encode_tx([("foo", "bar")]))
+
+
+@pytest.mark.trio
+async def test_call_timeout(tendermint_rpc):
+    async def broadcast_tx_commit(tx):
+        await trio.sleep_forever()
+
+    async def status():
+        return {"result": {}}
+
+    tendermint_rpc.handlers["broadcast_tx_commit"] = broadcast_tx_commit
+    tendermint_rpc.handlers["status"] = status
+    client = TendermintClient(tendermint_rpc.addr, commit_timeout=0.1)
+    with pytest.raises(TendermintNotAvailable):
+        await client.broadcast_tx_commit(encode_tx([("foo", "bar")]))
+    # Timed out connection is discarded, not the client
+    assert await client.call("status") == {}
+
+
+@pytest.mark.trio
+async def test_tendermint_not_running():
+    client = TendermintClient("http://127.0.0.1:1/")
+    with pytest.raises(TendermintNotAvailable):
+        await client.call("status")
+
+
+@pytest.mark.trio
+async def test_wait_for_tx(tendermint_rpc):
+    committed = {"0xAA": {"code": 0}, "0xBB": {"code": 1, "log": "Malformed transaction"}}
+    polls = []
+
+    async def tx(hash):
+        hash = "0x" + base64.b64decode(hash).hex().upper()
+        polls.append(hash)
+        if len(polls) < 3:
+            return {"error": {"code": -32603, "data": f"tx ({hash}) not found"}}
+        return {"result": {"hash": hash, "tx_result": committed[hash]}}
+
+    tendermint_rpc.handlers["tx"] = tx
+    client = TendermintClient(tendermint_rpc.addr, poll_interval=0.01)
+    rep = await client.wait_for_tx("AA")
+    assert rep["hash"] == "0xAA"
+    assert len(polls) == 3
+
+    with pytest.raises(TendermintRPCError):
+        await client.wait_for_tx("BB")
+
+
+@pytest.mark.trio
+async def test_transaction_sent_in_body(tendermint_rpc):
+    txs = []
+
+    async def broadcast_tx_sync(tx):
+        txs.append(base64.b64decode(tx))
+        return {"result": {"code": 0, "hash": "AA"}}
+
+    tendermint_rpc.handlers["broadcast_tx_sync"] = broadcast_tx_sync
+    client = TendermintClient(tendermint_rpc.addr)
+    # Characters which used to break the query string encoding
+    items = [("(checkpoint, CoolOrg, 1)", '{"a": "b+c/d=="}'), ("k&e?y", "v'a\"l")]
+    assert (await client.broadcast_tx_sync(encode_tx(items)))["hash"] == "AA"
+    assert txs == [
+        b"\x01"
+        + b"".join(
+            len(x.encode()).to_bytes(4, "big") + x.encode() for item in items for x in item
+        )
+    ]
@@ -2,10 +2,14 @@
 
 from pathlib import Path
 
+import attr
+import trio
 import pytest
+from pendulum import datetime
 
 from parsec.core.fs.storage import UserStorage
 from parsec.core.types import LocalUserManifest, EntryID
+from parsec.core.types.local_device import LocalOperationStorage, content_digest
 
 
 @pytest.fixture
@@ -86,6 +90,55 @@ async def test_realm_checkpoint(alice, alice_user_storage, initial_user_manifest
     assert await aws.get_need_sync_entries() == ({user_manifest_id}, set())
 
 
+async def los_flushed(device):
+    # Changes are written in background
+    while device.local_operation_storage.dirty:
+        await trio.sleep(0.01)
+
+
+@pytest.mark.trio
+async def test_local_operations_persistence(tmpdir, alice):
+    vlob_id = EntryID.new()
+    timestamp = datetime(2000, 1, 2)
+    device = attr.evolve(alice, local_operation_storage=LocalOperationStorage())
+
+    async with UserStorage.run(device, tmpdir):
+        los = device.local_operation_storage
+        los.add_op(vlob_id, 1, (timestamp, 0, b"create", False))
+        los.add_op(vlob_id, 2, (timestamp, 0, b"update"))
+        await los_flushed(device)
+        los.add_op(vlob_id, 2, (None, 0, b"read", True))
+        los.add_read_content(vlob_id, 2, b"<blob v2>")
+
+    # Only the content's digest is kept
+    expected = (
+        None,
+        [(timestamp, 0, b"create", False), (timestamp, 0, b"update"), (None, 0, b"read", True)],
+        0,
+        2,
+        "0",
+        False,
+        [(2, content_digest(b"<blob v2>"))],
+    )
+    assert device.local_operation_storage.storage[vlob_id] == expected
+
+    # State is restored when the storage is reopened
+    device = attr.evolve(alice, local_operation_storage=LocalOperationStorage())
+    async with UserStorage.run(device, tmpdir):
+        los = device.local_operation_storage
+        assert dict(los.storage) == {vlob_id: expected}
+
+        los.update_epoch_device(1, {vlob_id: b"<blob v2>"}, {vlob_id: "<hash>"})
+
+    device = attr.evolve(alice, local_operation_storage=LocalOperationStorage())
+    async with UserStorage.run(device, tmpdir):
+        los = device.local_operation_storage
+        assert los.epoch == 1
+        assert dict(los.storage) == {
+            vlob_id: (content_digest(b"<blob v2>"), [], 2, 2, "<hash>", False, [])
+        }
+
+
 @pytest.mark.trio
 async def test_vacuum(alice_user_storage):
     # Should be no-op
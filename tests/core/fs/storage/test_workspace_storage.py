@@ -385,6 +385,25 @@ async def test_chunk_interface(alice_workspace_storage):
     await aws.clear_chunk(chunk.id, miss_ok=True)
 
 
+@pytest.mark.trio
+async def test_get_chunks(alice_workspace_storage):
+    aws = alice_workspace_storage
+    dirty_chunk = Chunk.new(0, 5)
+    clean_chunk = Chunk.new(5, 10).evolve_as_block(b"56789")
+    missing_chunk = Chunk.new(10, 15)
+    await aws.set_chunk(dirty_chunk.id, b"01234")
+    await aws.set_clean_block(clean_chunk.access.id, b"56789")
+
+    assert await aws.get_chunks([]) == {}
+    chunk_ids = [dirty_chunk.id, clean_chunk.id, missing_chunk.id, dirty_chunk.id]
+    assert await aws.get_chunks(chunk_ids) == {dirty_chunk.id: b"01234", clean_chunk.id: b"56789"}
+
+    # More chunks than the number of parameters allowed in a statement
+    chunks = {Chunk.new(0, 1).id: bytes([i % 256]) for i in range(1200)}
+    await aws.chunk_storage.set_chunks(chunks)
+    assert await aws.get_chunks(list(chunks)) == chunks
+
+
 @pytest.mark.trio
 async def test_file_descriptor(alice_workspace_storage):
     aws = alice_workspace_storage
@@ -523,6 +542,46 @@ async def test_garbage_collection(tmpdir, alice, workspace_id):
         assert await aws.block_storage.get_nb_blocks() == 0
 
 
+@pytest.mark.trio
+async def test_block_memory_cache(tmpdir, alice, workspace_id):
+    block_size = DEFAULT_BLOCK_SIZE
+    chunks = [Chunk.new(0, block_size).evolve_as_block(bytes([i]) * block_size) for i in range(4)]
+    data = [bytes([i]) * block_size for i in range(4)]
+
+    async with WorkspaceStorage.run(
+        alice, tmpdir, workspace_id, cache_size=3 * block_size, memory_cache_size=2 * block_size
+    ) as aws:
+        cache = aws.block_storage.memory_cache
+        await aws.set_clean_block(chunks[0].access.id, data[0])
+        await aws.set_clean_block(chunks[1].access.id, data[1])
+        assert cache.size == 2 * block_size
+        assert await aws.get_chunk(chunks[0].id) == data[0]
+
+        # The least recently used block is evicted
+        await aws.set_clean_block(chunks[2].access.id, data[2])
+        assert cache.get_many([chunk.id for chunk in chunks]) == {
+            chunks[0].id: data[0],
+            chunks[2].id: data[2],
+        }
+        assert cache.size == 2 * block_size
+
+        # Evicted blocks are read from the database and cached again
+        assert await aws.get_chunks([chunks[1].id]) == {chunks[1].id: data[1]}
+        assert cache.get(chunks[1].id) == data[1]
+
+        # Blocks removed from the database are removed from memory
+        await aws.clear_clean_block(chunks[1].access.id)
+        assert cache.get(chunks[1].id) is None
+        with pytest.raises(FSLocalMissError):
+            await aws.get_chunk(chunks[1].id)
+        await aws.set_clean_block(chunks[1].access.id, data[1])
+        await aws.block_storage.clear_old_blocks(limit=1)
+        assert cache.get(chunks[0].id) is None
+        await aws.block_storage.clear_all_blocks()
+        assert len(cache) == 0
+        assert await aws.get_chunks([chunk.id for chunk in chunks]) == {}
+
+
 @pytest.mark.trio
 async def test_storage_file_tree(alice, tmpdir, workspace_id):
     path = Path(tmpdir)
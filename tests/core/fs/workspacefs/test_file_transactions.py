@@ -1,6 +1,7 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
 import os
+import trio
 import pytest
 from pendulum import datetime
 from pathlib import Path
@@ -211,6 +212,134 @@ async def test_load_block_from_remote(alice_file_transactions, foo_txt):
     assert data == chunk1_data + chunk2_data[:4]
 
 
+async def _prepare_remote_blocks(file_transactions, foo_txt, blocks_data):
+    workspace_id = file_transactions.remote_loader.workspace_id
+    await file_transactions.remote_loader.create_realm(workspace_id)
+
+    foo_manifest = await foo_txt.get_manifest()
+    blocksize = len(blocks_data[0])
+    chunks = []
+    for i, block_data in enumerate(blocks_data):
+        chunk = Chunk.new(i * blocksize, (i + 1) * blocksize).evolve_as_block(block_data)
+        await file_transactions.remote_loader.upload_block(chunk.access, block_data)
+        await file_transactions.local_storage.clear_clean_block(chunk.access.id)
+        chunks.append(chunk)
+    foo_manifest = foo_manifest.evolve(
+        blocksize=blocksize,
+        blocks=tuple((chunk,) for chunk in chunks),
+        size=blocksize * len(chunks),
+    )
+    await foo_txt.set_manifest(foo_manifest)
+    return chunks
+
+
+@pytest.mark.trio
+async def test_read_ahead(alice_file_transactions, foo_txt):
+    file_transactions = alice_file_transactions
+    blocks_data = [bytes([i]) * 10 for i in range(6)]
+    chunks = await _prepare_remote_blocks(file_transactions, foo_txt, blocks_data)
+
+    async def is_local(chunk):
+        return await file_transactions.local_storage.is_chunk(chunk.id)
+
+    async def wait_prefetched():
+        # Blocks are decrypted in worker threads, which `wait_all_tasks_blocked`
+        # doesn't wait for
+        with trio.fail_after(1):
+            while file_transactions._read_ahead[fd].cancel_scopes:
+                await trio.sleep(0.001)
+
+    fd = foo_txt.open()
+    async with trio.open_nursery() as nursery:
+        file_transactions.prefetch_nursery = nursery
+
+        # Only the first block is downloaded by the first read
+        assert await file_transactions.fd_read(fd, 5, 0) == blocks_data[0][:5]
+        await wait_prefetched()
+        assert [await is_local(chunk) for chunk in chunks] == [True] + [False] * 5
+
+        # The window grows with the sequential reads
+        assert await file_transactions.fd_read(fd, 5, 5) == blocks_data[0][5:]
+        await wait_prefetched()
+        assert [await is_local(chunk) for chunk in chunks] == [True] * 2 + [False] * 4
+        assert await file_transactions.fd_read(fd, 10, 10) == blocks_data[1]
+        await wait_prefetched()
+        assert [await is_local(chunk) for chunk in chunks] == [True] * 4 + [False] * 2
+
+        # A seek resets the window
+        await file_transactions.local_storage.clear_clean_block(chunks[0].access.id)
+        assert await file_transactions.fd_read(fd, 10, 0) == blocks_data[0]
+        assert await file_transactions.fd_read(fd, 10, 10) == blocks_data[1]
+        await wait_prefetched()
+        assert [await is_local(chunk) for chunk in chunks] == [True] * 4 + [False] * 2
+
+        await file_transactions.fd_close(fd)
+
+
+@pytest.mark.trio
+async def test_read_ahead_cancelled_on_close(monkeypatch, alice_file_transactions, foo_txt):
+    file_transactions = alice_file_transactions
+    blocks_data = [bytes([i]) * 10 for i in range(3)]
+    chunks = await _prepare_remote_blocks(file_transactions, foo_txt, blocks_data)
+    await file_transactions.local_storage.set_clean_block(chunks[0].access.id, blocks_data[0])
+
+    fd = foo_txt.open()
+    async with trio.open_nursery() as nursery:
+        file_transactions.prefetch_nursery = nursery
+        await file_transactions.fd_read(fd, 5, 0)
+
+        # The next block never comes
+        block_read_started = trio.Event()
+
+        async def mocked_block_read(block_id):
+            block_read_started.set()
+            await trio.sleep_forever()
+
+        monkeypatch.setattr(
+            file_transactions.remote_loader.backend_cmds, "block_read", mocked_block_read
+        )
+        await file_transactions.fd_read(fd, 5, 5)
+        await block_read_started.wait()
+
+        await file_transactions.fd_close(fd)
+        # The prefetching is over, no task is left in the nursery
+        await trio.testing.wait_all_tasks_blocked()
+        assert not nursery.child_tasks
+    assert not await file_transactions.local_storage.is_chunk(chunks[1].id)
+
+
+@pytest.mark.trio
+async def test_read_ahead_unexpected_error(monkeypatch, alice_file_transactions, foo_txt):
+    file_transactions = alice_file_transactions
+    blocks_data = [bytes([i]) * 10 for i in range(3)]
+    chunks = await _prepare_remote_blocks(file_transactions, foo_txt, blocks_data)
+    await file_transactions.local_storage.set_clean_block(chunks[0].access.id, blocks_data[0])
+
+    fd = foo_txt.open()
+    async with trio.open_nursery() as nursery:
+        file_transactions.prefetch_nursery = nursery
+        await file_transactions.fd_read(fd, 5, 0)
+
+        block_read = file_transactions.remote_loader.backend_cmds.block_read
+
+        async def failing_block_read(block_id):
+            raise RuntimeError("unexpected")
+
+        monkeypatch.setattr(
+            file_transactions.remote_loader.backend_cmds, "block_read", failing_block_read
+        )
+        await file_transactions.fd_read(fd, 5, 5)
+        await trio.testing.wait_all_tasks_blocked()
+        # The error is not propagated to the nursery running the prefetching
+        assert not nursery.cancel_scope.cancel_called
+        assert not nursery.child_tasks
+
+        # The block is downloaded by the read
+        monkeypatch.setattr(file_transactions.remote_loader.backend_cmds, "block_read", block_read)
+        assert await file_transactions.fd_read(fd, 10, 10) == blocks_data[1]
+        await file_transactions.fd_close(fd)
+
+
 size = st.integers(min_value=0, max_value=4 * 1024 ** 2)  # Between 0 and 4MB
 
 
@@ -1,12 +1,13 @@
 # Parsec Cloud (https://parsec.cloud) Copyright (c) AGPLv3 2019 Scille SAS
 
+import trio
 import errno
 import pytest
 from unittest.mock import ANY
 
 from parsec.api.protocol import DeviceID, RealmRole
 from parsec.api.data import BaseManifest as BaseRemoteManifest
-from parsec.core.types import FsPath, EntryID
+from parsec.core.types import FsPath, EntryID, Chunk, ChunkID
 from parsec.core.fs.exceptions import FSError, FSBackendOfflineError
 from parsec.core.fs.workspacefs.workspacefs import ReencryptionNeed
 
@@ -438,3 +439,92 @@ async def test_get_reencryption_need(alice_workspace, running_backend, monkeypat
     with running_backend.offline():
         with pytest.raises(FSBackendOfflineError):
             await alice_workspace.get_reencryption_need()
+
+
+@pytest.mark.trio
+async def test_load_blocks_concurrently(monkeypatch, running_backend, alice_user_fs):
+    wid = await alice_user_fs.workspace_create("w")
+    workspace = alice_user_fs.get_workspace(wid)
+    remote_loader = workspace.remote_loader
+    local_storage = workspace.local_storage
+    await remote_loader.create_realm(wid)
+    accesses = []
+    blocks = []
+    for i in range(6):
+        data = f"block {i}".encode()
+        chunk = Chunk.new(0, len(data)).evolve_as_block(data)
+        await remote_loader.upload_block(chunk.access, data)
+        await local_storage.clear_clean_block(chunk.access.id)
+        accesses.append(chunk.access)
+        blocks.append(data)
+
+    vanilla_block_read = remote_loader.backend_cmds.block_read
+    in_progress = set()
+    max_in_progress = 0
+
+    async def mocked_block_read(block_id):
+        nonlocal max_in_progress
+        in_progress.add(block_id)
+        max_in_progress = max(max_in_progress, len(in_progress))
+        await trio.sleep(0.01)
+        try:
+            return await vanilla_block_read(block_id)
+        finally:
+            in_progress.remove(block_id)
+
+    monkeypatch.setattr(remote_loader.backend_cmds, "block_read", mocked_block_read)
+    monkeypatch.setattr(remote_loader, "max_concurrent_block_transfers", 2)
+
+    await remote_loader.load_blocks(accesses)
+    assert max_in_progress == 2
+    for access, data in zip(accesses, blocks):
+        assert await local_storage.get_chunk(ChunkID(access.id)) == data
+
+
+@pytest.mark.trio
+async def test_upload_blocks_concurrently(monkeypatch, running_backend, alice_user_fs):
+    wid = await alice_user_fs.workspace_create("w")
+    workspace = alice_user_fs.get_workspace(wid)
+    remote_loader = workspace.remote_loader
+    local_storage = workspace.local_storage
+    await remote_loader.create_realm(wid)
+    accesses = []
+    blocks = []
+    for i in range(6):
+        data = f"block {i}".encode()
+        chunk = Chunk.new(0, len(data)).evolve_as_block(data)
+        await local_storage.set_chunk(chunk.id, data)
+        accesses.append(chunk.access)
+        blocks.append(data)
+
+    vanilla_block_create = remote_loader.backend_cmds.block_create
+    uploaded = []
+    in_progress = set()
+    max_in_progress = 0
+
+    async def mocked_block_create(block_id, realm_id, block):
+        nonlocal max_in_progress
+        uploaded.append(block_id)
+        in_progress.add(block_id)
+        max_in_progress = max(max_in_progress, len(in_progress))
+        await trio.sleep(0.01)
+        try:
+            return await vanilla_block_create(block_id, realm_id, block)
+        finally:
+            in_progress.remove(block_id)
+
+    monkeypatch.setattr(remote_loader.backend_cmds, "block_create", mocked_block_create)
+    monkeypatch.setattr(remote_loader, "max_concurrent_block_transfers", 2)
+
+    await remote_loader.upload_blocks(accesses)
+    assert max_in_progress == 2
+    for access, data in zip(accesses, blocks):
+        # The dirty blocks are now clean
+        assert not await local_storage.chunk_storage.is_chunk(ChunkID(access.id))
+        assert await local_storage.block_storage.get_chunk(ChunkID(access.id)) == data
+        rep = await remote_loader.backend_cmds.block_read(access.id)
+        assert access.key.decrypt(rep["block"]) == data
+
+    # Nothing left to upload
+    await remote_loader.upload_blocks(accesses)
+    assert len(uploaded) == 6
@@ -5,6 +5,8 @@ else
                 export TMHOME=$HOME/.tendermint
         fi
 	rm -rf $TMHOME/*
+	# The ABCI application state must be reset along with the chain
+	rm -f ${ABCI_STATE_DB:-abci_state.db}
 	$1 init
 	sed 's/skip_timeout_commit = false/skip_timeout_commit = true/g' $TMHOME/config/config.toml > $TMHOME/config/config_tmp.toml
 	rm -rf $TMHOME/config/config.toml